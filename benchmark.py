@@ -9,7 +9,7 @@ django.setup()
 
 from django.core import management
 from django.contrib.auth import get_user_model
-from zabacus.bills.schema import CreateBill, AddBillItem, AddUserToBill
+from zabacus.bills.schema import CreateBill, AddBillItem, AddUserToBill, AddUsersToBill
 from zabacus.bills.schema import BenchmarkUpdateBillName, BenchmarkUpdateBillItemName
 from abc import ABC, abstractmethod
 import random
@@ -80,11 +80,9 @@ class CreateBillJob(Job):
                 if rand_user not in bill_users:
                     bill_users.add(rand_user)
                     break
-        for rand_user in bill_users:
-            if rand_user == self.creator_id:
-                continue
-            self.benchmark_runner.append_job(
-                AddUserToBillJob(self.creator_id, new_bill_id, username_from_id(rand_user)))
+        self.benchmark_runner.append_job(
+            AddUsersToBillJob(self.creator_id, new_bill_id,
+                              [username_from_id(u) for u in bill_users if u != self.creator_id]))
         for i in range(self.num_items):
             self.benchmark_runner.append_job(AddBillItemJob(new_bill_id, bill_users))
         self.benchmark_runner.record_user_with_bill(self.creator_id)
@@ -100,12 +98,12 @@ class UpdateBillNameJob(Job):
 
 
 class UpdateBillItemNameJob(Job):
-    def __init__(self, creator_id, bill_id, new_item_name):
+    def __init__(self, creator_id, new_item_name):
         self.creator_id = creator_id
         self.new_item_name = new_item_name
 
     def run(self):
-        BenchmarkUpdateFirstBillItemInBill().mutate(user_info_by_id(self.creator_id), self.new_item_name)
+        BenchmarkUpdateBillItemName().mutate(user_info_by_id(self.creator_id), self.new_item_name)
 
 
 class AddUserToBillJob(Job):
@@ -118,6 +116,16 @@ class AddUserToBillJob(Job):
         AddUserToBill().mutate(user_info_by_id(self.creator_id), self.bill_id, self.username)
 
 
+class AddUsersToBillJob(Job):
+    def __init__(self, creator_id, bill_id, usernames):
+        self.creator_id = creator_id
+        self.bill_id = bill_id
+        self.usernames = usernames
+
+    def run(self):
+        AddUsersToBill().mutate(user_info_by_id(self.creator_id), self.bill_id, self.usernames)
+
+
 class AddBillItemJob(Job):
     def __init__(self, bill_id, bill_users):
         self.bill_id = bill_id
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# Concurrent writers on the same bill.
+#
+# Usage: ./benchmark_concurrency.py [num_writers] [updates_per_writer]
+#
+# `lww` and `occ`: every writer repeatedly reads the bill, increments a counter kept in its description
+# and writes it back. In `lww` mode the write is a plain full-row save() (the old behavior); in `occ`
+# mode it goes through UpdateBill with the version that was read and retries on conflict. Reports
+# throughput, the conflict rate and the number of lost updates.
+# `items`: every writer adds items to the bill through AddBillItem, exercising the multi-statement
+# transaction path and its deadlock / lock-wait retries. Reports throughput and retry counts.
+#
+# Runs against a throwaway SQLite database file.
+import os
+import sys
+import tempfile
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zabacus.settings')
+django.setup()
+
+from django.conf import settings
+DB_FILE = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+# update the connection settings in place: the connection handler already holds on to this dict
+settings.DATABASES['default'].update({
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': DB_FILE,
+    'OPTIONS': {'timeout': 60},
+})
+
+from django.core import management
+from django.db import connection
+from django.contrib.auth import get_user_model
+from zabacus.bills import tasks
+from zabacus.bills.sharding import get_bill
+from zabacus.bills.schema import CreateBill, UpdateBill, AddBillItem, ConflictError
+from zabacus.bills.transactions import retry_stats
+import threading
+import time
+
+
+class BenchParams:
+    num_writers = 8
+    updates_per_writer = 200
+
+
+def user_info(user):
+    build_obj = lambda **kwargs: type("Object", (), kwargs)
+    return build_obj(context=build_obj(user=user))
+
+
+class Writer(threading.Thread):
+    def __init__(self, mode, user, bid, num_updates):
+        super().__init__()
+        self.mode = mode
+        self.user = user
+        self.bid = bid
+        self.num_updates = num_updates
+        self.conflicts = 0
+        self.failures = 0
+
+    def update_lww(self):
+        bill = get_bill(self.bid)
+        bill.desc = str(int(bill.desc) + 1)
+        bill.save()
+
+    def update_occ(self):
+        while True:
+            bill = get_bill(self.bid)
+            try:
+                UpdateBill().mutate(user_info(self.user), self.bid, desc=str(int(bill.desc) + 1),
+                                    version=bill.version)
+                return
+            except ConflictError:
+                self.conflicts += 1
+
+    def update_items(self):
+        AddBillItem().mutate(user_info(self.user), self.bid, 'item', 'desc', self.user.id, 1.0,
+                             {self.user.username: 1.0})
+
+    def run(self):
+        update = {'lww': self.update_lww, 'occ': self.update_occ, 'items': self.update_items}[self.mode]
+        for _ in range(self.num_updates):
+            try:
+                update()
+            except Exception:
+                self.failures += 1
+        connection.close()
+
+
+def run_mode(mode, user, num_writers, updates_per_writer):
+    bill = CreateBill().mutate(user_info(user), 'Contended Bill', desc='0').bill
+    retry_stats.reset()
+    writers = [Writer(mode, user, bill.id, updates_per_writer) for _ in range(num_writers)]
+    time_begin = time.time()
+    for w in writers:
+        w.start()
+    for w in writers:
+        w.join()
+    elapsed = time.time() - time_begin
+
+    expected = num_writers * updates_per_writer
+    failures = sum(w.failures for w in writers)
+    retries = sum(s['retries'] for s in retry_stats.snapshot().values())
+    if mode == 'items':
+        print('[{}] {} updates in {:.2f} s: {:.0f} updates/sec, {} transaction retries, {} failures.'.format(
+            mode, expected, elapsed, expected / elapsed, retries, failures))
+        return
+    final = int(get_bill(bill.id).desc)
+    conflicts = sum(w.conflicts for w in writers)
+    print('[{}] {} updates in {:.2f} s: {:.0f} updates/sec, {} conflicts ({:.1%} of attempts), '
+          '{} transaction retries, {} failures, {} lost updates.'.format(
+              mode, expected, elapsed, expected / elapsed, conflicts, conflicts / (expected + conflicts),
+              retries, failures, expected - failures - final))
+
+
+if __name__ == '__main__':
+    num_writers = BenchParams.num_writers
+    updates_per_writer = BenchParams.updates_per_writer
+    if len(sys.argv) >= 2:
+        num_writers = int(sys.argv[1])
+    if len(sys.argv) >= 3:
+        updates_per_writer = int(sys.argv[2])
+
+    management.call_command('migrate', verbosity=0)
+    user = get_user_model().objects.create(username='user00001')
+    connection.close()
+    for mode in ('lww', 'occ', 'items'):
+        run_mode(mode, user, num_writers, updates_per_writer)
+    # run the queued side effects of the mutations while their tables still exist (the queue's own atexit
+    # flush would run after the database is gone)
+    tasks.queue.flush()
+    connection.close()
+    os.remove(DB_FILE)
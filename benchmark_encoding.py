@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# Compare response encoders and compression on realistic GraphQL results.
+#
+# Usage: ./benchmark_encoding.py [num_bills] [num_items_per_bill] [num_iterations]
+#
+# Seeds bills, runs a `listBills` and a nested `showBill` query through the schema and times turning each
+# result into the response body num_iterations times: with the stock graphene-django encoding
+# (json.dumps), with zabacus.encoding.encode_json and, if installed, with orjson. Then reports the bytes
+# sent on the wire uncompressed, gzipped and, if installed, brotli-compressed at the configured levels.
+# Runs against a throwaway in-memory SQLite database.
+import os
+import sys
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zabacus.settings')
+django.setup()
+
+from django.conf import settings
+# update the connection settings in place: the connection handler already holds on to this dict
+settings.DATABASES['default'].update({'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'})
+
+from django.core import management
+from django.contrib.auth import get_user_model
+from zabacus import encoding
+from zabacus.bills import tasks
+from zabacus.bills.schema import CreateBill, AddBillItem, AddUsersToBill
+from zabacus.schema import schema
+import gzip
+import json
+import time
+
+# run background work inline: background threads cannot see the in-memory database
+tasks.TASK_QUEUE_SETTINGS['MODE'] = 'sync'
+
+
+class BenchParams:
+    num_bills = 20
+    num_items_per_bill = 100
+    num_iterations = 200
+    num_members = 4
+
+
+QUERIES = {
+    'listBills': 'query { listBills { id name desc date edited status itemCount totalCents memberCount '
+                 'people { username firstName lastName } } }',
+    'showBill': 'query($bid: ID) { showBill(bid: $bid) { id name desc people { username } '
+                'items { id name desc date totalCents paidBy { username } '
+                'assignments { user { username } amountCents } } '
+                'balances { user { username } paidCents owedCents balanceCents } } }',
+}
+
+
+def user_info(user):
+    build_obj = lambda **kwargs: type("Object", (), kwargs)
+    return build_obj(context=build_obj(user=user))
+
+
+def seed():
+    users = [get_user_model().objects.create(username='user{:05d}'.format(i), first_name='First{}'.format(i),
+                                             last_name='Last{}'.format(i))
+             for i in range(1, BenchParams.num_members + 1)]
+    info = user_info(users[0])
+    weights = {u.username: 1 for u in users}
+    bills = []
+    for b in range(BenchParams.num_bills):
+        bill = CreateBill().mutate(info, 'Bill {}'.format(b), desc='Shared expenses, trip #{}'.format(b)).bill
+        AddUsersToBill().mutate(info, bill.id, [u.username for u in users[1:]])
+        for i in range(BenchParams.num_items_per_bill):
+            AddBillItem().mutate(info, bill.id, 'Item {}'.format(i), 'Groceries & café', users[i % len(users)].id,
+                                 len(users), weights)
+        bills.append(bill)
+    return users[0], bills
+
+
+def stock_encode(data):
+    # what graphene_django.views.GraphQLView.json_encode does
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def encoders():
+    yield 'graphene json.dumps', stock_encode
+    yield 'encode_json', encoding.encode_json
+    if encoding.orjson is not None:
+        yield 'encode_orjson', encoding.encode_orjson
+
+
+def time_encoder(encoder, data):
+    begin = time.process_time()
+    for _ in range(BenchParams.num_iterations):
+        encoder(data)
+    return (time.process_time() - begin) / BenchParams.num_iterations
+
+
+def main():
+    if len(sys.argv) > 1:
+        BenchParams.num_bills = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        BenchParams.num_items_per_bill = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        BenchParams.num_iterations = int(sys.argv[3])
+
+    management.call_command('migrate', verbosity=0)
+    user, bills = seed()
+    context = type("Object", (), {'user': user})
+
+    print('{} bills with {} items each, {} iterations per encoder'.format(
+        BenchParams.num_bills, BenchParams.num_items_per_bill, BenchParams.num_iterations))
+    for name, query in QUERIES.items():
+        result = schema.execute(query, context_value=context, variables={'bid': str(bills[0].id)})
+        if result.errors:
+            print('{}: {}'.format(name, result.errors))
+            continue
+        data = {'data': result.data}
+        print('{}:'.format(name))
+        for encoder_name, encoder in encoders():
+            print('  {:20} {:8.3f} ms/encode'.format(encoder_name, time_encoder(encoder, data) * 1000))
+
+        content = encoding.encode(data)
+        print('  {:20} {:9d} bytes'.format('uncompressed', len(content)))
+        sizes = []
+        begin = time.process_time()
+        compressed = gzip.compress(content, encoding.RESPONSE_SETTINGS['GZIP_LEVEL'])
+        sizes.append(('gzip', len(compressed), time.process_time() - begin))
+        if encoding.brotli is not None:
+            begin = time.process_time()
+            compressed = encoding.brotli.compress(content, quality=encoding.RESPONSE_SETTINGS['BROTLI_QUALITY'])
+            sizes.append(('brotli', len(compressed), time.process_time() - begin))
+        for label, size, cpu in sizes:
+            print('  {:20} {:9d} bytes ({:5.1f}%), {:8.3f} ms to compress'.format(
+                label, size, 100 * size / len(content), cpu * 1000))
+
+
+if __name__ == '__main__':
+    main()
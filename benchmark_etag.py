@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# Measure what conditional requests (ETag / If-None-Match) save on repeated polls of unchanged bills.
+#
+# Usage: ./benchmark_etag.py [num_bills] [num_items_per_bill] [num_polls]
+#
+# Requests go through the full Django stack (middleware, JWT authentication, the GraphQL view) with the
+# test client. Each query is polled num_polls times as an unconditional request and as a conditional one
+# carrying the ETag of the first response; the report compares response bytes and CPU time per request.
+# Runs against a throwaway in-memory SQLite database.
+import os
+import sys
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zabacus.settings')
+django.setup()
+
+from django.conf import settings
+# update the connection settings in place: the connection handler already holds on to this dict
+settings.DATABASES['default'].update({'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'})
+
+from django.core import management
+from django.contrib.auth import get_user_model
+from django.test import Client
+from graphql_jwt.shortcuts import get_token
+from zabacus.bills import tasks
+from zabacus.bills.schema import CreateBill, AddBillItem, AddUsersToBill
+import json
+import time
+
+# run background work inline: background threads cannot see the in-memory database
+tasks.TASK_QUEUE_SETTINGS['MODE'] = 'sync'
+
+
+class BenchParams:
+    num_bills = 20
+    num_items_per_bill = 20
+    num_polls = 200
+    num_members = 4
+
+
+QUERIES = {
+    'listBills': 'query { listBills { id name date edited status itemCount totalCents memberCount '
+                 'people { username firstName lastName } } }',
+    'showBill': 'query($bid: ID) { showBill(bid: $bid) { id name desc people { username } '
+                'items { id name totalCents paidBy { username } assignments { user { username } amountCents } } '
+                'balances { user { username } balanceCents } } }',
+}
+
+
+def user_info(user):
+    build_obj = lambda **kwargs: type("Object", (), kwargs)
+    return build_obj(context=build_obj(user=user))
+
+
+def seed():
+    users = [get_user_model().objects.create(username='user{:05d}'.format(i))
+             for i in range(1, BenchParams.num_members + 1)]
+    info = user_info(users[0])
+    weights = {u.username: 1 for u in users}
+    bills = []
+    for b in range(BenchParams.num_bills):
+        bill = CreateBill().mutate(info, 'Bill {}'.format(b)).bill
+        AddUsersToBill().mutate(info, bill.id, [u.username for u in users[1:]])
+        for i in range(BenchParams.num_items_per_bill):
+            AddBillItem().mutate(info, bill.id, 'Item {}'.format(i), 'Benchmark item', users[i % len(users)].id,
+                                 len(users), weights)
+        bills.append(bill)
+    return users[0], bills
+
+
+def poll(client, body, headers, num_polls):
+    total_bytes = 0
+    statuses = set()
+    begin = time.process_time()
+    for _ in range(num_polls):
+        response = client.post('/graphql/', body, content_type='application/json', **headers)
+        total_bytes += len(response.content)
+        statuses.add(response.status_code)
+    return (time.process_time() - begin) / num_polls, total_bytes / num_polls, statuses
+
+
+def main():
+    if len(sys.argv) > 1:
+        BenchParams.num_bills = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        BenchParams.num_items_per_bill = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        BenchParams.num_polls = int(sys.argv[3])
+
+    management.call_command('migrate', verbosity=0)
+    user, bills = seed()
+    client = Client(HTTP_HOST='localhost', HTTP_AUTHORIZATION='JWT {}'.format(get_token(user)))
+
+    print('{} bills with {} items each, {} polls per query'.format(
+        BenchParams.num_bills, BenchParams.num_items_per_bill, BenchParams.num_polls))
+    for name, query in QUERIES.items():
+        body = json.dumps({'query': query, 'variables': {'bid': str(bills[0].id)}})
+        first = client.post('/graphql/', body, content_type='application/json')
+        etag = first.get('ETag')
+        if etag is None:
+            print('{}: no ETag issued'.format(name))
+            continue
+        full_cpu, full_bytes, _ = poll(client, body, {}, BenchParams.num_polls)
+        cond_cpu, cond_bytes, statuses = poll(client, body, {'HTTP_IF_NONE_MATCH': etag}, BenchParams.num_polls)
+        print('{}:'.format(name))
+        print('  unconditional: {:8.3f} ms CPU/request, {:9.0f} bytes/response'.format(full_cpu * 1000, full_bytes))
+        print('  If-None-Match: {:8.3f} ms CPU/request, {:9.0f} bytes/response (status {})'.format(
+            cond_cpu * 1000, cond_bytes, ', '.join(str(s) for s in sorted(statuses))))
+        print('  saved: {:.1f}% CPU, {:.1f}% bytes'.format(
+            100 * (1 - cond_cpu / full_cpu), 100 * (1 - cond_bytes / full_bytes)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# Cost of the membership check behind every bill query, on each cache backend.
+#
+# Usage: ./benchmark_membership.py [num_bills] [num_requests]
+#
+# A user shares `num_bills` bills with friends and asks for the payers of one of them after the other,
+# through the whole HTTP stack (JWT authentication, replica routing, the GraphQL view). The cache holds
+# their membership set in `file` mode (FileBasedCache, as in development; a shared in-memory cache such as
+# memcached behaves the same) and is a table of the database in `database` mode (DatabaseCache, as in
+# deployment), where membership is checked in the query fetching the bill instead. Reports wall time and
+# SQL queries per request, and how many of the queries went to the cache table. Runs against a throwaway
+# in-memory SQLite database, so a query costs far less than a round trip to a database server.
+import os
+import sys
+import tempfile
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zabacus.settings')
+django.setup()
+
+from django.conf import settings
+# update the connection settings in place: the connection handler already holds on to this dict
+settings.DATABASES['default'].update({'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'})
+
+from django.core import management
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment
+from django.contrib.auth import get_user_model
+from graphql_jwt.shortcuts import get_token
+from zabacus.bills import tasks
+from zabacus.bills.schema import CreateBill, AddUsersToBill
+import json
+import time
+
+# run on-commit work inline: background threads cannot see the in-memory database
+tasks.TASK_QUEUE_SETTINGS['MODE'] = 'sync'
+
+CACHE_TABLE = 'zabacus_benchmark_cache'
+
+BACKENDS = {
+    'file': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+             'LOCATION': tempfile.mkdtemp(prefix='zabacus-benchmark-cache-')},
+    'database': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': CACHE_TABLE},
+}
+
+PAYERS_QUERY = 'query($bid: ID!) { billPayers(bid: $bid) { paidCents } }'
+
+
+class BenchParams:
+    num_bills = 50
+    num_requests = 500
+
+
+def user_info(user):
+    build_obj = lambda **kwargs: type("Object", (), kwargs)
+    return build_obj(context=build_obj(user=user))
+
+
+def seed(num_bills):
+    users = [get_user_model().objects.create(username='user{:05d}'.format(i)) for i in range(1, 5)]
+    info = user_info(users[0])
+    bids = []
+    for n in range(num_bills):
+        bill = CreateBill().mutate(info, 'Bill {}'.format(n)).bill
+        AddUsersToBill().mutate(info, bill.id, [u.username for u in users[1:]])
+        bids.append(str(bill.id))
+    return users[0], bids
+
+
+# (seconds, queries, queries on the cache table) per request asking for the payers of each of `bids` in turn
+def measure(client, token, bids, num_requests):
+    def request(n):
+        response = client.post('/graphql/', json.dumps({'query': PAYERS_QUERY, 'variables': {'bid': bids[n % len(bids)]}}),
+                               content_type='application/json', HTTP_AUTHORIZATION='JWT {}'.format(token))
+        if 'errors' in json.loads(response.content.decode()):
+            raise RuntimeError(response.content.decode())
+
+    # warm the cache
+    for n in range(len(bids)):
+        request(n)
+    with CaptureQueriesContext(connection) as queries:
+        begin = time.perf_counter()
+        for n in range(num_requests):
+            request(n)
+        seconds = time.perf_counter() - begin
+    cache_queries = sum(CACHE_TABLE in q['sql'] for q in queries)
+    return seconds / num_requests, len(queries) / num_requests, cache_queries / num_requests
+
+
+def main():
+    if len(sys.argv) > 1:
+        BenchParams.num_bills = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        BenchParams.num_requests = int(sys.argv[2])
+
+    setup_test_environment()
+    management.call_command('migrate', verbosity=0)
+    user, bids = seed(BenchParams.num_bills)
+    token = get_token(user)
+
+    print('{} bills, {} requests per backend'.format(BenchParams.num_bills, BenchParams.num_requests))
+    for mode, backend in BACKENDS.items():
+        with override_settings(CACHES={'default': backend}):
+            if mode == 'database':
+                management.call_command('createcachetable', verbosity=0)
+            seconds, queries, cache_queries = measure(Client(), token, bids, BenchParams.num_requests)
+        print('{:8}: {:7.3f} ms/request, {:.1f} queries/request ({:.1f} on the cache table)'.format(
+            mode, seconds * 1000, queries, cache_queries))
+
+
+if __name__ == '__main__':
+    main()
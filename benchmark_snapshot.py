@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# Compare the CPU cost of serving a whole bill through the nested `showBill` resolvers with serving its
+# precomputed `billSnapshot`.
+#
+# Usage: ./benchmark_snapshot.py [num_items] [num_members] [num_requests]
+#
+# Both queries go through the real GraphQL executor and fetch the same data (members, items with their
+# payers and weight assignments, balances). CPU time is process time per request; the benchmark runs
+# against a throwaway in-memory SQLite database, so it includes the work of the database itself.
+import os
+import sys
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zabacus.settings')
+django.setup()
+
+from django.conf import settings
+# update the connection settings in place: the connection handler already holds on to this dict
+settings.DATABASES['default'].update({'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'})
+
+from django.core import management
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+from zabacus.bills import snapshots, tasks
+from zabacus.bills.schema import CreateBill, AddBillItem, AddUsersToBill
+from zabacus.schema import schema
+import time
+
+# render snapshots inline: background threads cannot see the in-memory database
+tasks.TASK_QUEUE_SETTINGS['MODE'] = 'sync'
+
+
+class BenchParams:
+    num_items = 200
+    num_members = 10
+    num_requests = 200
+
+
+SHOW_BILL_QUERY = '''
+query($bid: ID) {
+  showBill(bid: $bid) {
+    id name desc date edited status version archived
+    createdBy { username }
+    people { username }
+    items {
+      id name desc date edited totalCents version
+      createdBy { username }
+      paidBy { username }
+      assignments { user { username } amountCents }
+    }
+    balances { user { username } paidCents owedCents balanceCents }
+  }
+}
+'''
+
+SNAPSHOT_QUERY = 'query($bid: ID!) { billSnapshot(bid: $bid) }'
+
+
+def user_info(user):
+    build_obj = lambda **kwargs: type("Object", (), kwargs)
+    return build_obj(context=build_obj(user=user))
+
+
+def seed(num_items, num_members):
+    users = [get_user_model().objects.create(username='user{:05d}'.format(i)) for i in range(1, num_members + 1)]
+    info = user_info(users[0])
+    bill = CreateBill().mutate(info, 'Benchmark Bill').bill
+    AddUsersToBill().mutate(info, bill.id, [u.username for u in users[1:]])
+    weights = {u.username: 1 for u in users}
+    for i in range(num_items):
+        AddBillItem().mutate(info, bill.id, 'Item {}'.format(i), 'Benchmark item', users[i % num_members].id,
+                             num_members, weights)
+    return users[0], bill
+
+
+def measure(query, user, bid, num_requests):
+    context = user_info(user).context
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        result = schema.execute(query, variable_values={'bid': bid}, context_value=context)
+    if result.errors:
+        raise result.errors[0]
+    begin = time.process_time()
+    for _ in range(num_requests):
+        schema.execute(query, variable_values={'bid': bid}, context_value=context)
+    return (time.process_time() - begin) / num_requests, len(queries)
+
+
+def main():
+    if len(sys.argv) > 1:
+        BenchParams.num_items = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        BenchParams.num_members = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        BenchParams.num_requests = int(sys.argv[3])
+
+    management.call_command('migrate', verbosity=0)
+    user, bill = seed(BenchParams.num_items, BenchParams.num_members)
+    bid = str(bill.id)
+
+    begin = time.process_time()
+    snapshots.render(bill)
+    render_time = time.process_time() - begin
+
+    nested_time, nested_queries = measure(SHOW_BILL_QUERY, user, bid, BenchParams.num_requests)
+    snapshot_time, snapshot_queries = measure(SNAPSHOT_QUERY, user, bid, BenchParams.num_requests)
+
+    print('Bill with {} items, {} members; {} requests each'.format(
+        BenchParams.num_items, BenchParams.num_members, BenchParams.num_requests))
+    print('Snapshot render: {:.2f} ms CPU'.format(render_time * 1000))
+    print('showBill (nested):  {:8.3f} ms CPU/request, {} queries'.format(nested_time * 1000, nested_queries))
+    print('billSnapshot:       {:8.3f} ms CPU/request, {} queries'.format(snapshot_time * 1000, snapshot_queries))
+    print('Speedup: {:.1f}x'.format(nested_time / snapshot_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# Start-up cost and memory of server workers, with and without preloading the application.
+#
+# Usage: ./benchmark_startup.py [num_workers]
+#
+# Without preloading (`gunicorn` without `--preload`), every forked worker imports and initializes the
+# application itself. With preloading, the master does it once (see zabacus/startup.py) and then forks the
+# workers. Both are reproduced here with os.fork: the report gives the time spent setting Django up,
+# building the GraphQL schema and warming up the rest, and for each worker its resident set size and the
+# part of it that is private to the worker (the rest is shared with the master), measured before the worker
+# serves anything: serving requests unshares some more pages. Linux only (reads /proc).
+import json
+import os
+import sys
+import time
+
+
+class BenchParams:
+    num_workers = 3
+
+
+PHASES = ('django.setup', 'schema build', 'warm-up')
+
+
+# {'rss': resident set size, 'private': pages not shared with other processes} in KiB, of this process
+def memory():
+    usage = {'rss': 0, 'private': 0}
+    path = '/proc/self/smaps_rollup' if os.path.exists('/proc/self/smaps_rollup') else '/proc/self/smaps'
+    with open(path) as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key == 'Rss':
+                usage['rss'] += int(value.split()[0])
+            elif key in ('Private_Clean', 'Private_Dirty'):
+                usage['private'] += int(value.split()[0])
+    return usage
+
+
+# Seconds spent in each start-up phase
+def start():
+    timings = []
+    begin = time.perf_counter()
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zabacus.settings')
+    import django
+    django.setup()
+    timings.append(time.perf_counter() - begin)
+
+    begin = time.perf_counter()
+    import zabacus.schema  # noqa: F401
+    timings.append(time.perf_counter() - begin)
+
+    begin = time.perf_counter()
+    from zabacus import startup
+    startup.warm_up()
+    timings.append(time.perf_counter() - begin)
+    return timings
+
+
+# Fork a worker running `fn()` and return the JSON-able result it reports back
+def fork(fn):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        with os.fdopen(write_fd, 'w') as f:
+            json.dump(fn(), f)
+        os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        result = json.load(f)
+    os.waitpid(pid, 0)
+    return result
+
+
+def report(title, timings, workers):
+    print(title)
+    for phase, seconds in zip(PHASES, timings):
+        print('  {:14} {:8.1f} ms'.format(phase, seconds * 1000))
+    for i, usage in enumerate(workers, 1):
+        print('  worker {}: {:8d} KiB RSS, {:8d} KiB private'.format(i, usage['rss'], usage['private']))
+    print('  total private: {:8d} KiB'.format(sum(usage['private'] for usage in workers)))
+
+
+def main():
+    if len(sys.argv) > 1:
+        BenchParams.num_workers = int(sys.argv[1])
+
+    # nothing of the application is imported yet: each worker starts it on its own
+    results = [fork(lambda: {'timings': start(), 'memory': memory()}) for _ in range(BenchParams.num_workers)]
+    timings = [sum(r['timings'][i] for r in results) / len(results) for i in range(len(PHASES))]
+    report('without --preload (start-up time per worker):', timings, [r['memory'] for r in results])
+
+    timings = start()
+    master = memory()
+    workers = [fork(memory) for _ in range(BenchParams.num_workers)]
+    report('with --preload (start-up time in the master, {} KiB RSS):'.format(master['rss']), timings, workers)
+
+
+if __name__ == '__main__':
+    main()
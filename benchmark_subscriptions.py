@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# Measure fan-out latency of bill change events to many `billUpdated` subscribers.
+#
+# Usage: ./benchmark_subscriptions.py [num_subscribers] [num_events]
+#
+# Subscriptions go through the real GraphQL executor and the configured pub/sub backend; delivery is
+# timed from the moment a mutation publishes an event until the subscriber's event loop (as in the
+# ASGI transport) receives the rendered result. Runs against a throwaway in-memory SQLite database.
+import os
+import sys
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zabacus.settings')
+django.setup()
+
+from django.conf import settings
+# update the connection settings in place: the connection handler already holds on to this dict
+settings.DATABASES['default'].update({'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'})
+
+from django.core import management
+from django.contrib.auth import get_user_model
+from zabacus.bills import pubsub
+from zabacus.bills.schema import CreateBill
+from zabacus.schema import schema
+import asyncio
+import threading
+import time
+
+
+class BenchParams:
+    num_subscribers = 1000
+    num_events = 100
+    # Pause between published events, in seconds
+    publish_interval = 0.001
+
+
+def user_info(user):
+    build_obj = lambda **kwargs: type("Object", (), kwargs)
+    return build_obj(context=build_obj(user=user))
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+class SubscriptionBenchmark:
+    def __init__(self, num_subscribers, num_events):
+        self.num_subscribers = num_subscribers
+        self.num_events = num_events
+        self.loop = asyncio.new_event_loop()
+        self.published_at = {}
+        self.latencies = []
+        self.done = threading.Event()
+
+    def receive(self, event_id):
+        # runs on the event loop thread
+        self.latencies.append(time.perf_counter() - self.published_at[event_id])
+        if len(self.latencies) == self.num_subscribers * self.num_events:
+            self.done.set()
+
+    def subscribe_all(self, user, bid):
+        query = 'subscription($bid: ID!) { billUpdated(bid: $bid) { bid kind id } }'
+        for _ in range(self.num_subscribers):
+            observable = schema.execute(query, variable_values={'bid': bid}, context_value=user_info(user).context,
+                                        allow_subscriptions=True)
+            observable.subscribe(lambda r: self.loop.call_soon_threadsafe(
+                self.receive, int(r.data['billUpdated']['id'])))
+
+    def run(self):
+        management.call_command('migrate', verbosity=0)
+        user = get_user_model().objects.create(username='user00001')
+        bill = CreateBill().mutate(user_info(user), 'Benchmark Bill').bill
+
+        loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        loop_thread.start()
+
+        time_begin = time.time()
+        self.subscribe_all(user, str(bill.id))
+        subscribe_time = time.time() - time_begin
+
+        publish_times = []
+        time_begin = time.time()
+        for i in range(self.num_events):
+            self.published_at[i] = time.perf_counter()
+            pubsub.publish_bill_event(bill, 'benchmark', i)
+            publish_times.append(time.perf_counter() - self.published_at[i])
+            time.sleep(BenchParams.publish_interval)
+        self.done.wait()
+        elapsed = time.time() - time_begin
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+        latencies = sorted(self.latencies)
+        publish_times.sort()
+        deliveries = len(latencies)
+        print('Subscribers: {}, events: {}, deliveries: {}.'.format(self.num_subscribers, self.num_events, deliveries))
+        print('Subscribe time: {0:.3f} s ({1:.3f} ms/subscriber).'.format(
+            subscribe_time, 1000 * subscribe_time / self.num_subscribers))
+        print('Publish call (request path): p50 {0:.3f} ms, p99 {1:.3f} ms.'.format(
+            1000 * percentile(publish_times, 50), 1000 * percentile(publish_times, 99)))
+        print('Delivery latency: p50 {0:.3f} ms, p99 {1:.3f} ms, max {2:.3f} ms.'.format(
+            1000 * percentile(latencies, 50), 1000 * percentile(latencies, 99), 1000 * latencies[-1]))
+        print('Throughput: {0:.0f} deliveries/sec.'.format(deliveries / elapsed))
+
+
+if __name__ == '__main__':
+    num_subscribers = BenchParams.num_subscribers
+    num_events = BenchParams.num_events
+    if len(sys.argv) >= 2:
+        num_subscribers = int(sys.argv[1])
+    if len(sys.argv) >= 3:
+        num_events = int(sys.argv[2])
+
+    SubscriptionBenchmark(num_subscribers, num_events).run()
@@ -1,3 +1,3 @@
 #!/bin/bash
-gunicorn --access-logfile - --workers 3 --bind unix:/var/run/zabacus-api/gunicorn.sock zabacus.wsgi:application
+gunicorn --access-logfile - --preload --workers 3 --bind unix:/var/run/zabacus-api/gunicorn.sock zabacus.wsgi:application
 
@@ -0,0 +1,41 @@
+"""
+ASGI config for zabacus project.
+
+It exposes the ASGI callable as a module-level variable named ``application``. HTTP requests are
+served by the regular Django WSGI application (run in a thread pool) and WebSocket connections to
+``/graphql/`` carry GraphQL subscriptions, so mutations and subscribers share the in-process pub/sub.
+
+Run it with any ASGI server, e.g. ``uvicorn zabacus.asgi:application``.
+"""
+
+import os
+
+from asgiref.wsgi import WsgiToAsgi
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zabacus.settings')
+
+http_application = WsgiToAsgi(get_wsgi_application())
+
+from zabacus import startup  # noqa: E402 (needs Django set up)
+from zabacus.subscriptions import graphql_ws_app  # noqa: E402 (needs Django set up)
+
+startup.warm_up()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http':
+        await http_application(scope, receive, send)
+    elif scope['type'] == 'websocket' and scope['path'].rstrip('/') == '/graphql':
+        await graphql_ws_app(scope, receive, send)
+    elif scope['type'] == 'websocket':
+        await receive()
+        await send({'type': 'websocket.close', 'code': 1000})
+    elif scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
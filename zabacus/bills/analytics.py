@@ -0,0 +1,156 @@
+from collections import defaultdict
+import numpy as np
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDay, TruncWeek, TruncMonth, TruncYear
+from zabacus import caching
+from zabacus.bills import sharding
+from zabacus.bills.models import ArchivedShare, ArchivedSpending, BillItem, ItemWeightAssignment
+
+# Spending analytics over bill items and weight assignments.
+#
+# All grouping happens in SQL (one aggregated query per measure and shard; the per-shard groups are then
+# added up); NumPy is only used to post-process the already grouped series (rolling windows) and the
+# user's per-item shares (percentiles). Archived bills are covered by the per-member totals written when
+# they were archived (ArchivedSpending per day, ArchivedShare per share amount, see archive.py).
+# Results are cached per user in the shared cache; every cached entry is keyed on a per-user version token
+# that item mutations replace through `invalidate_analytics` as soon as they commit.
+
+PERIODS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+    'year': TruncYear,
+}
+
+# Non-time groupings: (field on ItemWeightAssignment, field on BillItem, field on ArchivedSpending)
+GROUPINGS = {
+    'bill': ('item__bill', 'bill', 'bill'),
+    'status': ('item__bill__status', 'bill__status', 'bill__status'),
+}
+
+PERCENTILES = (50, 90, 99)
+
+CACHE_TIMEOUT = 60 * 60
+
+
+_cache = caching.VersionedCache('analytics', CACHE_TIMEOUT)
+
+
+def _cached(uid, name, compute):
+    return _cache.get_or_compute(uid, name, compute)
+
+
+# Drop cached analytics of every user in `uids` (call after a mutation touching their items)
+def invalidate_analytics(uids):
+    _cache.bump(uids)
+
+
+# (bucket of an ItemWeightAssignment, of a BillItem, of an ArchivedSpending row) for `group_by`
+def _bucket_exprs(group_by):
+    if group_by in PERIODS:
+        trunc = PERIODS[group_by]
+        return trunc('item__date'), trunc('date'), trunc('day')
+    if group_by in GROUPINGS:
+        return tuple(F(field) for field in GROUPINGS[group_by])
+    raise ValueError('Unknown grouping: {}'.format(group_by))
+
+
+def _archived_spending(db, user, group_by):
+    _, _, bucket = _bucket_exprs(group_by)
+    summaries = ArchivedSpending.objects.using(db).filter(user=user, bill__people=user) \
+        .annotate(bucket=bucket).values('bucket') \
+        .annotate(owed=Sum('owed_cents'), owed_count=Sum('owed_count'), paid=Sum('paid_cents'),
+                  paid_count=Sum('paid_count')).order_by()
+    owed = []
+    paid = []
+    for r in summaries:
+        if r['owed_count']:
+            owed.append({'bucket': r['bucket'], 'owed_cents': r['owed'], 'item_count': r['owed_count']})
+        if r['paid_count']:
+            paid.append({'bucket': r['bucket'], 'paid_cents': r['paid']})
+    shares = list(ArchivedShare.objects.using(db).filter(user=user, bill__people=user)
+                  .values_list('amount_cents', 'count'))
+    amounts, counts = zip(*shares) if shares else ((), ())
+    return owed, paid, np.repeat(np.asarray(amounts, dtype=np.int64), counts).tolist()
+
+
+def _rolling_mean(values, window):
+    # trailing mean over the last `window` buckets (fewer at the start of the series)
+    values = np.asarray(values, dtype=np.float64)
+    csum = np.concatenate(([0.0], np.cumsum(values)))
+    end = np.arange(1, len(values) + 1)
+    start = np.maximum(end - max(window, 1), 0)
+    return (csum[end] - csum[start]) / (end - start)
+
+
+def _shard_spending(db, user, group_by):
+    owed_bucket, paid_bucket, _ = _bucket_exprs(group_by)
+    owed = ItemWeightAssignment.objects.using(db).filter(user=user) \
+        .annotate(bucket=owed_bucket).values('bucket') \
+        .annotate(owed_cents=Sum('amount_cents'), item_count=Count('id')).order_by()
+    paid = BillItem.objects.using(db).filter(paid_by=user) \
+        .annotate(bucket=paid_bucket).values('bucket') \
+        .annotate(paid_cents=Sum('total_cents')).order_by()
+    shares = ItemWeightAssignment.objects.using(db).filter(user=user).values_list('amount_cents', flat=True)
+    archived_owed, archived_paid, archived_shares = _archived_spending(db, user, group_by)
+    return list(owed) + archived_owed, list(paid) + archived_paid, list(shares) + archived_shares
+
+
+def _compute_user_spending(user, group_by, window):
+    _bucket_exprs(group_by)  # fail on an unknown grouping even for users without bills
+    per_shard = sharding.fan_out(lambda db, ids: _shard_spending(db, user, group_by), sharding.user_shards(user))
+
+    buckets = {}
+    for owed, paid, _ in per_shard:
+        for row in owed:
+            bucket = buckets.setdefault(row['bucket'], {'owed_cents': 0, 'item_count': 0, 'paid_cents': 0})
+            bucket['owed_cents'] += row['owed_cents']
+            bucket['item_count'] += row['item_count']
+        for row in paid:
+            bucket = buckets.setdefault(row['bucket'], {'owed_cents': 0, 'item_count': 0, 'paid_cents': 0})
+            bucket['paid_cents'] += row['paid_cents']
+
+    keys = sorted(buckets)
+    rolling = _rolling_mean([buckets[k]['owed_cents'] for k in keys], window)
+    rows = []
+    for k, r in zip(keys, rolling):
+        row = dict(buckets[k], rolling_owed_cents=float(r))
+        row['key'] = k.date().isoformat() if hasattr(k, 'date') else str(k)
+        rows.append(row)
+
+    shares = np.fromiter((a for _, _, amounts in per_shard for a in amounts), dtype=np.int64)
+    if len(shares):
+        percentiles = dict(zip(PERCENTILES, np.percentile(shares, PERCENTILES).tolist()))
+    else:
+        percentiles = {}
+    return {'buckets': rows, 'percentiles': percentiles}
+
+
+# The current user's spending grouped by `group_by` (a period in PERIODS, 'bill' or 'status'),
+# with a trailing rolling mean of the owed amount over `window` buckets and share percentiles.
+def user_spending(user, group_by='month', window=3):
+    return _cached(user.id, 'spending:{}:{}'.format(group_by, window),
+                   lambda: _compute_user_spending(user, group_by, window))
+
+
+def _compute_bill_payers(bill):
+    paid = bill.items.values('paid_by') \
+        .annotate(paid_cents=Sum('total_cents'), item_count=Count('id')).order_by('-paid_cents')
+    paid = [{'uid': r['paid_by'], 'paid_cents': r['paid_cents'], 'item_count': r['item_count']} for r in paid]
+    if not bill.archived:
+        return paid
+    # items added since the bill was archived are in the hot tables
+    totals = defaultdict(lambda: [0, 0])
+    for r in paid:
+        totals[r['uid']] = [r['paid_cents'], r['item_count']]
+    for uid, cents, count in ArchivedSpending.objects.using(bill._state.db).filter(bill=bill, paid_count__gt=0) \
+            .values_list('user').annotate(Sum('paid_cents'), Sum('paid_count')).order_by():
+        totals[uid][0] += cents
+        totals[uid][1] += count
+    return [{'uid': uid, 'paid_cents': p, 'item_count': n}
+            for uid, (p, n) in sorted(totals.items(), key=lambda r: -r[1][0])]
+
+
+# Users of `bill` ordered by how much they paid, as seen by `user`
+def bill_payers(user, bill):
+    return _cached(user.id, 'payers:{}'.format(bill.id), lambda: _compute_bill_payers(bill))
@@ -1,5 +1,20 @@
 from django.apps import AppConfig
+from django.core.signals import request_finished, request_started
+from django.db.models.signals import post_migrate
+
+
+def _ensure_id_ranges(sender, using, **kwargs):
+    from zabacus.bills import sharding
+    sharding.ensure_id_ranges(using)
 
 
 class BillsConfig(AppConfig):
-    name = 'bills'
+    name = 'zabacus.bills'
+    label = 'bills'
+
+    def ready(self):
+        from zabacus.bills import sharding
+        post_migrate.connect(_ensure_id_ranges, sender=self)
+        # scope of the memoized membership sets
+        request_started.connect(sharding.begin_request)
+        request_finished.connect(sharding.end_request)
@@ -0,0 +1,203 @@
+import json
+import zlib
+from collections import Counter, defaultdict
+from datetime import datetime, time
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+import django.utils.timezone as tz
+from zabacus.bills import sharding
+from zabacus.bills.models import ArchivedShare, ArchivedSpending, Bill, BillArchive, BillItem, BillStatus, \
+    ItemWeightAssignment
+
+# Archival of settled bills.
+#
+# The items and weight assignments of a settled bill that has not been edited for a while are moved out of
+# the hot item and assignment tables into one BillArchive row per bill (zlib-compressed JSON, next to the
+# bill on its shard). Per-member totals of the archived items (ArchivedSpending, ArchivedShare) are written
+# alongside, for analytics to sum in SQL without decoding archives. The bill row itself stays, flagged
+# `archived`, so memberships, listings and sync cursors are unaffected. Readers of a bill's items go
+# through `items_of`, which rehydrates the archive into unsaved model instances, together with any item
+# added to the bill since it was archived (those stay in the hot tables). Archived items cannot be edited
+# or deleted until the bill is reopened, which `restore`s them into the hot tables.
+
+ARCHIVE_BATCH_SIZE = 100
+
+ITEM_FIELDS = ('id', 'name', 'desc', 'date', 'edited', 'created_by_id', 'paid_by_id', 'total_cents', 'version')
+DATE_FIELDS = ('date', 'edited')
+
+
+def _encode(items):
+    return zlib.compress(json.dumps(items, separators=(',', ':')).encode())
+
+
+def _decode(data):
+    items = json.loads(zlib.decompress(bytes(data)).decode())
+    for item in items:
+        for f in DATE_FIELDS:
+            item[f] = parse_datetime(item[f])
+    return items
+
+
+# Local midnight of the day of `moment`
+def local_day(moment):
+    return tz.make_aware(datetime.combine(tz.localtime(moment).date(), time()))
+
+
+# (ArchivedSpending rows, ArchivedShare rows) summing up the items of bill `bid`, dicts of ITEM_FIELDS with
+# `assignments` as stored in its archive
+def summarize(bid, items):
+    spending = defaultdict(lambda: ArchivedSpending(bill_id=bid))
+    shares = Counter()
+    for item in items:
+        day = local_day(item['date'])
+        row = spending[item['paid_by_id'], day]
+        row.paid_cents += item['total_cents']
+        row.paid_count += 1
+        for _, uid, amount in item['assignments']:
+            row = spending[uid, day]
+            row.owed_cents += amount
+            row.owed_count += 1
+            shares[uid, amount] += 1
+    for (uid, day), row in spending.items():
+        row.user_id, row.day = uid, day
+    return (list(spending.values()),
+            [ArchivedShare(bill_id=bid, user_id=uid, amount_cents=amount, count=n) for (uid, amount), n in shares.items()])
+
+
+# Archive (up to `limit` of) the settled bills on shard `db` last edited before `cutoff` with ids above
+# `after_id`, in one transaction. Returns (ids of the archived bills, number of archived items).
+def archive_batch(db, cutoff, after_id=0, limit=ARCHIVE_BATCH_SIZE):
+    with transaction.atomic(using=db):
+        bill_ids = list(
+            Bill.objects.using(db).select_for_update()
+            .filter(status=BillStatus.STL.name, archived=False, edited__lt=cutoff, id__gt=after_id)
+            .order_by('id').values_list('id', flat=True)[:limit]
+        )
+        if not bill_ids:
+            return [], 0
+        # the locking read keeps new items out of these bills until the batch commits
+        items = list(
+            BillItem.objects.using(db).select_for_update().filter(bill_id__in=bill_ids).order_by('id')
+            .values('bill_id', *ITEM_FIELDS)
+        )
+        assignments = defaultdict(list)
+        for aid, iid, uid, amount in ItemWeightAssignment.objects.using(db) \
+                .filter(item__bill_id__in=bill_ids).order_by('id') \
+                .values_list('id', 'item_id', 'user_id', 'amount_cents'):
+            assignments[iid].append([aid, uid, amount])
+        by_bill = defaultdict(list)
+        for item in items:
+            record = {f: item[f] for f in ITEM_FIELDS}
+            record['assignments'] = assignments[item['id']]
+            by_bill[item['bill_id']].append(record)
+
+        spending = []
+        shares = []
+        for bid, records in by_bill.items():
+            bill_spending, bill_shares = summarize(bid, records)
+            spending.extend(bill_spending)
+            shares.extend(bill_shares)
+            for record in records:
+                for f in DATE_FIELDS:
+                    record[f] = record[f].isoformat()
+        now = tz.now()
+        BillArchive.objects.using(db).bulk_create(
+            [BillArchive(bill_id=bid, data=_encode(by_bill[bid]), archived=now) for bid in bill_ids]
+        )
+        ArchivedSpending.objects.using(db).bulk_create(spending)
+        ArchivedShare.objects.using(db).bulk_create(shares)
+        ItemWeightAssignment.objects.using(db).filter(item__bill_id__in=bill_ids).delete()
+        BillItem.objects.using(db).filter(bill_id__in=bill_ids).delete()
+        Bill.objects.using(db).filter(id__in=bill_ids).update(archived=True)
+    return bill_ids, len(items)
+
+
+# {bill id: archived items as dicts of ITEM_FIELDS plus `assignments`, [[id, user id, amount cents]]}
+def load_archives(db, bill_ids):
+    return {bid: _decode(data) for bid, data in
+            BillArchive.objects.using(db).filter(bill_id__in=bill_ids).values_list('bill_id', 'data')}
+
+
+def _rehydrate(bill):
+    try:
+        data = BillArchive.objects.using(bill._state.db).values_list('data', flat=True).get(bill_id=bill.id)
+    except BillArchive.DoesNotExist:
+        # restored in the meantime
+        return []
+    items = []
+    for record in _decode(data):
+        assignments = record.pop('assignments')
+        item = BillItem(bill=bill, **record)
+        item._state.adding = False
+        item._state.db = bill._state.db
+        # hand the assignments to `item.assignments.all()` the way prefetch_related would
+        cached = item.assignments.all()
+        cached._result_cache = [
+            ItemWeightAssignment(id=aid, item=item, user_id=uid, amount_cents=amount) for aid, uid, amount in assignments
+        ]
+        cached._prefetch_done = True
+        item._prefetched_objects_cache = {'assignments': cached}
+        items.append(item)
+    return items
+
+
+# Rehydrated archived items of `bill` (none unless it is archived), decoded once per bill instance
+def archived_items(bill):
+    if not bill.archived:
+        return []
+    if not hasattr(bill, '_archived_items'):
+        bill._archived_items = _rehydrate(bill)
+    return bill._archived_items
+
+
+# Items of `bill`: a queryset for a bill in the hot tables, a list of rehydrated and hot items for an
+# archived one. Either way `item.assignments.all()` gives each item's assignments.
+def items_of(bill):
+    if not bill.archived:
+        return bill.items.all()
+    return archived_items(bill) + list(bill.items.all())
+
+
+# Bill.balances() for a bill that may be archived
+def balances(bill):
+    if not bill.archived:
+        return bill.balances()
+    paid = defaultdict(int)
+    owed = defaultdict(int)
+    for item in items_of(bill):
+        paid[item.paid_by_id] += item.total_cents
+        for a in item.assignments.all():
+            owed[a.user_id] += a.amount_cents
+    return {uid: (paid[uid], owed[uid], paid[uid] - owed[uid]) for uid in set(paid) | set(owed)}
+
+
+# Whether user `uid` has a share in any item of `bill`
+def has_shares(bill, uid):
+    if ItemWeightAssignment.objects.using(bill._state.db).filter(item__bill=bill, user_id=uid).exists():
+        return True
+    return any(a.user_id == uid for i in archived_items(bill) for a in i.assignments.all())
+
+
+# Move the archived items of `bill` back into the hot tables, keeping their ids
+def restore(bill):
+    if not bill.archived:
+        return
+    db = sharding.shard_of(bill)
+    items = []
+    assignments = []
+    record = BillArchive.objects.using(db).select_for_update().filter(bill_id=bill.id).first()
+    if record is not None:
+        for item in _decode(record.data):
+            assignments.extend(
+                ItemWeightAssignment(id=aid, item_id=item['id'], user_id=uid, amount_cents=amount)
+                for aid, uid, amount in item.pop('assignments')
+            )
+            items.append(BillItem(bill_id=bill.id, **item))
+        BillItem.objects.using(db).bulk_create(items)
+        ItemWeightAssignment.objects.using(db).bulk_create(assignments)
+        ArchivedSpending.objects.using(db).filter(bill_id=bill.id).delete()
+        ArchivedShare.objects.using(db).filter(bill_id=bill.id).delete()
+        record.delete()
+    Bill.objects.using(db).filter(id=bill.id).update(archived=False)
+    bill.archived = False
+    bill.__dict__.pop('_archived_items', None)
@@ -0,0 +1,112 @@
+import functools
+import hashlib
+import json
+from graphql.language import ast
+from graphql.language.parser import parse
+from zabacus.bills import sharding
+from zabacus.bills.models import Bill
+
+# ETags for GraphQL queries that read bills (served conditionally by zabacus.views.GraphQLView).
+#
+# The ETag of a query hashes the document, operation name, variables and user, and the ids and change
+# stamps of the bills the query can see: the bill named by the `bid` argument of single-bill fields, every
+# bill of the user for the others. Change stamps are the bills' `version`, `edited` and `archived`
+# columns: every mutation of a bill, its items or its members bumps `edited` (see `bill_changed`), and so
+# do profile edits of its members. They are read with one query per shard from the database the query
+# itself would read (a replica, unless the user is pinned to the primary), so the ETag always describes
+# the state the response would be computed from, and a poll that finds nothing changed is answered
+# without executing anything else. Operations with any other root field get no ETag.
+
+# Root fields that only depend on the user's bills: {field name: whether it reads the single bill `bid`}
+CONDITIONAL_FIELDS = {
+    'showBill': True,
+    'billSnapshot': True,
+    'billPayers': True,
+    'listBills': False,
+    'mySpending': False,
+}
+
+
+def _argument(node):
+    if isinstance(node, ast.Variable):
+        return 'variable', node.name.value
+    if isinstance(node, (ast.StringValue, ast.IntValue)):
+        return 'value', node.value
+    return None
+
+
+# {operation name: (operation type, [(root field, `bid` argument)] or None if some root field is not
+# in CONDITIONAL_FIELDS)}, for the GraphQL document `query`
+@functools.lru_cache(maxsize=256)
+def _operations(query):
+    try:
+        document = parse(query)
+    except Exception:
+        return {}
+    operations = {}
+    for definition in document.definitions:
+        if not isinstance(definition, ast.OperationDefinition):
+            continue
+        fields = []
+        for selection in definition.selection_set.selections:
+            if not isinstance(selection, ast.Field) or selection.name.value not in CONDITIONAL_FIELDS:
+                fields = None
+                break
+            bid = next((a.value for a in selection.arguments or [] if a.name.value == 'bid'), None)
+            fields.append((selection.name.value, _argument(bid)))
+        operations[definition.name.value if definition.name else None] = (definition.operation, fields)
+    return operations
+
+
+def _operation(query, operation_name):
+    operations = _operations(query)
+    if operation_name:
+        return operations.get(operation_name)
+    return next(iter(operations.values())) if len(operations) == 1 else None
+
+
+# Type ('query', 'mutation' or 'subscription') of the operation `operation_name` of the GraphQL document
+# `query`, None if there is no such operation
+def operation_type(query, operation_name=None):
+    operation = _operation(query, operation_name) if query else None
+    return operation[0] if operation is not None else None
+
+
+# [[id, version, edited, archived]] of the bills `bids`, sorted by id
+def _stamps(bids):
+    results = sharding.fan_out(
+        lambda db, ids: list(Bill.objects.using(db).filter(id__in=ids).values_list('id', 'version', 'edited', 'archived')),
+        sharding.bills_by_read_db(bids)
+    )
+    return sorted([bid, version, edited.isoformat(), archived] for rows in results for bid, version, edited, archived in rows)
+
+
+# ETag of the GraphQL query `query` run by `user`, or None if it cannot be served conditionally
+def query_etag(user, query, variables, operation_name):
+    if not query or user is None or user.is_anonymous:
+        return None
+    operation = _operation(query, operation_name)
+    if operation is None or operation[0] != 'query' or not operation[1]:
+        return None
+
+    member_of = sharding.bill_ids(user)
+    bids = set()
+    for name, argument in operation[1]:
+        if not CONDITIONAL_FIELDS[name]:
+            bids |= member_of
+            continue
+        if argument is None:
+            return None
+        kind, value = argument
+        if kind == 'variable':
+            value = (variables or {}).get(value)
+        try:
+            bid = int(value)
+        except (TypeError, ValueError):
+            return None
+        if bid in member_of:
+            bids.add(bid)
+
+    digest = hashlib.sha1(query.encode())
+    digest.update(json.dumps([operation_name, variables, user.id, _stamps(bids)], sort_keys=True).encode())
+    return 'W/"{}"'.format(digest.hexdigest())
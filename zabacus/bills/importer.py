@@ -0,0 +1,139 @@
+import csv
+import json
+from django.db import transaction
+import django.utils.timezone as tz
+from django.utils.html import escape
+from zabacus.bills import sharding
+from zabacus.bills.models import BillItem, ItemWeightAssignment, parse_cents
+
+# Bulk import of bill items from CSV or JSON lines.
+#
+# Every row describes one item: `name`, `desc`, `payer` (username), `total` and `weights` (an object
+# mapping usernames to amounts; a JSON string in CSV files). Rows are parsed lazily, validated against
+# the bill's membership (loaded once) and inserted in chunks of bulk inserts. The whole import runs
+# in one transaction and is rolled back if any row is invalid, so it can be fixed and re-run.
+
+IMPORT_CHUNK_SIZE = 500
+
+CSV_FIELDS = ('name', 'desc', 'payer', 'total', 'weights')
+
+
+class RowError(Exception):
+    pass
+
+
+def parse_csv(stream):
+    for row in csv.DictReader(stream):
+        try:
+            row['weights'] = json.loads(row.get('weights') or '')
+        except ValueError:
+            row['weights'] = None
+        yield row
+
+
+def parse_ndjson(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield row if isinstance(row, dict) else {}
+
+
+PARSERS = {
+    'csv': parse_csv,
+    'ndjson': parse_ndjson,
+}
+
+
+def parse_rows(stream, fmt):
+    try:
+        return PARSERS[fmt](stream)
+    except KeyError:
+        raise ValueError('Unknown import format: {}'.format(fmt))
+
+
+def _money(value):
+    try:
+        return parse_cents(value)
+    except ValueError:
+        raise RowError('invalid amount')
+
+
+# Validate a parsed row; return (name, desc, payer id, total cents, [(user id, amount cents)])
+def validate_row(row, members):
+    name = row.get('name')
+    if not isinstance(name, str) or not name:
+        raise RowError('missing name')
+    desc = row.get('desc') or ''
+    if not isinstance(desc, str):
+        raise RowError('invalid description')
+    if row.get('payer') not in members:
+        raise RowError('payer not involved')
+    total_cents = _money(row.get('total'))
+    weights = row.get('weights')
+    if not isinstance(weights, dict) or not weights:
+        raise RowError('invalid weight assignment')
+    assignments = []
+    for username, amount in weights.items():
+        if username not in members:
+            raise RowError('user {} not involved'.format(username))
+        assignments.append((members[username], _money(amount)))
+    if sum(a for _, a in assignments) != total_cents:
+        raise RowError('weight assignment sum mismatch')
+    return escape(name), escape(desc), members[row['payer']], total_cents, assignments
+
+
+def _insert_chunk(bill, user, stamp, chunk, last_id):
+    db = sharding.shard_of(bill)
+    BillItem.objects.using(db).bulk_create([
+        BillItem(name=name, desc=desc, date=stamp, edited=stamp, created_by=user,
+                 paid_by_id=payer, bill=bill, total_cents=total)
+        for name, desc, payer, total, _ in chunk
+    ])
+    # not every backend returns primary keys from bulk_create: the rows of this import all carry the
+    # same `edited` stamp and come back in insertion order
+    new_ids = list(
+        BillItem.objects.using(db).filter(bill=bill, edited=stamp, id__gt=last_id).order_by('id').values_list('id', flat=True)
+    )
+    ItemWeightAssignment.objects.using(db).bulk_create([
+        ItemWeightAssignment(item_id=iid, user_id=uid, amount_cents=amount)
+        for iid, (_, _, _, _, assignments) in zip(new_ids, chunk)
+        for uid, amount in assignments
+    ])
+    bill.adjust_counters(items=len(chunk), total_cents=sum(total for _, _, _, total, _ in chunk))
+    return new_ids[-1]
+
+
+# Import all `rows` into `bill` on behalf of `user`. Returns (number of imported items, errors), where
+# errors is a list of (row number, message); nothing is imported unless errors is empty.
+def import_items(bill, user, rows, chunk_size=IMPORT_CHUNK_SIZE):
+    members = dict(sharding.members(bill).values_list('username', 'id'))
+    stamp = tz.localtime(tz.now())
+    errors = []
+    imported = 0
+    last_id = 0
+    chunk = []
+    with transaction.atomic(using=sharding.shard_of(bill)):
+        for row_no, row in enumerate(rows, 1):
+            try:
+                chunk.append(validate_row(row, members))
+            except RowError as e:
+                errors.append((row_no, str(e)))
+            if errors:
+                # keep validating to report every bad row, but stop writing
+                chunk = []
+            elif len(chunk) >= chunk_size:
+                last_id = _insert_chunk(bill, user, stamp, chunk, last_id)
+                imported += len(chunk)
+                chunk = []
+        if chunk and not errors:
+            _insert_chunk(bill, user, stamp, chunk, last_id)
+            imported += len(chunk)
+        if errors:
+            transaction.set_rollback(True)
+            imported = 0
+    return imported, errors
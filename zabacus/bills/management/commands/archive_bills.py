@@ -0,0 +1,36 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+import django.utils.timezone as tz
+from zabacus.bills import archive, sharding
+
+
+class Command(BaseCommand):
+    help = 'Move the items of settled bills not edited for a while out of the hot tables into per-bill archives.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='Archive settled bills last edited this long ago')
+        parser.add_argument('--batch-size', type=int, default=archive.ARCHIVE_BATCH_SIZE,
+                            help='Bills archived per transaction')
+        parser.add_argument('--limit', type=int, help='Stop after archiving this many bills')
+
+    def handle(self, *args, **options):
+        if options['days'] < 0 or options['batch_size'] < 1:
+            raise CommandError('--days must not be negative and --batch-size must be positive.')
+        cutoff = tz.now() - timedelta(days=options['days'])
+        remaining = options['limit']
+        total_bills = total_items = 0
+        for db in sharding.shards():
+            last_id = 0
+            while remaining is None or remaining > 0:
+                size = options['batch_size'] if remaining is None else min(options['batch_size'], remaining)
+                bill_ids, num_items = archive.archive_batch(db, cutoff, last_id, size)
+                if not bill_ids:
+                    break
+                last_id = bill_ids[-1]
+                total_bills += len(bill_ids)
+                total_items += num_items
+                if remaining is not None:
+                    remaining -= len(bill_ids)
+                if options['verbosity'] >= 2:
+                    self.stdout.write('[{}] archived {} bill(s) up to id {}.'.format(db, len(bill_ids), last_id))
+        self.stdout.write('Archived {} bill(s) with {} item(s).'.format(total_bills, total_items))
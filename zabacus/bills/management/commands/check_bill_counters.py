@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Sum
+from zabacus.bills import archive, sharding
+from zabacus.bills.models import Bill, BillItem, Involvement
+
+COUNTERS = ('item_count', 'total_cents', 'member_count')
+
+
+# {bill id: {counter: actual value}} for the bills `bill_ids` on shard `db`, of which `archived_ids` are archived
+def actual_counters(db, bill_ids, archived_ids):
+    counters = {bid: dict.fromkeys(COUNTERS, 0) for bid in bill_ids}
+    for bid, count, total in BillItem.objects.using(db).filter(bill_id__in=bill_ids).values_list('bill_id') \
+            .annotate(Count('id'), Sum('total_cents')).order_by():
+        counters[bid]['item_count'] += count
+        counters[bid]['total_cents'] += total
+    for bid, items in archive.load_archives(db, archived_ids).items():
+        counters[bid]['item_count'] += len(items)
+        counters[bid]['total_cents'] += sum(i['total_cents'] for i in items)
+    for bid, count in Involvement.objects.using(db).filter(bill_id__in=bill_ids).values_list('bill_id') \
+            .annotate(Count('id')).order_by():
+        counters[bid]['member_count'] = count
+    return counters
+
+
+class Command(BaseCommand):
+    help = 'Verify the item count, total and member count stored on every bill, and optionally repair them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', help='Overwrite wrong counters with the actual values')
+        parser.add_argument('--batch-size', type=int, default=500, help='Bills checked per transaction')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+        checked = wrong = 0
+        for db in sharding.shards():
+            last_id = 0
+            while True:
+                # repairs lock the bills of the batch, so that mutations adjusting their counters in the
+                # meantime apply on top of the repaired values
+                with transaction.atomic(using=db):
+                    bills = Bill.objects.using(db).filter(id__gt=last_id).order_by('id')
+                    if options['repair']:
+                        bills = bills.select_for_update()
+                    bills = list(bills.values('id', 'archived', *COUNTERS)[:options['batch_size']])
+                    if not bills:
+                        break
+                    last_id = bills[-1]['id']
+                    actual = actual_counters(db, [b['id'] for b in bills], [b['id'] for b in bills if b['archived']])
+                    for b in bills:
+                        values = actual[b['id']]
+                        if all(b[f] == values[f] for f in COUNTERS):
+                            continue
+                        wrong += 1
+                        self.stdout.write('Bill {}: {}.'.format(b['id'], ', '.join(
+                            '{} {} (stored {})'.format(f, values[f], b[f]) for f in COUNTERS if b[f] != values[f])))
+                        if options['repair']:
+                            Bill.objects.using(db).filter(id=b['id']).update(**values)
+                checked += len(bills)
+        self.stdout.write('Checked {} bill(s), {} with wrong counters{}.'.format(
+            checked, wrong, ' (repaired)' if options['repair'] and wrong else ''))
+        if wrong and not options['repair']:
+            raise CommandError('Run with --repair to fix the counters.')
@@ -0,0 +1,50 @@
+import sys
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+from zabacus.bills import importer, sharding
+from zabacus.bills.schema import bill_changed, items_changed
+from zabacus.bills.transactions import atomic_on
+
+
+class Command(BaseCommand):
+    help = 'Import bill items from a CSV or JSON lines file into an existing bill.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('bid', type=int, help='ID of the bill to import into')
+        parser.add_argument('username', help='User the items are created by; must be involved in the bill')
+        parser.add_argument('file', help='CSV or JSON lines file, "-" for standard input')
+        parser.add_argument('--format', choices=sorted(importer.PARSERS), default='csv')
+        parser.add_argument('--chunk-size', type=int, default=importer.IMPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['username'])
+        except get_user_model().DoesNotExist:
+            raise CommandError('User does not exist.')
+        try:
+            bill = sharding.get_user_bill(user, options['bid'])
+        except ObjectDoesNotExist:
+            raise CommandError('Bill not found.')
+
+        # the items and everything derived from them (edited stamp, search index...) commit together
+        with atomic_on([sharding.shard_of(bill)]):
+            if options['file'] == '-':
+                imported, errors = self._import(bill, user, sys.stdin, options)
+            else:
+                with open(options['file'], newline='') as stream:
+                    imported, errors = self._import(bill, user, stream, options)
+            if imported:
+                items_changed(bill)
+                bill_changed(bill, 'items_imported')
+
+        for row, message in errors:
+            self.stderr.write('Row {}: {}'.format(row, message))
+        if errors:
+            raise CommandError('{} invalid row(s), nothing imported.'.format(len(errors)))
+        self.stdout.write('Imported {} item(s) into bill {}.'.format(imported, bill.id))
+
+    @staticmethod
+    def _import(bill, user, stream, options):
+        rows = importer.parse_rows(stream, options['format'])
+        return importer.import_items(bill, user, rows, chunk_size=options['chunk_size'])
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from zabacus.bills import search, sharding
+from zabacus.bills.models import Bill, SearchEntry
+
+
+class Command(BaseCommand):
+    help = 'Rewrite the full-text search index entries of every bill (or of the given bills).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('bill_ids', nargs='*', type=int, help='Only these bills')
+        parser.add_argument('--batch-size', type=int, default=200, help='Bills reindexed per transaction')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+        batch_size = options['batch_size']
+        indexed = 0
+        if options['bill_ids']:
+            by_db = {}
+            for bid in options['bill_ids']:
+                by_db.setdefault(sharding.shard_for(bid), []).append(bid)
+            for db, bids in by_db.items():
+                for start in range(0, len(bids), batch_size):
+                    search.reindex_bills(db, bids[start:start + batch_size])
+                indexed += len(bids)
+            self.stdout.write('Reindexed {} bill(s).'.format(indexed))
+            return
+        for db in sharding.shards():
+            last_id = 0
+            while True:
+                bids = list(Bill.objects.using(db).filter(id__gt=last_id).order_by('id')
+                            .values_list('id', flat=True)[:batch_size])
+                if not bids:
+                    break
+                search.reindex_bills(db, bids)
+                indexed += len(bids)
+                last_id = bids[-1]
+            # entries of bills deleted while their reindex was pending
+            SearchEntry.objects.using(db).exclude(bill_id__in=Bill.objects.using(db).values('id')).delete()
+        self.stdout.write('Reindexed {} bill(s).'.format(indexed))
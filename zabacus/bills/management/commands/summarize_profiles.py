@@ -0,0 +1,90 @@
+import io
+import os
+import pstats
+from collections import Counter, defaultdict
+from django.core.management.base import BaseCommand, CommandError
+from zabacus import profiling
+
+
+# Merged stack counts of the collapsed-stack files `paths`
+def merge_collapsed(paths):
+    stacks = Counter()
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack:
+                    stacks[stack] += int(count)
+    return stacks
+
+
+class Command(BaseCommand):
+    help = 'Merge the profiles written by profiled GraphQL requests per operation and print the hot spots.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', default=profiling.PROFILING_SETTINGS['DIRECTORY'],
+                            help='Directory holding the profiles')
+        parser.add_argument('--operation', action='append', help='Only this operation (repeatable)')
+        parser.add_argument('--limit', type=int, default=20, help='Functions shown per operation')
+        parser.add_argument('--sort', default='cumulative', help='Sort order of cProfile stats (pstats keys)')
+        parser.add_argument('--output', help='Also write the merged profiles (<operation>.collapsed / .prof) here')
+        parser.add_argument('--delete', action='store_true', help='Delete the profiles once merged')
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options['directory']):
+            raise CommandError('No profiles in {}.'.format(options['directory']))
+        # {(operation, extension): [path]}
+        files = defaultdict(list)
+        for name in sorted(os.listdir(options['directory'])):
+            operation, _, extension = name.partition('.')
+            extension = extension.rpartition('.')[2]
+            if extension not in profiling.MODES.values():
+                continue
+            if options['operation'] and operation not in options['operation']:
+                continue
+            files[operation, extension].append(os.path.join(options['directory'], name))
+        if not files:
+            self.stdout.write('No profiles found.')
+            return
+        if options['output']:
+            os.makedirs(options['output'], exist_ok=True)
+
+        for (operation, extension), paths in sorted(files.items()):
+            self.stdout.write('{} ({} profile(s), {})'.format(operation, len(paths), extension))
+            output = os.path.join(options['output'], '{}.{}'.format(operation, extension)) \
+                if options['output'] else None
+            if extension == 'prof':
+                report = io.StringIO()
+                stats = pstats.Stats(*paths, stream=report)
+                stats.sort_stats(options['sort']).print_stats(options['limit'])
+                self.stdout.write(report.getvalue())
+                if output:
+                    stats.dump_stats(output)
+            else:
+                stacks = merge_collapsed(paths)
+                self.summarize_stacks(stacks, options['limit'])
+                if output:
+                    with open(output, 'w') as f:
+                        for stack, count in stacks.most_common():
+                            f.write('{} {}\n'.format(stack, count))
+            if options['delete']:
+                for path in paths:
+                    os.remove(path)
+
+    def summarize_stacks(self, stacks, limit):
+        total = sum(stacks.values())
+        if not total:
+            self.stdout.write('  no samples (operations shorter than the sampling interval)')
+            return
+        own = Counter()
+        inclusive = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        self.stdout.write('  {} samples'.format(total))
+        for title, counts in (('self', own), ('total', inclusive)):
+            self.stdout.write('  by {} time:'.format(title))
+            for frame, count in counts.most_common(limit):
+                self.stdout.write('  {:6.1f}% {:7d}  {}'.format(100 * count / total, count, frame))
@@ -0,0 +1,116 @@
+# Generated by Django 2.2.13 on 2026-10-19 21:05
+#
+# 0001-0011 squashed by hand: the schema as of 0011, for databases that have none of them applied (new
+# installs and new bill shards). The replaced migrations created foreign keys to auth_user that 0011 only
+# dropped afterwards, which fails on a shard, where auth_user does not exist; here the user foreign keys of
+# the sharded models never have a constraint and ids are 64-bit from the start. Their data migrations are
+# left out, as there is no data to convert on a database that has none of them applied.
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    replaces = [
+        ('bills', '0001_initial'),
+        ('bills', '0002_auto_20181001_2332'),
+        ('bills', '0003_auto_20181001_1941'),
+        ('bills', '0004_auto_20181001_2037'),
+        ('bills', '0005_auto_20181002_0000'),
+        ('bills', '0006_bill_desc'),
+        ('bills', '0007_involvement_unique'),
+        ('bills', '0008_money_cents'),
+        ('bills', '0009_sync_tracking'),
+        ('bills', '0010_version_columns'),
+        ('bills', '0011_sharding'),
+    ]
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Bill',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255)),
+                ('date', models.DateTimeField()),
+                ('edited', models.DateTimeField(db_index=True)),
+                ('status', models.CharField(choices=[('OPN', 'open'), ('STL', 'settled'), ('DIS', 'dispute')], max_length=32)),
+                ('created_by', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='created', to=settings.AUTH_USER_MODEL)),
+                ('desc', models.TextField(default='No description.')),
+                ('version', models.PositiveIntegerField(default=1)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BillItem',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255)),
+                ('desc', models.TextField()),
+                ('date', models.DateTimeField()),
+                ('edited', models.DateTimeField(db_index=True)),
+                ('bill', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='bills.Bill')),
+                ('created_by', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='created_items', to=settings.AUTH_USER_MODEL)),
+                ('paid_by', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='paid_items', to=settings.AUTH_USER_MODEL)),
+                ('total_cents', models.BigIntegerField()),
+                ('version', models.PositiveIntegerField(default=1)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Involvement',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('bill', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='bills.Bill')),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('joined', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'unique_together': {('bill', 'user')},
+            },
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='people',
+            field=models.ManyToManyField(related_name='involved', through='bills.Involvement', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='ItemWeightAssignment',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='assignments', to='bills.BillItem')),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('amount_cents', models.BigIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('bill', 'bill'), ('item', 'item')], max_length=16)),
+                ('object_id', models.BigIntegerField()),
+                ('deleted', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tombstones', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'index_together': {('user', 'deleted')},
+            },
+        ),
+        migrations.CreateModel(
+            name='InvolvementDirectory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bill_id', models.BigIntegerField(db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bill_directory', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'bill_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.13 on 2026-10-19 17:41
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+# Keep one Involvement row per (bill, user), the oldest, so that the unique constraint can be added
+def remove_duplicates(apps, schema_editor):
+    Involvement = apps.get_model('bills', 'Involvement')
+    db = schema_editor.connection.alias
+    duplicates = Involvement.objects.using(db).values('bill_id', 'user_id') \
+        .annotate(keep=Min('id'), rows=Count('id')).filter(rows__gt=1).order_by()
+    for d in duplicates:
+        Involvement.objects.using(db).filter(bill_id=d['bill_id'], user_id=d['user_id']) \
+            .exclude(id=d['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('bills', '0006_bill_desc'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop, hints={'model_name': 'involvement'}),
+        migrations.AlterUniqueTogether(
+            name='involvement',
+            unique_together={('bill', 'user')},
+        ),
+    ]
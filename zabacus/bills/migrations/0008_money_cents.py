@@ -0,0 +1,66 @@
+from django.db import migrations, models
+from django.db.models import ExpressionWrapper, F, FloatField, Sum
+from django.db.models.functions import Cast, Round
+
+
+def to_cents(apps, schema_editor):
+    BillItem = apps.get_model('bills', 'BillItem')
+    ItemWeightAssignment = apps.get_model('bills', 'ItemWeightAssignment')
+    BillItem.objects.update(total_cents=Cast(Round(F('total') * 100), models.BigIntegerField()))
+    ItemWeightAssignment.objects.update(amount_cents=Cast(Round(F('amount') * 100), models.BigIntegerField()))
+    # the total and each share are rounded on their own, so the shares of an item may now be a few cents
+    # off its total: the difference goes to the largest share
+    unbalanced = BillItem.objects.annotate(assigned_cents=Sum('assignments__amount_cents')) \
+        .exclude(assigned_cents=None).exclude(assigned_cents=F('total_cents'))
+    for item_id, total_cents, assigned_cents in unbalanced.values_list('id', 'total_cents', 'assigned_cents'):
+        share = ItemWeightAssignment.objects.filter(item_id=item_id).order_by('-amount_cents', 'id')[0]
+        ItemWeightAssignment.objects.filter(id=share.id) \
+            .update(amount_cents=F('amount_cents') + total_cents - assigned_cents)
+
+
+def from_cents(apps, schema_editor):
+    BillItem = apps.get_model('bills', 'BillItem')
+    ItemWeightAssignment = apps.get_model('bills', 'ItemWeightAssignment')
+    BillItem.objects.update(total=ExpressionWrapper(F('total_cents') / 100.0, output_field=FloatField()))
+    ItemWeightAssignment.objects.update(amount=ExpressionWrapper(F('amount_cents') / 100.0, output_field=FloatField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bills', '0007_involvement_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='billitem',
+            name='total_cents',
+            field=models.BigIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='itemweightassignment',
+            name='amount_cents',
+            field=models.BigIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='billitem',
+            name='total',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AlterField(
+            model_name='itemweightassignment',
+            name='amount',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.RunPython(to_cents, from_cents),
+        migrations.RemoveField(
+            model_name='billitem',
+            name='total',
+        ),
+        migrations.RemoveField(
+            model_name='itemweightassignment',
+            name='amount',
+        ),
+    ]
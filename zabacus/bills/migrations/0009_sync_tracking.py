@@ -0,0 +1,45 @@
+# Generated by Django 2.2.13 on 2026-10-19 17:46
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('bills', '0008_money_cents'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='involvement',
+            name='joined',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='bill',
+            name='edited',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='billitem',
+            name='edited',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('bill', 'bill'), ('item', 'item')], max_length=16)),
+                ('object_id', models.IntegerField()),
+                ('deleted', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tombstones', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'index_together': {('user', 'deleted')},
+            },
+        ),
+    ]
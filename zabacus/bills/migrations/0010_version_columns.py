@@ -0,0 +1,23 @@
+# Generated by Django 2.2.13 on 2026-10-19 17:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bills', '0009_sync_tracking'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='billitem',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
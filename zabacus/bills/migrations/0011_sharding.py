@@ -0,0 +1,89 @@
+# Generated by Django 2.2.13 on 2026-10-19 18:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Existing bills all live on `default`, which is the first shard
+def fill_directory(apps, schema_editor):
+    db = schema_editor.connection.alias
+    Involvement = apps.get_model('bills', 'Involvement')
+    InvolvementDirectory = apps.get_model('bills', 'InvolvementDirectory')
+    InvolvementDirectory.objects.using(db).bulk_create([
+        InvolvementDirectory(user_id=uid, bill_id=bid)
+        for uid, bid in Involvement.objects.using(db).values_list('user_id', 'bill_id').iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('bills', '0010_version_columns'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bill',
+            name='created_by',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='created', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='bill',
+            name='id',
+            field=models.BigAutoField(primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='billitem',
+            name='created_by',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='created_items', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='billitem',
+            name='id',
+            field=models.BigAutoField(primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='billitem',
+            name='paid_by',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='paid_items', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='involvement',
+            name='id',
+            field=models.BigAutoField(primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='involvement',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='itemweightassignment',
+            name='id',
+            field=models.BigAutoField(primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='itemweightassignment',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='tombstone',
+            name='object_id',
+            field=models.BigIntegerField(),
+        ),
+        migrations.CreateModel(
+            name='InvolvementDirectory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bill_id', models.BigIntegerField(db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bill_directory', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'bill_id')},
+            },
+        ),
+        migrations.RunPython(fill_directory, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.13 on 2026-10-19 18:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bills', '0011_sharding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillArchive',
+            fields=[
+                ('bill', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archive', serialize=False, to='bills.Bill')),
+                ('data', models.BinaryField()),
+                ('archived', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='archived',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 2.2.13 on 2026-10-19 18:15
+
+import json
+import zlib
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def fill_counters(apps, schema_editor):
+    db = schema_editor.connection.alias
+    Bill = apps.get_model('bills', 'Bill')
+    BillItem = apps.get_model('bills', 'BillItem')
+    BillArchive = apps.get_model('bills', 'BillArchive')
+    Involvement = apps.get_model('bills', 'Involvement')
+    counters = {}
+    for bid, count, total in BillItem.objects.using(db).values_list('bill_id') \
+            .annotate(Count('id'), Sum('total_cents')).order_by():
+        counters.setdefault(bid, {})['item_count'] = count
+        counters[bid]['total_cents'] = total
+    for bid, data in BillArchive.objects.using(db).values_list('bill_id', 'data').iterator():
+        items = json.loads(zlib.decompress(bytes(data)).decode())
+        entry = counters.setdefault(bid, {})
+        entry['item_count'] = entry.get('item_count', 0) + len(items)
+        entry['total_cents'] = entry.get('total_cents', 0) + sum(i['total_cents'] for i in items)
+    for bid, count in Involvement.objects.using(db).values_list('bill_id').annotate(Count('id')).order_by():
+        counters.setdefault(bid, {})['member_count'] = count
+    for bid, values in counters.items():
+        Bill.objects.using(db).filter(id=bid).update(**values)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bills', '0012_bill_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='member_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='total_cents',
+            field=models.BigIntegerField(default=0),
+        ),
+        # bills live on every shard, not only on default
+        migrations.RunPython(fill_counters, migrations.RunPython.noop, hints={'model_name': 'bill'}),
+    ]
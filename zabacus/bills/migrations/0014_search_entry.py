@@ -0,0 +1,80 @@
+# Generated by Django 2.2.13 on 2026-10-19 19:20
+
+import json
+import zlib
+from django.db import migrations, models
+
+SQLITE_INDEX = [
+    # external content table: the text stays in bills_searchentry, FTS5 only keeps the index
+    "CREATE VIRTUAL TABLE bills_searchentry_fts USING fts5(text, content='bills_searchentry', content_rowid='id')",
+    "CREATE TRIGGER bills_searchentry_ai AFTER INSERT ON bills_searchentry BEGIN "
+    "INSERT INTO bills_searchentry_fts (rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER bills_searchentry_ad AFTER DELETE ON bills_searchentry BEGIN "
+    "INSERT INTO bills_searchentry_fts (bills_searchentry_fts, rowid, text) VALUES ('delete', old.id, old.text); END",
+    "CREATE TRIGGER bills_searchentry_au AFTER UPDATE ON bills_searchentry BEGIN "
+    "INSERT INTO bills_searchentry_fts (bills_searchentry_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+    "INSERT INTO bills_searchentry_fts (rowid, text) VALUES (new.id, new.text); END",
+]
+SQLITE_DROP = [
+    'DROP TRIGGER bills_searchentry_au',
+    'DROP TRIGGER bills_searchentry_ad',
+    'DROP TRIGGER bills_searchentry_ai',
+    'DROP TABLE bills_searchentry_fts',
+]
+MYSQL_INDEX = ['ALTER TABLE bills_searchentry ADD FULLTEXT INDEX bills_searchentry_text (text)']
+MYSQL_DROP = ['ALTER TABLE bills_searchentry DROP INDEX bills_searchentry_text']
+
+
+def _execute(schema_editor, statements):
+    for sql in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def create_index(apps, schema_editor):
+    _execute(schema_editor, {'sqlite': SQLITE_INDEX, 'mysql': MYSQL_INDEX})
+
+
+def drop_index(apps, schema_editor):
+    _execute(schema_editor, {'sqlite': SQLITE_DROP, 'mysql': MYSQL_DROP})
+
+
+def fill_index(apps, schema_editor):
+    db = schema_editor.connection.alias
+    Bill = apps.get_model('bills', 'Bill')
+    BillItem = apps.get_model('bills', 'BillItem')
+    BillArchive = apps.get_model('bills', 'BillArchive')
+    SearchEntry = apps.get_model('bills', 'SearchEntry')
+    SearchEntry.objects.using(db).bulk_create(
+        SearchEntry(bill_id=bid, text='{}\n{}'.format(name, desc))
+        for bid, name, desc in Bill.objects.using(db).values_list('id', 'name', 'desc').iterator()
+    )
+    SearchEntry.objects.using(db).bulk_create(
+        SearchEntry(bill_id=bid, item_id=iid, text='{}\n{}'.format(name, desc))
+        for bid, iid, name, desc in BillItem.objects.using(db).values_list('bill_id', 'id', 'name', 'desc').iterator()
+    )
+    for bid, data in BillArchive.objects.using(db).values_list('bill_id', 'data').iterator():
+        items = json.loads(zlib.decompress(bytes(data)).decode())
+        SearchEntry.objects.using(db).bulk_create(
+            SearchEntry(bill_id=bid, item_id=i['id'], text='{}\n{}'.format(i['name'], i['desc'])) for i in items
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bills', '0013_bill_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('bill_id', models.BigIntegerField(db_index=True)),
+                ('item_id', models.BigIntegerField(null=True)),
+                ('text', models.TextField()),
+            ],
+        ),
+        migrations.RunPython(create_index, drop_index, hints={'model_name': 'searchentry'}),
+        migrations.RunPython(fill_index, migrations.RunPython.noop, hints={'model_name': 'searchentry'}),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 2.2.13 on 2026-10-19 22:40
+
+import json
+import zlib
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_summaries(apps, schema_editor):
+    from zabacus.bills.archive import DATE_FIELDS, summarize
+    from django.utils.dateparse import parse_datetime
+    db = schema_editor.connection.alias
+    BillArchive = apps.get_model('bills', 'BillArchive')
+    ArchivedSpending = apps.get_model('bills', 'ArchivedSpending')
+    ArchivedShare = apps.get_model('bills', 'ArchivedShare')
+    for bid, data in BillArchive.objects.using(db).values_list('bill_id', 'data').iterator():
+        items = json.loads(zlib.decompress(bytes(data)).decode())
+        for item in items:
+            for f in DATE_FIELDS:
+                item[f] = parse_datetime(item[f])
+        spending, shares = summarize(bid, items)
+        # summarize builds instances of the current models; copy them into the historical ones
+        ArchivedSpending.objects.using(db).bulk_create(
+            ArchivedSpending(bill_id=bid, user_id=r.user_id, day=r.day, paid_cents=r.paid_cents,
+                             paid_count=r.paid_count, owed_cents=r.owed_cents, owed_count=r.owed_count)
+            for r in spending
+        )
+        ArchivedShare.objects.using(db).bulk_create(
+            ArchivedShare(bill_id=bid, user_id=r.user_id, amount_cents=r.amount_cents, count=r.count) for r in shares
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('bills', '0014_search_entry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedSpending',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('day', models.DateTimeField()),
+                ('paid_cents', models.BigIntegerField(default=0)),
+                ('paid_count', models.IntegerField(default=0)),
+                ('owed_cents', models.BigIntegerField(default=0)),
+                ('owed_count', models.IntegerField(default=0)),
+                ('bill', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_spending', to='bills.Bill')),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedShare',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('amount_cents', models.BigIntegerField()),
+                ('count', models.IntegerField()),
+                ('bill', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_shares', to='bills.Bill')),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop, hints={'model_name': 'archivedspending'}),
+    ]
@@ -1,26 +1,58 @@
 from django.db import models
+from django.db.models import F, Sum
 from django.conf import settings
+import django.utils.timezone as tz
 
+import numbers
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 from enum import Enum
 
 # Create your models here.
 
 
+# Convert a money amount in dollars (number or numeric string) to an integer number of cents
+def to_cents(amount):
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+# Largest amount in cents accepted from clients; amounts are summed per bill into 64-bit columns
+MAX_CENTS = 10 ** 15
+
+
+# to_cents for client input: raises ValueError unless `amount` is a finite number (or numeric string, not
+# a bool) of at most MAX_CENTS cents either way
+def parse_cents(amount):
+    if isinstance(amount, bool) or not isinstance(amount, (numbers.Real, str)):
+        raise ValueError('Not a number: {!r}'.format(amount))
+    try:
+        cents = to_cents(amount)
+    except (InvalidOperation, ValueError):
+        # NaN, infinities, numbers beyond the decimal context, malformed strings
+        raise ValueError('Not a finite number: {!r}'.format(amount))
+    if abs(cents) > MAX_CENTS:
+        raise ValueError('Out of range: {!r}'.format(amount))
+    return cents
+
+
 class BillStatus(Enum):
     OPN = 'open'
     STL = 'settled'
     DIS = 'dispute'
 
 
+# Bill, BillItem, Involvement and ItemWeightAssignment live on the bill shards (see sharding.py) while
+# users live on the default database, so foreign keys to users are not enforced by the database.
 class Bill(models.Model):
+    id = models.BigAutoField(primary_key=True)
     name = models.CharField(max_length=255)
     desc = models.TextField(default='No description.')
     date = models.DateTimeField()
-    edited = models.DateTimeField()
+    edited = models.DateTimeField(db_index=True)
     created_by = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         related_name='created',
         on_delete=models.CASCADE,
+        db_constraint=False,
     )
     people = models.ManyToManyField(
         settings.AUTH_USER_MODEL,
@@ -32,43 +64,160 @@ class Bill(models.Model):
         max_length=32,
         choices=[(tag.name, tag.value) for tag in BillStatus],
     )
+    # bumped by every edit of the row, for optimistic concurrency control
+    version = models.PositiveIntegerField(default=1)
+    # items and weight assignments have been moved to a BillArchive (see archive.py)
+    archived = models.BooleanField(default=False)
+    # summary counters (archived items included), kept up to date by the mutations through
+    # `adjust_counters`; `./manage.py check_bill_counters --repair` recomputes them
+    item_count = models.PositiveIntegerField(default=0)
+    total_cents = models.BigIntegerField(default=0)
+    member_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.name
 
+    # Add the given deltas to the summary counters, with F() expressions so that concurrent mutations add up
+    def adjust_counters(self, items=0, total_cents=0, members=0):
+        deltas = {f: d for f, d in (('item_count', items), ('total_cents', total_cents), ('member_count', members)) if d}
+        if not deltas:
+            return
+        Bill.objects.using(self._state.db).filter(id=self.id).update(**{f: F(f) + d for f, d in deltas.items()})
+        for f, d in deltas.items():
+            setattr(self, f, getattr(self, f) + d)
+
+    # Per-user settlement figures for this bill, in cents, computed with two aggregated queries.
+    # Returns a dict mapping user id to (paid, owed, balance); a positive balance is owed to the user.
+    def balances(self):
+        paid = dict(self.items.values_list('paid_by').annotate(Sum('total_cents')).order_by())
+        owed = dict(
+            ItemWeightAssignment.objects.using(self._state.db).filter(item__bill=self)
+            .values_list('user').annotate(Sum('amount_cents')).order_by()
+        )
+        result = {}
+        for uid in set(paid) | set(owed):
+            p, o = paid.get(uid, 0), owed.get(uid, 0)
+            result[uid] = (p, o, p - o)
+        return result
+
+
+class BillItemQuerySet(models.QuerySet):
+    # Items whose weight assignments do not add up exactly to the item total
+    def unbalanced(self):
+        return self.annotate(assigned_cents=Sum('assignments__amount_cents')) \
+            .exclude(assigned_cents=F('total_cents'))
+
 
 class BillItem(models.Model):
+    id = models.BigAutoField(primary_key=True)
     name = models.CharField(max_length=255)
     desc = models.TextField()
     date = models.DateTimeField()
-    edited = models.DateTimeField()
+    edited = models.DateTimeField(db_index=True)
     created_by = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         related_name='created_items',
         on_delete=models.CASCADE,
+        db_constraint=False,
     )
     paid_by = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         related_name='paid_items',
         on_delete=models.CASCADE,
+        db_constraint=False,
     )
     bill = models.ForeignKey(
         Bill,
         related_name='items',
         on_delete=models.CASCADE
     )
-    total = models.FloatField()
+    # money is stored as an integer number of cents so sums are exact
+    total_cents = models.BigIntegerField()
+    version = models.PositiveIntegerField(default=1)
+
+    objects = BillItemQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
 
 class Involvement(models.Model):
+    id = models.BigAutoField(primary_key=True)
     bill = models.ForeignKey(Bill, on_delete=models.CASCADE)
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_constraint=False)
+    joined = models.DateTimeField(default=tz.now, db_index=True)
+
+    class Meta:
+        unique_together = ('bill', 'user')
 
 
 class ItemWeightAssignment(models.Model):
+    id = models.BigAutoField(primary_key=True)
     item = models.ForeignKey(BillItem, related_name='assignments', on_delete=models.CASCADE)
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    amount = models.FloatField()
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_constraint=False)
+    amount_cents = models.BigIntegerField()
+
+
+# Items and weight assignments of an archived bill, as zlib-compressed JSON (see archive.py)
+class BillArchive(models.Model):
+    bill = models.OneToOneField(Bill, primary_key=True, related_name='archive', on_delete=models.CASCADE)
+    data = models.BinaryField()
+    archived = models.DateTimeField()
+
+
+# What a member paid and owes in the archived items of a bill, per (local) day of the items, written when
+# the bill is archived so that analytics can sum archived bills in SQL without decoding them
+class ArchivedSpending(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    bill = models.ForeignKey(Bill, related_name='archived_spending', on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE, db_constraint=False)
+    # local midnight of the items' date
+    day = models.DateTimeField()
+    paid_cents = models.BigIntegerField(default=0)
+    paid_count = models.IntegerField(default=0)
+    owed_cents = models.BigIntegerField(default=0)
+    owed_count = models.IntegerField(default=0)
+
+
+# How many of the member's shares in the archived items of a bill have each amount (for share percentiles)
+class ArchivedShare(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    bill = models.ForeignKey(Bill, related_name='archived_shares', on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE, db_constraint=False)
+    amount_cents = models.BigIntegerField()
+    count = models.IntegerField()
+
+
+# Record of a deletion that a user has to be told about when syncing: a bill that was deleted or
+# that the user was removed from, or an item deleted from one of the user's bills.
+class Tombstone(models.Model):
+    BILL = 'bill'
+    ITEM = 'item'
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='tombstones', on_delete=models.CASCADE)
+    kind = models.CharField(max_length=16, choices=[(BILL, BILL), (ITEM, ITEM)])
+    object_id = models.BigIntegerField()
+    deleted = models.DateTimeField()
+
+    class Meta:
+        index_together = ('user', 'deleted')
+
+
+# Global copy of Involvement on the default database (user -> ids of the bills they are involved in),
+# used to find the shards holding a user's bills
+class InvolvementDirectory(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='bill_directory', on_delete=models.CASCADE)
+    bill_id = models.BigIntegerField(db_index=True)
+
+    class Meta:
+        unique_together = ('user', 'bill_id')
+
+
+# Full-text search index (see search.py): the name and description of a bill (`item_id` null) or of one of
+# its items, archived ones included, next to the bill on its shard. Derived data, written by the mutations
+# and rebuilt from the bill by `search.reindex_bills`; MySQL indexes `text` with FULLTEXT, SQLite with an FTS5 table over this one.
+class SearchEntry(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    bill_id = models.BigIntegerField(db_index=True)
+    item_id = models.BigIntegerField(null=True)
+    text = models.TextField()
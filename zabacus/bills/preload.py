@@ -0,0 +1,110 @@
+from collections import defaultdict
+from django.contrib.auth import get_user_model
+from django.db.models import prefetch_related_objects
+from graphql.language import ast
+from zabacus.bills.models import Bill, Involvement
+
+# Batch loading of what nested GraphQL fields read, for resolvers returning lists of bills or items.
+#
+# Resolved naively, every `createdBy`, `paidBy`, `people` or `assignments` field of every bill or item in
+# a result runs its own query, so a bill with a hundred items costs hundreds of queries. The resolvers of
+# list fields call `bills` / `items` with the fields the client selected under them, which load each
+# selected relation of all the objects at once and leave it where the nested resolvers find it (Django's
+# related object and prefetch caches, `preloaded_members` for `people`). Users are loaded from the user
+# database by id, as bills and items may live on shards that do not hold the user table.
+
+
+# Names of the fields selected under the field being resolved, or under its subfield `path`
+def selected_fields(info, *path):
+    names = set()
+
+    def collect(selection_set, path):
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.FragmentSpread):
+                collect(info.fragments[selection.name.value].selection_set, path)
+            elif isinstance(selection, ast.InlineFragment):
+                collect(selection.selection_set, path)
+            elif not path:
+                names.add(selection.name.value)
+            elif selection.name.value == path[0] and selection.selection_set:
+                collect(selection.selection_set, path[1:])
+
+    for node in info.field_asts:
+        if node.selection_set:
+            collect(node.selection_set, path)
+    return names
+
+
+def _cache_related(obj, field, value):
+    type(obj)._meta.get_field(field).set_cached_value(obj, value)
+
+
+# Load the users referenced by the foreign keys `fields` of every object in `objects` in one query
+def attach_users(objects, *fields):
+    users = get_user_model().objects.in_bulk({getattr(o, f + '_id') for o in objects for f in fields})
+    for o in objects:
+        for f in fields:
+            user = users.get(getattr(o, f + '_id'))
+            if user is not None:
+                _cache_related(o, f, user)
+
+
+# Set `preloaded_members` (the users involved) on every bill in `bills`
+def attach_members(bills):
+    by_db = defaultdict(list)
+    for bill in bills:
+        by_db[bill._state.db].append(bill.id)
+    uids = defaultdict(list)
+    for db, bids in by_db.items():
+        for bid, uid in Involvement.objects.using(db).filter(bill_id__in=bids).values_list('bill_id', 'user_id'):
+            uids[bid].append(uid)
+    users = get_user_model().objects.in_bulk({uid for ids in uids.values() for uid in ids})
+    for bill in bills:
+        bill.preloaded_members = [users[uid] for uid in sorted(uids[bill.id]) if uid in users]
+
+
+# Load the bills of every item in `items` that does not hold its bill yet, with one query per shard
+def attach_bills(items):
+    items = [i for i in items if not type(i)._meta.get_field('bill').is_cached(i)]
+    by_db = defaultdict(set)
+    for item in items:
+        by_db[item._state.db].add(item.bill_id)
+    bills = {}
+    for db, bids in by_db.items():
+        bills.update(Bill.objects.using(db).in_bulk(bids))
+    for item in items:
+        bill = bills.get(item.bill_id)
+        if bill is not None:
+            _cache_related(item, 'bill', bill)
+
+
+# Preload the relations of `bills` read by the selected `fields`
+def bills(bill_list, fields):
+    bill_list = list(bill_list)
+    if 'people' in fields:
+        attach_members(bill_list)
+    if 'createdBy' in fields:
+        attach_users(bill_list, 'created_by')
+    return bill_list
+
+
+# Preload the relations of `items` read by the selected `fields`; items of `bill` if given
+def items(item_list, fields, bill=None):
+    item_list = list(item_list)
+    if bill is not None:
+        for item in item_list:
+            _cache_related(item, 'bill', bill)
+    elif 'bill' in fields:
+        attach_bills(item_list)
+    user_fields = [f for f, name in (('created_by', 'createdBy'), ('paid_by', 'paidBy')) if name in fields]
+    if user_fields:
+        attach_users(item_list, *user_fields)
+    if 'assignments' in fields:
+        # archived items come with their assignments
+        prefetch_related_objects([i for i in item_list if not hasattr(i, '_prefetched_objects_cache')], 'assignments')
+        attach_users([a for i in item_list for a in i.assignments.all()], 'user')
+        for item in item_list:
+            for a in item.assignments.all():
+                _cache_related(a, 'item', item)
+    return item_list
+
@@ -0,0 +1,94 @@
+import itertools
+import threading
+from collections import defaultdict
+from django.conf import settings
+from django.utils.module_loading import import_string
+import django.utils.timezone as tz
+from rx import Observable
+from zabacus.bills import tasks
+
+# Publish/subscribe of compact bill change events.
+#
+# Mutations publish an event on the bill's channel once their transaction commits; GraphQL
+# subscriptions (`billUpdated`) observe the channel. The backend is pluggable through the
+# PUBSUB_BACKEND setting: any class with `publish`, `subscribe` and `unsubscribe` methods
+# like LocalPubSub. LocalPubSub only fans out within one process, which is enough for a single
+# ASGI worker and for tests; several workers need a shared backend (e.g. Redis) behind the
+# same interface.
+
+
+class LocalPubSub:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channels = defaultdict(dict)
+        self._tokens = itertools.count()
+
+    def publish(self, channel, event):
+        with self._lock:
+            callbacks = list(self._channels.get(channel, {}).values())
+        for callback in callbacks:
+            callback(event)
+
+    # `callback(event)` is called on the publishing thread; returns a token for `unsubscribe`
+    def subscribe(self, channel, callback):
+        token = next(self._tokens)
+        with self._lock:
+            self._channels[channel][token] = callback
+        return token
+
+    def unsubscribe(self, channel, token):
+        with self._lock:
+            callbacks = self._channels.get(channel)
+            if callbacks is not None:
+                callbacks.pop(token, None)
+                if not callbacks:
+                    del self._channels[channel]
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_pubsub():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(getattr(settings, 'PUBSUB_BACKEND', 'zabacus.bills.pubsub.LocalPubSub'))()
+    return _backend
+
+
+def bill_channel(bid):
+    return 'bill:{}'.format(bid)
+
+
+# Observable of the events published on `channel`, for subscription resolvers; it completes after the
+# first event for which `last(event)` is true, if given
+def observe(channel, last=None):
+    def subscribe(observer):
+        def on_event(event):
+            observer.on_next(event)
+            if last is not None and last(event):
+                observer.on_completed()
+
+        backend = get_pubsub()
+        token = backend.subscribe(channel, on_event)
+        return lambda: backend.unsubscribe(channel, token)
+
+    return Observable.create(subscribe)
+
+
+# Publish `kind` of change to `bill` (and the affected object, if any) once the current transaction
+# commits; the fan-out runs on the background task queue, off the request path
+def publish_bill_event(bill, kind, object_id=None):
+    event = {
+        'bid': bill.id,
+        'kind': kind,
+        'id': object_id,
+        'at': tz.now().isoformat(),
+    }
+    tasks.enqueue_on_commit(_publish, bill_channel(bill.id), event)
+
+
+def _publish(channel, event):
+    get_pubsub().publish(channel, event)
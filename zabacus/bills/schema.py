@@ -1,12 +1,22 @@
 import numbers
+import io
+from datetime import timedelta
 import graphene
 from graphql import GraphQLError
 from graphene_django.types import DjangoObjectType
 from django.core.exceptions import MultipleObjectsReturned, ObjectDoesNotExist
+from django.db import connections, transaction
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
 import django.utils.timezone as tz
 from django.utils.html import escape
 from django.contrib.auth import get_user_model
-from zabacus.bills.models import Bill, BillItem, Involvement, ItemWeightAssignment, BillStatus
+from zabacus.bills.models import Bill, BillItem, Involvement, ItemWeightAssignment, BillStatus, Tombstone, parse_cents
+from zabacus.bills import analytics, archive, importer, preload, pubsub, search, sharding, snapshots
+from zabacus.bills.transactions import atomic_mutation, enlist
+
+
+SYNC_CURSOR_OVERLAP = timedelta(seconds=5)
 
 
 # Helper functions
@@ -18,25 +28,141 @@ def get_auth_user(info):
     return user
 
 
-# Check validity of `assignment` JSON string, given a bill and a grand total of the item
-def validate_weight_assignment(bill, total, weights):
+# Check validity of `assignment` JSON string, given a bill and a grand total (in cents) of the item.
+# Returns a list of (user, amount in cents) pairs that add up exactly to `total_cents`.
+def validate_weight_assignment(bill, total_cents, weights):
     validated_weights = []
-    assign_total = 0.0
+    assign_total = 0
+    assignees = {u.username: u for u in sharding.members(bill).filter(username__in=list(weights.keys()))}
     for username, amount in weights.items():
+        # numbers only: no numeric strings, no bools
         if not isinstance(amount, numbers.Real):
             raise GraphQLError('Invalid weight assignment (type error).')
         try:
-            assignee = bill.people.get(username=username)
-        except ObjectDoesNotExist:
+            amount_cents = parse_cents(amount)
+        except ValueError:
+            raise GraphQLError('Invalid weight assignment (type error).')
+        try:
+            assignee = assignees[username]
+        except KeyError:
             raise GraphQLError('Invalid weight assignment (user not involved).')
-        assign_total += amount
-        validated_weights.append((assignee, amount))
+        assign_total += amount_cents
+        validated_weights.append((assignee, amount_cents))
 
-    if abs(assign_total - total) >= 0.01:
+    if assign_total != total_cents:
         raise GraphQLError('Invalid weight assignment (sum mismatch).')
     return validated_weights
 
 
+# Cents of the `total` argument of an item mutation
+def total_to_cents(total):
+    try:
+        return parse_cents(total)
+    except ValueError:
+        raise GraphQLError('Invalid total.')
+
+
+class ConflictError(GraphQLError):
+    pass
+
+
+# Write `fields` of `obj` (a Bill or BillItem) with a conditional UPDATE that only applies if the row is
+# still at `version` (by default the version `obj` was read at), and bump the version. Raises
+# ConflictError, which clients may retry on, if someone else modified the row in the meantime.
+def save_versioned(obj, fields, version=None):
+    expected = obj.version if version is None else version
+    values = {f: getattr(obj, f) for f in fields}
+    if not type(obj).objects.using(sharding.shard_of(obj)).filter(id=obj.id, version=expected).update(version=F('version') + 1, **values):
+        raise ConflictError('Conflict: {} was modified concurrently, please reload and retry.'.format(
+            type(obj).__name__))
+    obj.version = expected + 1
+
+
+# Invalidate everything derived from the items of `bill`; call after any item mutation. The cached
+# analytics of its members are dropped once the transaction commits.
+def items_changed(bill):
+    members = sharding.member_ids(bill)
+    transaction.on_commit(lambda: analytics.invalidate_analytics(members))
+
+
+# Announce a `kind` of change to `bill` (and the affected object, if any); call after any mutation of the
+# bill, its items or its members. This bumps the bill's `edited` stamp (updateBill sets it itself), which
+# sync and ETags rely on, and updates its search index entries, and once the transaction commits replaces
+# the bill's snapshot and notifies the subscribers of the bill.
+def bill_changed(bill, kind, object_id=None):
+    if kind not in ('bill_updated', 'bill_deleted'):
+        touch_bill(bill)
+    search.bill_changed(bill, kind, object_id)
+    snapshots.invalidate(bill)
+    pubsub.publish_bill_event(bill, kind, object_id)
+
+
+# Bump `edited` on `bill` (e.g. after its items or membership changed) so that syncing clients pick it up
+def touch_bill(bill):
+    bill.edited = tz.localtime(tz.now())
+    Bill.objects.using(sharding.shard_of(bill)).filter(id=bill.id).update(edited=bill.edited)
+
+
+# Bump `edited` on the bills `bids` (e.g. after the profile of one of their members changed)
+def touch_bills(bids):
+    edited = tz.localtime(tz.now())
+    by_shard = {}
+    for bid in bids:
+        by_shard.setdefault(sharding.shard_for(bid), []).append(bid)
+    for db, ids in by_shard.items():
+        Bill.objects.using(db).filter(id__in=ids).update(edited=edited)
+
+
+# Record the deletion of a bill or item for every user in `uids`, for `sync` to report
+def record_deletion(kind, object_id, uids):
+    datetime = tz.now()
+    Tombstone.objects.bulk_create(
+        [Tombstone(user_id=uid, kind=kind, object_id=object_id, deleted=datetime) for uid in uids]
+    )
+
+
+# Copy memberships (and optionally all items with their weight assignments) of bill `src` into
+# the freshly created bill `dst`, which may be on another shard. Runs a constant number of statements
+# regardless of bill size.
+def clone_bill_contents(src, dst, user, with_items=False):
+    db = sharding.shard_of(dst)
+    uids = sharding.member_ids(src)
+    Involvement.objects.using(db).bulk_create([Involvement(bill=dst, user_id=uid) for uid in uids])
+    sharding.record_members(dst.id, uids)
+    if not with_items:
+        dst.adjust_counters(members=len(uids))
+        return
+
+    src_items = sorted(archive.items_of(src), key=lambda i: i.id)
+    dst.adjust_counters(items=len(src_items), total_cents=sum(i.total_cents for i in src_items), members=len(uids))
+    if not src_items:
+        return
+    datetime = dst.edited
+    BillItem.objects.using(db).bulk_create([
+        BillItem(
+            name=i.name,
+            desc=i.desc,
+            date=datetime,
+            edited=datetime,
+            created_by=user,
+            paid_by_id=i.paid_by_id,
+            bill=dst,
+            total_cents=i.total_cents
+        ) for i in src_items
+    ])
+    # bulk_create does not hand back primary keys on every backend, so pair the new rows with
+    # their sources by insertion order (`dst` is brand new, so it holds only the cloned items)
+    new_ids = dict(zip((i.id for i in src_items), dst.items.order_by('id').values_list('id', flat=True)))
+    if src.archived:
+        src_assignments = [a for i in src_items for a in i.assignments.all()]
+    else:
+        src_assignments = ItemWeightAssignment.objects.using(src._state.db).filter(item__bill=src)
+    ItemWeightAssignment.objects.using(db).bulk_create([
+        ItemWeightAssignment(item_id=new_ids[a.item_id], user_id=a.user_id, amount_cents=a.amount_cents)
+        for a in src_assignments
+    ])
+
+
 class DisplayUserType(DjangoObjectType):
     class Meta:
         model = get_user_model()
@@ -44,19 +170,112 @@ class DisplayUserType(DjangoObjectType):
 
 
 class BillItemType(DjangoObjectType):
+    total = graphene.Float()
+
     class Meta:
         model = BillItem
 
+    def resolve_total(self, info):
+        return self.total_cents / 100
+
+
+class BalanceType(graphene.ObjectType):
+    user = graphene.Field(DisplayUserType)
+    paid_cents = graphene.Int()
+    owed_cents = graphene.Int()
+    balance_cents = graphene.Int()
+
 
 class BillType(DjangoObjectType):
+    total = graphene.Float()
+    balances = graphene.List(BalanceType)
+
     class Meta:
         model = Bill
 
+    def resolve_total(self, info):
+        return self.total_cents / 100
+
+    def resolve_people(self, info):
+        members = getattr(self, 'preloaded_members', None)
+        return sharding.members(self) if members is None else members
+
+    def resolve_items(self, info):
+        return preload.items(archive.items_of(self), preload.selected_fields(info), bill=self)
+
+    def resolve_balances(self, info):
+        balances = archive.balances(self)
+        users = get_user_model().objects.in_bulk(balances.keys())
+        return [
+            BalanceType(user=users[uid], paid_cents=p, owed_cents=o, balance_cents=b)
+            for uid, (p, o, b) in sorted(balances.items())
+        ]
+
 
 class ItemWeightAssignmentType(DjangoObjectType):
+    amount = graphene.Float()
+
     class Meta:
         model = ItemWeightAssignment
 
+    def resolve_amount(self, info):
+        return self.amount_cents / 100
+
+
+class SpendBucketType(graphene.ObjectType):
+    key = graphene.String()
+    paid_cents = graphene.Int()
+    owed_cents = graphene.Int()
+    item_count = graphene.Int()
+    rolling_owed_cents = graphene.Float()
+
+
+class SharePercentileType(graphene.ObjectType):
+    percentile = graphene.Int()
+    amount_cents = graphene.Float()
+
+
+class SpendingReportType(graphene.ObjectType):
+    buckets = graphene.List(SpendBucketType)
+    share_percentiles = graphene.List(SharePercentileType)
+
+
+class PayerType(graphene.ObjectType):
+    user = graphene.Field(DisplayUserType)
+    paid_cents = graphene.Int()
+    item_count = graphene.Int()
+
+
+class DeletionType(graphene.ObjectType):
+    kind = graphene.String()
+    id = graphene.ID()
+
+
+class SyncType(graphene.ObjectType):
+    cursor = graphene.String()
+    bills = graphene.List(BillType)
+    items = graphene.List(BillItemType)
+    deleted = graphene.List(DeletionType)
+
+
+class SearchHitType(graphene.ObjectType):
+    bill = graphene.Field(BillType)
+    # the items of the bill that match (none if only the bill itself does)
+    items = graphene.List(BillItemType)
+
+
+class SearchResultType(graphene.ObjectType):
+    hits = graphene.List(SearchHitType)
+    # `after` for the next page; null on the last page
+    cursor = graphene.String()
+
+
+class BillEventType(graphene.ObjectType):
+    bid = graphene.ID()
+    kind = graphene.String()
+    id = graphene.ID()
+    at = graphene.String()
+
 
 # Add/Remove items from a bill
 class AddBillItem(graphene.Mutation):
@@ -70,23 +289,26 @@ class AddBillItem(graphene.Mutation):
         total = graphene.Float(required=True)
         weights = graphene.JSONString(required=True)
 
+    @atomic_mutation
     def mutate(self, info, bid, iname, idesc, payer, total, weights):
         user = get_auth_user(info)
         try:
-            bill = user.involved.get(id=bid)
+            bill = sharding.get_user_bill(user, bid)
         except ObjectDoesNotExist:
             raise GraphQLError('Bill not found.')
 
         # check validity of the `assign` JSON string
-        validated_weights = validate_weight_assignment(bill, total, weights)
+        total_cents = total_to_cents(total)
+        validated_weights = validate_weight_assignment(bill, total_cents, weights)
 
         try:
-            payer_user = bill.people.get(id=payer)
+            payer_user = sharding.members(bill).get(id=payer)
         except ObjectDoesNotExist:
             raise GraphQLError('Payor not involved.')
 
+        db = sharding.shard_of(bill)
         datetime = tz.localtime(tz.now())
-        new_item = BillItem.objects.create(
+        new_item = BillItem.objects.using(db).create(
             name=escape(iname),
             desc=escape(idesc),
             date=datetime,
@@ -94,17 +316,15 @@ class AddBillItem(graphene.Mutation):
             created_by=user,
             paid_by=payer_user,
             bill=bill,
-            total=total
+            total_cents=total_cents
         )
-        new_item.save()
-        for (u, amount) in validated_weights:
-            ass_rel = ItemWeightAssignment.objects.create(
-                item=new_item,
-                user=u,
-                amount=amount
-            )
-            ass_rel.save()
+        ItemWeightAssignment.objects.using(db).bulk_create([
+            ItemWeightAssignment(item=new_item, user=u, amount_cents=amount) for (u, amount) in validated_weights
+        ])
 
+        bill.adjust_counters(items=1, total_cents=total_cents)
+        items_changed(bill)
+        bill_changed(bill, 'item_added', new_item.id)
         return AddBillItem(bill=bill)
 
 
@@ -114,14 +334,19 @@ class DeleteBillItem(graphene.Mutation):
     class Arguments:
         iid = graphene.ID(required=True)
 
+    @atomic_mutation
     def mutate(self, info, iid):
         user = get_auth_user(info)
         try:
-            item = user.created_items.get(id=iid)
+            item = sharding.get_item(iid, created_by=user)
         except ObjectDoesNotExist:
             raise GraphQLError('Invalid item.')
         bill = item.bill
+        record_deletion(Tombstone.ITEM, item.id, sharding.member_ids(bill))
+        bill_changed(bill, 'item_deleted', item.id)
+        bill.adjust_counters(items=-1, total_cents=-item.total_cents)
         item.delete()
+        items_changed(bill)
 
         return DeleteBillItem(bill=bill)
 
@@ -136,11 +361,13 @@ class UpdateBillItem(graphene.Mutation):
         payer = graphene.ID()
         total = graphene.Float()
         weights = graphene.JSONString()
+        version = graphene.Int()
 
+    @atomic_mutation
     def mutate(self, info, iid, **kwargs):
         user = get_auth_user(info)
         try:
-            item = user.created_items.get(id=iid)
+            item = sharding.get_item(iid, created_by=user)
         except ObjectDoesNotExist:
             raise GraphQLError('Item not found.')
 
@@ -152,50 +379,100 @@ class UpdateBillItem(graphene.Mutation):
         it_tot = kwargs.get('total')
         it_wei = kwargs.get('weights')
 
+        changed = ['edited']
         if it_nam is not None:
             item.name = escape(it_nam)
+            changed.append('name')
         if it_dec is not None:
             item.desc = escape(it_dec)
+            changed.append('desc')
         if it_pyr is not None:
             try:
-                new_payer = bill.people.get(id=it_pyr)
+                new_payer = sharding.members(bill).get(id=it_pyr)
             except ObjectDoesNotExist:
                 raise GraphQLError('Payer not involved.')
             item.paid_by = new_payer
+            changed.append('paid_by')
+        validated_weights = None
         if it_tot is not None:
             if it_wei is None:
                 raise GraphQLError('Weight assignment required.')
-            validated_weights = validate_weight_assignment(bill, it_tot, it_wei)
-            item.total = it_tot
-            item.save()
-            # remove old weight assignments
-            for a in item.assignments.all():
-                a.delete()
-            for (u, amount) in validated_weights:
-                rel = ItemWeightAssignment.objects.create(
-                    item=item,
-                    user=u,
-                    amount=amount
-                )
-                rel.save()
-
+            old_total_cents = item.total_cents
+            item.total_cents = total_to_cents(it_tot)
+            changed.append('total_cents')
+            validated_weights = validate_weight_assignment(bill, item.total_cents, it_wei)
+        item.edited = tz.localtime(tz.now())
+
+        save_versioned(item, changed, kwargs.get('version'))
+        if validated_weights is not None:
+            # replace old weight assignments
+            item.assignments.all().delete()
+            ItemWeightAssignment.objects.using(sharding.shard_of(item)).bulk_create([
+                ItemWeightAssignment(item=item, user=u, amount_cents=amount) for (u, amount) in validated_weights
+            ])
+            bill.adjust_counters(total_cents=item.total_cents - old_total_cents)
+
+        items_changed(bill)
+        bill_changed(bill, 'item_updated', item.id)
         return UpdateBillItem(bill=bill)
 
 
-class BenchmarkUpdateBillName(graphene.Mutation):
+class ImportErrorType(graphene.ObjectType):
+    row = graphene.Int()
+    message = graphene.String()
+
+
+class ImportBillItems(graphene.Mutation):
     bill = graphene.Field(BillType)
+    imported = graphene.Int()
+    errors = graphene.List(ImportErrorType)
 
     class Arguments:
-        bname = graphene.String()
+        bid = graphene.ID(required=True)
+        data = graphene.String(required=True)
+        format = graphene.String(default_value='csv')
 
-    def mutate(self, info, bname):
+    @atomic_mutation
+    def mutate(self, info, bid, data, format):
         user = get_auth_user(info)
         try:
-            bill = user.involved.first()
+            bill = sharding.get_user_bill(user, bid)
         except ObjectDoesNotExist:
             raise GraphQLError('Bill not found.')
+        try:
+            rows = importer.parse_rows(io.StringIO(data), format)
+        except ValueError:
+            raise GraphQLError('Unknown import format.')
+
+        imported, errors = importer.import_items(bill, user, rows)
+        if imported:
+            items_changed(bill)
+            bill_changed(bill, 'items_imported')
+        return ImportBillItems(
+            bill=bill,
+            imported=imported,
+            errors=[ImportErrorType(row=r, message=m) for r, m in errors]
+        )
+
+
+class BenchmarkUpdateBillName(graphene.Mutation):
+    bill = graphene.Field(BillType)
+
+    class Arguments:
+        bname = graphene.String()
+        version = graphene.Int()
+
+    @atomic_mutation
+    def mutate(self, info, bname, version=None):
+        user = get_auth_user(info)
+        bill = sharding.first_bill(user)
+        if bill is None:
+            raise GraphQLError('Bill not found.')
+        enlist(sharding.shard_of(bill))
         bill.name = escape(bname)
-        bill.save()
+        bill.edited = tz.localtime(tz.now())
+        save_versioned(bill, ['name', 'edited'], version)
+        bill_changed(bill, 'bill_updated')
         return BenchmarkUpdateBillName(bill=bill)
 
 
@@ -203,23 +480,55 @@ class BenchmarkUpdateBillItemName(graphene.Mutation):
     bill = graphene.Field(BillType)
 
     class Arguments:
-        bid = graphene.ID(required=True)
         iname = graphene.String(required=True)
+        version = graphene.Int()
 
-    def mutate(self, info, name):
+    @atomic_mutation
+    def mutate(self, info, iname, version=None):
         user = get_auth_user(info)
-        try:
-            bill = user.involved.first()
-            item = bill.items.first()
-        except ObjectDoesNotExist:
+        bill = sharding.first_bill(user)
+        item = bill.items.first() if bill is not None else None
+        if item is None:
             raise GraphQLError('Item not found.')
+        enlist(sharding.shard_of(bill))
 
         item.name = escape(iname)
-        item.save()
-        return BenchmarkUpdateFirstBillItemNameInBill(bill=bill)
+        item.edited = tz.localtime(tz.now())
+        save_versioned(item, ['name', 'edited'], version)
+        bill_changed(bill, 'item_updated', item.id)
+        return BenchmarkUpdateBillItemName(bill=bill)
 
 
 # Add/remove a user from a bill
+# Involve every user in `unames` in `bill` using a constant number of queries. Returns a dict
+# mapping each requested username to the outcome of adding it ('OK' or an error message).
+def involve_users(bill, unames):
+    results = {}
+    users = get_user_model().objects.in_bulk(unames, field_name='username')
+    db = sharding.shard_of(bill)
+    # lock the bill row, so that concurrent additions to the bill wait for this one and then see its
+    # members: every 'OK' below is a row actually inserted. (SQLite has no row locks; a concurrent
+    # addition there fails to commit and is retried.)
+    if connections[db].features.has_select_for_update:
+        list(Bill.objects.using(db).select_for_update().filter(id=bill.id).values_list('id'))
+    members = set(sharding.member_ids(bill))
+    new_rels = []
+    for uname in unames:
+        if uname in results:
+            continue
+        if uname not in users:
+            results[uname] = 'Target user does not exist.'
+        elif users[uname].id in members:
+            results[uname] = 'User already in bill.'
+        else:
+            results[uname] = 'OK'
+            new_rels.append(Involvement(bill=bill, user=users[uname]))
+    Involvement.objects.using(db).bulk_create(new_rels)
+    sharding.record_members(bill.id, [r.user_id for r in new_rels])
+    bill.adjust_counters(members=len(new_rels))
+    return results
+
+
 class AddUserToBill(graphene.Mutation):
     bill = graphene.Field(BillType)
 
@@ -227,23 +536,49 @@ class AddUserToBill(graphene.Mutation):
         bid = graphene.ID(required=True)
         uname = graphene.String(required=True)
 
+    @atomic_mutation
     def mutate(self, info, bid, uname):
         user = get_auth_user(info)
         try:
-            bill = user.involved.get(id=bid)
+            bill = sharding.get_user_bill(user, bid)
         except ObjectDoesNotExist:
             raise GraphQLError('Can not find bill.')
+        result = involve_users(bill, [uname])[uname]
+        if result != 'OK':
+            raise GraphQLError(result)
+        bill_changed(bill, 'members_added')
+
+        return AddUserToBill(bill=bill)
+
+
+class UserInvolvementResultType(graphene.ObjectType):
+    uname = graphene.String()
+    result = graphene.String()
+
+
+class AddUsersToBill(graphene.Mutation):
+    bill = graphene.Field(BillType)
+    results = graphene.List(UserInvolvementResultType)
+
+    class Arguments:
+        bid = graphene.ID(required=True)
+        unames = graphene.List(graphene.String, required=True)
+
+    @atomic_mutation
+    def mutate(self, info, bid, unames):
+        user = get_auth_user(info)
         try:
-            target_user = get_user_model().objects.get(username=uname)
+            bill = sharding.get_user_bill(user, bid)
         except ObjectDoesNotExist:
-            raise GraphQLError('Target user does not exist.')
-        if bill.people.filter(username=uname).exists():
-            raise GraphQLError('User already in bill.')
-
-        new_rel = Involvement.objects.create(bill=bill, user=target_user)
-        new_rel.save()
+            raise GraphQLError('Can not find bill.')
+        results = involve_users(bill, unames)
+        if 'OK' in results.values():
+            bill_changed(bill, 'members_added')
 
-        return AddUserToBill(bill=bill)
+        return AddUsersToBill(
+            bill=bill,
+            results=[UserInvolvementResultType(uname=u, result=r) for u, r in results.items()]
+        )
 
 
 class RemoveUserFromBill(graphene.Mutation):
@@ -253,24 +588,28 @@ class RemoveUserFromBill(graphene.Mutation):
         bid = graphene.ID(required=True)
         uid = graphene.ID(required=True)
 
+    @atomic_mutation
     def mutate(self, info, bid, uid):
         user = get_auth_user(info)
         try:
-            bill = user.involved.get(id=bid)
+            bill = sharding.get_user_bill(user, bid)
         except ObjectDoesNotExist:
             raise GraphQLError('Bill not found.')
         try:
-            victim = bill.people.get(id=uid)
+            victim = sharding.members(bill).get(id=uid)
         except ObjectDoesNotExist:
             raise GraphQLError('User does not exist.')
-        for i in bill.items.all():
-            if i.assignments.filter(user=victim).exists():
-                raise GraphQLError('User cannot be removed.')
+        if archive.has_shares(bill, victim.id):
+            raise GraphQLError('User cannot be removed.')
         try:
-            rel = Involvement.objects.get(bill=bill, user=victim)
+            rel = bill.involvement_set.get(user=victim)
         except ObjectDoesNotExist:
             raise GraphQLError('Impossible.')
         rel.delete()
+        bill.adjust_counters(members=-1)
+        sharding.forget_members(bill.id, [victim.id])
+        record_deletion(Tombstone.BILL, bill.id, [victim.id])
+        bill_changed(bill, 'member_removed', victim.id)
 
         return RemoveUserFromBill(bill=bill)
 
@@ -283,11 +622,22 @@ class CreateBill(graphene.Mutation):
         name = graphene.String(required=True)
         desc = graphene.String()
         bid = graphene.ID()
+        with_items = graphene.Boolean()
 
+    @atomic_mutation
     def mutate(self, info, name, **kwargs):
         user = get_auth_user(info)
+        bid = kwargs.get('bid')
+        src_bill = None
+        if bid is not None:
+            # involve all users present in bill `bid`, if provided
+            try:
+                src_bill = sharding.get_user_bill(user, bid)
+            except ObjectDoesNotExist:
+                raise GraphQLError('Template source bill not found.')
+
         datetime = tz.localtime(tz.now())
-        new_bill = Bill.objects.create(
+        fields = dict(
             name=escape(name),
             date=datetime,
             edited=datetime,
@@ -296,24 +646,24 @@ class CreateBill(graphene.Mutation):
         )
         bd = kwargs.get('desc')
         if bd is not None:
-            new_bill.desc = escape(bd)
-
-        new_bill.save()
-        bid = kwargs.get('bid')
-        if bid is not None:
-            # involve all users present in bill `bid`, if provided
-            try:
-                bill = user.involved.get(id=bid)
-            except ObjectDoesNotExist:
-                raise GraphQLError('Template source bill not found.')
-            for p in bill.people.all():
-                new_rel = Involvement.objects.create(bill=new_bill, user=p)
-                new_rel.save()
+            fields['desc'] = escape(bd)
+        if src_bill is None:
+            fields['member_count'] = 1
+
+        db = sharding.new_bill_shard()
+        enlist(db)
+        new_bill = Bill.objects.using(db).create(**fields)
+        if src_bill is not None:
+            clone_bill_contents(src_bill, new_bill, user, with_items=bool(kwargs.get('with_items')))
+            if kwargs.get('with_items'):
+                items_changed(new_bill)
         else:
             # otherwise only involve the creating user
-            new_rel = Involvement.objects.create(bill=new_bill, user=user)
-            new_rel.save()
+            Involvement.objects.using(sharding.shard_of(new_bill)).create(bill=new_bill, user=user)
+            sharding.record_members(new_bill.id, [user.id])
 
+        # a new bill has no snapshot or subscribers yet, only search index entries
+        search.bill_created(new_bill)
         return CreateBill(bill=new_bill)
 
 
@@ -323,13 +673,19 @@ class DeleteBill(graphene.Mutation):
     class Arguments:
         bid = graphene.ID(required=True)
 
+    @atomic_mutation
     def mutate(self, info, bid):
         user = get_auth_user(info)
         try:
-            bill = user.created.get(id=bid)
+            bill = sharding.get_bill(bid, created_by=user)
         except ObjectDoesNotExist:
             raise GraphQLError('Bill not found.')
+        members = sharding.member_ids(bill)
+        transaction.on_commit(lambda: analytics.invalidate_analytics(members))
+        record_deletion(Tombstone.BILL, bill.id, members)
+        bill_changed(bill, 'bill_deleted')
         bill.delete()
+        sharding.forget_members(bid, members)
 
         return DeleteBill(result='OK')
 
@@ -342,50 +698,168 @@ class UpdateBill(graphene.Mutation):
         name = graphene.String()
         desc = graphene.String()
         status = graphene.String()
+        version = graphene.Int()
 
+    @atomic_mutation
     def mutate(self, info, bid, **kwargs):
         user = get_auth_user(info)
         try:
-            bill = user.involved.get(id=bid)
+            bill = sharding.get_user_bill(user, bid)
         except ObjectDoesNotExist:
             raise GraphQLError('Bill not found.')
         bn = kwargs.get('name')
         bd = kwargs.get('desc')
         bs = kwargs.get('status')
+        changed = ['edited']
         if bn is not None:
             bill.name = escape(bn)
+            changed.append('name')
         if bd is not None:
             bill.desc = escape(bd)
+            changed.append('desc')
         if bs is not None:
             bill.status = bs
-        bill.save()
+            changed.append('status')
+        bill.edited = tz.localtime(tz.now())
+        save_versioned(bill, changed, kwargs.get('version'))
+        if bs is not None and bs != BillStatus.STL.name:
+            # reopened
+            archive.restore(bill)
+        if bs is not None:
+            items_changed(bill)
+        bill_changed(bill, 'bill_updated')
         return UpdateBill(bill=bill)
 
 
+# Bills of `user` on shard database `db` and their items, limited to changes after `since` if given
+def sync_shard(db, user, since=None):
+    bills = Bill.objects.using(db).filter(people=user)
+    items = BillItem.objects.using(db).filter(bill__people=user)
+    if since is not None:
+        # bills joined after the cursor are sent with all their items
+        joined = Involvement.objects.using(db).filter(user=user, joined__gt=since).values('bill_id')
+        bills = bills.filter(Q(edited__gt=since) | Q(id__in=joined))
+        items = items.filter(Q(edited__gt=since) | Q(bill_id__in=joined))
+    bills, items = list(bills), list(items)
+    # archived items never change, so they are only sent with their bill on a full sync or when it was joined
+    joined_ids = set() if since is None else set(joined.values_list('bill_id', flat=True))
+    for b in bills:
+        if b.archived and (since is None or b.id in joined_ids):
+            items.extend(archive.archived_items(b))
+    return bills, items
+
+
 class Mutation(graphene.ObjectType):
     add_user_to_bill = AddUserToBill.Field()
+    add_users_to_bill = AddUsersToBill.Field()
     remove_user_from_bill = RemoveUserFromBill.Field()
     add_bill_item = AddBillItem.Field()
     update_bill_item = UpdateBillItem.Field()
     delete_bill_item = DeleteBillItem.Field()
+    import_bill_items = ImportBillItems.Field()
     create_bill = CreateBill.Field()
     update_bill = UpdateBill.Field()
     delete_bill = DeleteBill.Field()
 
 
 class Query(graphene.ObjectType):
-    list_bills = graphene.List(BillType)
+    list_bills = graphene.List(BillType, include_archived=graphene.Boolean(default_value=True))
     created_bills = graphene.List(BillType)
     show_bill = graphene.Field(BillType, bid=graphene.ID())
-
-    def resolve_list_bills(self, info):
+    # the precomputed JSON document of the bill (see snapshots.py), returned as is
+    bill_snapshot = graphene.String(bid=graphene.ID(required=True))
+    my_spending = graphene.Field(SpendingReportType, group_by=graphene.String(default_value='month'),
+                                 window=graphene.Int(default_value=3))
+    bill_payers = graphene.List(PayerType, bid=graphene.ID(required=True))
+    sync = graphene.Field(SyncType, since=graphene.String())
+    search_bills = graphene.Field(SearchResultType, q=graphene.String(required=True),
+                                  first=graphene.Int(default_value=20), after=graphene.String())
+
+    def resolve_list_bills(self, info, include_archived):
         user = get_auth_user(info)
-        return user.involved.all().order_by('-date')
+        filters = {} if include_archived else {'archived': False}
+        bills = sorted(sharding.user_bills(user, **filters), key=lambda b: b.date, reverse=True)
+        return preload.bills(bills, preload.selected_fields(info))
 
     def resolve_created_bills(self, info):
         user = get_auth_user(info)
-        return user.created.all()
+        return preload.bills(sharding.find_bills(created_by=user), preload.selected_fields(info))
 
     def resolve_show_bill(self, info, bid):
         user = get_auth_user(info)
-        return user.involved.get(id=bid)
+        return sharding.get_user_bill(user, bid)
+
+    def resolve_bill_snapshot(self, info, bid):
+        user = get_auth_user(info)
+        try:
+            bill = sharding.get_user_bill(user, bid)
+        except ObjectDoesNotExist:
+            raise GraphQLError('Bill not found.')
+        return snapshots.get(bill)
+
+    def resolve_my_spending(self, info, group_by, window):
+        user = get_auth_user(info)
+        try:
+            report = analytics.user_spending(user, group_by, window)
+        except ValueError:
+            raise GraphQLError('Invalid grouping.')
+        return SpendingReportType(
+            buckets=[SpendBucketType(**b) for b in report['buckets']],
+            share_percentiles=[SharePercentileType(percentile=p, amount_cents=a)
+                               for p, a in sorted(report['percentiles'].items())]
+        )
+
+    def resolve_bill_payers(self, info, bid):
+        user = get_auth_user(info)
+        try:
+            bill = sharding.get_user_bill(user, bid)
+        except ObjectDoesNotExist:
+            raise GraphQLError('Bill not found.')
+        payers = analytics.bill_payers(user, bill)
+        users = get_user_model().objects.in_bulk([p['uid'] for p in payers])
+        return [PayerType(user=users[p['uid']], paid_cents=p['paid_cents'], item_count=p['item_count'])
+                for p in payers]
+
+    def resolve_sync(self, info, since=None):
+        user = get_auth_user(info)
+        # step the returned cursor back a little so rows stamped just before a late commit are not
+        # skipped on the next sync; clients upsert, so seeing a row twice is harmless
+        cursor = tz.now() - SYNC_CURSOR_OVERLAP
+        deleted = user.tombstones.none()
+        if since is not None:
+            since = parse_datetime(since)
+            if since is None or tz.is_naive(since):
+                raise GraphQLError('Invalid cursor.')
+            deleted = user.tombstones.filter(deleted__gt=since)
+        changes = sharding.fan_out(lambda db, ids: sync_shard(db, user, since), sharding.user_shards(user))
+        return SyncType(
+            cursor=cursor.isoformat(),
+            bills=preload.bills([b for bills, _ in changes for b in bills], preload.selected_fields(info, 'bills')),
+            items=preload.items([i for _, items in changes for i in items], preload.selected_fields(info, 'items')),
+            deleted=[DeletionType(kind=t.kind, id=t.object_id) for t in deleted]
+        )
+
+    def resolve_search_bills(self, info, q, first, after=None):
+        user = get_auth_user(info)
+        try:
+            hits, cursor = search.search(user, q, first, after)
+        except ValueError as e:
+            raise GraphQLError(str(e))
+        preload.bills([bill for bill, _ in hits], preload.selected_fields(info, 'hits', 'bill'))
+        preload.items([i for _, items in hits for i in items], preload.selected_fields(info, 'hits', 'items'))
+        return SearchResultType(hits=[SearchHitType(bill=bill, items=items) for bill, items in hits], cursor=cursor)
+
+
+class Subscription(graphene.ObjectType):
+    bill_updated = graphene.Field(BillEventType, bid=graphene.ID(required=True))
+
+    def resolve_bill_updated(self, info, bid):
+        user = get_auth_user(info)
+        if not sharding.is_member(user, bid):
+            raise GraphQLError('Bill not found.')
+
+        # the subscriber gets to see their removal from the bill, or its deletion, and nothing after
+        def last(event):
+            return event['kind'] == 'bill_deleted' or (event['kind'] == 'member_removed' and event['id'] == user.id)
+
+        return pubsub.observe(pubsub.bill_channel(bid), last).map(lambda event: BillEventType(**event))
@@ -0,0 +1,158 @@
+import re
+from collections import defaultdict
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+import django.utils.timezone as tz
+from zabacus.bills import archive, sharding
+from zabacus.bills.models import Bill, BillItem, SearchEntry
+
+# Full-text search over the names and descriptions of a user's bills and their items (`searchBills`).
+#
+# The index is the SearchEntry table on every shard: one row per bill and per item (archived items
+# included, as they leave the item table), holding its name and description. On MySQL it carries a FULLTEXT
+# index and is searched with MATCH ... AGAINST in boolean mode; on SQLite an FTS5 table mirrors it through
+# triggers (see migration 0014). Other databases fall back to substring matching.
+#
+# A bill or item matches when every word of the query is a prefix of one of its words. Results are the
+# bills the user is involved in that match or have matching items, newest first, each with its matching
+# items, and are paged by keyset on (date, id) so that pages stay stable while bills are added.
+#
+# Entries are written by the mutations themselves, in their transaction on the bill's shard (`bill_changed`
+# and `bill_created`), so the index commits or rolls back with the change and searches see an edit as soon
+# as it is committed. Single-item edits rewrite one entry; imports rewrite the bill's entries. `./manage.py
+# rebuild_search_index` rewrites the whole index.
+
+MAX_TERMS = 8
+MAX_PAGE_SIZE = 100
+
+WORD = re.compile(r'\w+')
+
+
+def _entry_text(name, desc):
+    return '{}\n{}'.format(name, desc)
+
+
+# SearchEntry rows of the bills `bills` on shard `db`
+def entries(db, bills):
+    bills = list(bills)
+    result = [SearchEntry(bill_id=b.id, text=_entry_text(b.name, b.desc)) for b in bills]
+    for bid, iid, name, desc in BillItem.objects.using(db).filter(bill_id__in=[b.id for b in bills]) \
+            .values_list('bill_id', 'id', 'name', 'desc'):
+        result.append(SearchEntry(bill_id=bid, item_id=iid, text=_entry_text(name, desc)))
+    for bid, items in archive.load_archives(db, [b.id for b in bills if b.archived]).items():
+        result.extend(SearchEntry(bill_id=bid, item_id=i['id'], text=_entry_text(i['name'], i['desc'])) for i in items)
+    return result
+
+
+# Rewrite the entries of the bills `bids` on shard `db` (dropping those of deleted bills)
+def reindex_bills(db, bids):
+    with transaction.atomic(using=db):
+        SearchEntry.objects.using(db).filter(bill_id__in=bids).delete()
+        SearchEntry.objects.using(db).bulk_create(entries(db, Bill.objects.using(db).filter(id__in=bids)))
+
+
+# Update the index entries of `bill` after a `kind` of change (see schema.bill_changed) to it or to its item
+# `object_id`, in the current transaction
+def bill_changed(bill, kind, object_id=None):
+    db = sharding.shard_of(bill)
+    entries = SearchEntry.objects.using(db).filter(bill_id=bill.id)
+    if kind == 'bill_updated':
+        entries.filter(item_id__isnull=True).update(text=_entry_text(bill.name, bill.desc))
+    elif kind == 'bill_deleted':
+        entries.delete()
+    elif kind == 'item_deleted':
+        entries.filter(item_id=object_id).delete()
+    elif kind in ('item_added', 'item_updated'):
+        name, desc = BillItem.objects.using(db).values_list('name', 'desc').get(id=object_id)
+        if kind == 'item_added' or not entries.filter(item_id=object_id).update(text=_entry_text(name, desc)):
+            SearchEntry.objects.using(db).create(bill_id=bill.id, item_id=object_id, text=_entry_text(name, desc))
+    elif kind == 'items_imported':
+        reindex_bills(db, [bill.id])
+
+
+# Add the index entries of the new bill `bill`, in the current transaction
+def bill_created(bill):
+    if bill.item_count:
+        # cloned with its items
+        reindex_bills(sharding.shard_of(bill), [bill.id])
+    else:
+        SearchEntry.objects.using(sharding.shard_of(bill)).create(bill_id=bill.id, text=_entry_text(bill.name, bill.desc))
+
+
+# Entries on shard `db` that contain every word in `terms` (as a word prefix)
+def matching_entries(db, terms):
+    entries = SearchEntry.objects.using(db)
+    vendor = connections[db].vendor
+    # columns are left unqualified: Django renames the table when the queryset is used as a subquery
+    if vendor == 'mysql':
+        return entries.extra(where=['MATCH(text) AGAINST (%s IN BOOLEAN MODE)'],
+                             params=[' '.join('+{}*'.format(t) for t in terms)])
+    if vendor == 'sqlite':
+        return entries.extra(where=['id IN (SELECT rowid FROM bills_searchentry_fts '
+                                    'WHERE bills_searchentry_fts MATCH %s)'],
+                             params=[' AND '.join('"{}"*'.format(t) for t in terms)])
+    for t in terms:
+        entries = entries.filter(text__icontains=t)
+    return entries
+
+
+# Words of the query `q`
+def parse_query(q):
+    terms = WORD.findall(q.lower())[:MAX_TERMS]
+    if not terms:
+        raise ValueError('Empty search.')
+    return terms
+
+
+def make_cursor(bill):
+    return '{}|{}'.format(bill.date.isoformat(), bill.id)
+
+
+# (date, bill id) of the last bill of the previous page
+def parse_cursor(cursor):
+    date, _, bid = cursor.rpartition('|')
+    date = parse_datetime(date)
+    if date is None or tz.is_naive(date) or not bid.isdigit():
+        raise ValueError('Invalid cursor.')
+    return date, int(bid)
+
+
+# Up to `limit` matching bills of `user` on shard `db` after `after`, with their matching items
+def search_shard(db, user, terms, after, limit):
+    matches = matching_entries(db, terms)
+    bills = Bill.objects.using(db).filter(people=user, id__in=matches.values('bill_id'))
+    if after is not None:
+        date, bid = after
+        bills = bills.filter(Q(date__lt=date) | Q(date=date, id__lt=bid))
+    bills = list(bills.order_by('-date', '-id')[:limit])
+    item_ids = defaultdict(set)
+    for bid, iid in matches.filter(bill_id__in=[b.id for b in bills], item_id__isnull=False) \
+            .values_list('bill_id', 'item_id'):
+        item_ids[bid].add(iid)
+    hot = BillItem.objects.using(db).in_bulk({iid for ids in item_ids.values() for iid in ids})
+    hits = []
+    for bill in bills:
+        items = [hot[iid] for iid in sorted(item_ids[bill.id]) if iid in hot]
+        for item in items:
+            item.bill = bill
+        items.extend(i for i in archive.archived_items(bill) if i.id in item_ids[bill.id])
+        hits.append((bill, sorted(items, key=lambda i: i.id)))
+    return hits
+
+
+# Page of the bills of `user` matching the query `q`: ([(bill, matching items)], cursor of the next page
+# or None). Raises ValueError for an empty query, a bad page size or a bad cursor.
+def search(user, q, first, after=None):
+    terms = parse_query(q)
+    if not 1 <= first <= MAX_PAGE_SIZE:
+        raise ValueError('Page size must be between 1 and {}.'.format(MAX_PAGE_SIZE))
+    after = None if after is None else parse_cursor(after)
+    # one more than asked for, to tell whether there is a next page
+    results = sharding.fan_out(lambda db, ids: search_shard(db, user, terms, after, first + 1),
+                               sharding.user_shards(user))
+    hits = sorted((hit for hits in results for hit in hits), key=lambda h: (h[0].date, h[0].id), reverse=True)
+    if len(hits) <= first:
+        return hits, None
+    hits = hits[:first]
+    return hits, make_cursor(hits[-1][0])
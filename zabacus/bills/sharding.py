@@ -0,0 +1,312 @@
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections, models, transaction
+from zabacus import caching, routers
+from zabacus.bills.models import Bill, BillItem, InvolvementDirectory
+
+# Horizontal sharding of bill data.
+#
+# A bill and everything hanging off it (items, involvements, weight assignments) live together on one of
+# the databases listed in settings.BILL_SHARDS, while users, tombstones and the involvement directory stay
+# on `default`. The shard of a row is encoded in its id: shard i hands out ids from
+# [i * SHARD_ID_SPAN, (i + 1) * SHARD_ID_SPAN) (see `ensure_id_ranges`), so any bill or item id is routed
+# without a lookup. Shards are identified by their position in BILL_SHARDS and may only be appended.
+#
+# InvolvementDirectory mirrors Involvement on `default`, so queries over all bills of a user only visit
+# the shards holding some of them, in parallel (`fan_out`). The ids of the bills of a user are cached as a
+# set (`bill_ids`), across requests under a per-user version token that `record_members` and
+# `forget_members` replace once their change commits, and for the rest of the current request, so that
+# authorization is a set lookup and bills are only fetched when the row itself is needed. On a DatabaseCache,
+# reading a cached set (its version, then its value) costs two queries on the primary where the directory
+# answers in one: sets are only memoized per request there, and `get_user_bill` checks membership in the
+# query fetching the bill unless the set is at hand.
+#
+# Code touching bill data picks its database explicitly: `get_bill` / `get_item` for lookups by id and
+# `shard_of(obj)` for inserts and queryset updates. ShardRouter makes related managers and saves of
+# sharded objects follow their instance, and keeps global tables off the shards.
+
+SHARD_ID_SPAN = 2 ** 40
+
+SHARDED_MODELS = ('bills.bill', 'bills.billitem', 'bills.involvement', 'bills.itemweightassignment',
+                  'bills.billarchive', 'bills.archivedspending', 'bills.archivedshare', 'bills.searchentry')
+
+FAN_OUT_WORKERS = 8
+
+MEMBERSHIP_CACHE_TIMEOUT = 60 * 60
+
+# membership sets memoized for the request being served by the current thread (see apps.py)
+_request = threading.local()
+
+_membership_cache = caching.VersionedCache('bill-membership', MEMBERSHIP_CACHE_TIMEOUT)
+
+
+def shards():
+    return getattr(settings, 'BILL_SHARDS', [DEFAULT_DB_ALIAS])
+
+
+# Alias of the (primary) database of the shard holding the bill or item with id `object_id`
+def shard_for(object_id):
+    index = int(object_id) // SHARD_ID_SPAN
+    if not 0 <= index < len(shards()):
+        raise ObjectDoesNotExist('No shard holds id {}.'.format(object_id))
+    return shards()[index]
+
+
+# The database to read the bill or item with id `object_id` from (a replica unless pinned to the primary)
+def read_db(object_id):
+    return routers.read_db(shard_for(object_id))
+
+
+# Alias of the database a sharded object is (or will be, for a new one) stored in
+def shard_of(obj):
+    for attr in ('pk', 'bill_id', 'item_id'):
+        key = getattr(obj, attr, None)
+        if key is not None:
+            return shard_for(key)
+    return None
+
+
+def new_bill_shard():
+    return random.choice(shards())
+
+
+def get_bill(bid, **filters):
+    return Bill.objects.using(read_db(bid)).get(id=bid, **filters)
+
+
+def get_item(iid, **filters):
+    return BillItem.objects.using(read_db(iid)).get(id=iid, **filters)
+
+
+def member_ids(bill):
+    return list(bill.involvement_set.values_list('user_id', flat=True))
+
+
+# Users involved in `bill`, as a queryset on the user database
+def members(bill):
+    return get_user_model().objects.filter(id__in=member_ids(bill))
+
+
+def begin_request(**kwargs):
+    _request.memberships = {}
+
+
+def end_request(**kwargs):
+    _request.memberships = None
+
+
+# Membership sets memoized for the current request, for threads working on its behalf
+def request_memberships():
+    return getattr(_request, 'memberships', None)
+
+
+def set_request_memberships(memberships):
+    _request.memberships = memberships
+
+
+# Whether membership sets are cached across requests
+def _caches_memberships():
+    return caching.is_shared() and not caching.is_in_database()
+
+
+# Ids of the bills `user` is involved in, as a frozenset
+def bill_ids(user):
+    memo = getattr(_request, 'memberships', None)
+    if memo is not None and user.id in memo:
+        return memo[user.id]
+    # from the primary: a lagging replica would leave a stale set cached until the next change
+    compute = lambda: frozenset(
+        InvolvementDirectory.objects.using(DEFAULT_DB_ALIAS).filter(user_id=user.id).values_list('bill_id', flat=True))
+    ids = _membership_cache.get_or_compute(user.id, 'ids', compute) if _caches_memberships() else compute()
+    if memo is not None:
+        memo[user.id] = ids
+    return ids
+
+
+def is_member(user, bid):
+    try:
+        return int(bid) in bill_ids(user)
+    except (TypeError, ValueError):
+        return False
+
+
+# The bill with id `bid` (and matching `filters`), provided `user` is involved in it
+def get_user_bill(user, bid, **filters):
+    memo = getattr(_request, 'memberships', None)
+    if not _caches_memberships() and not (memo and user.id in memo):
+        # one indexed join instead of fetching the membership set first
+        try:
+            return get_bill(bid, people=user, **filters)
+        except (TypeError, ValueError, ObjectDoesNotExist):
+            raise Bill.DoesNotExist('Bill matching query does not exist.')
+    if not is_member(user, bid):
+        raise Bill.DoesNotExist('Bill matching query does not exist.')
+    return get_bill(bid, **filters)
+
+
+def _forget_memberships(uids):
+    memo = getattr(_request, 'memberships', None)
+    if memo:
+        for uid in uids:
+            memo.pop(uid, None)
+
+
+def _memberships_changed(uids):
+    _forget_memberships(uids)
+    if _caches_memberships():
+        _membership_cache.bump(uids)
+
+
+# Drop the cached membership sets of the users in `uids` once the current transaction commits
+def memberships_changed(uids):
+    uids = list(uids)
+    _forget_memberships(uids)
+    transaction.on_commit(lambda: _memberships_changed(uids))
+
+
+# Involvement directory; keep it in step with every Involvement insert and delete
+def record_members(bid, uids):
+    uids = list(uids)
+    InvolvementDirectory.objects.bulk_create(
+        [InvolvementDirectory(user_id=uid, bill_id=bid) for uid in uids], ignore_conflicts=True
+    )
+    memberships_changed(uids)
+
+
+def forget_members(bid, uids=None):
+    entries = InvolvementDirectory.objects.filter(bill_id=bid)
+    if uids is None:
+        uids = entries.values_list('user_id', flat=True)
+    else:
+        entries = entries.filter(user_id__in=uids)
+    memberships_changed(uids)
+    entries.delete()
+
+
+# {database to read from: ids of the bills of `user` on that shard}
+def user_shards(user):
+    return bills_by_read_db(bill_ids(user))
+
+
+# {read database: [bill ids]} for the bills `bids`
+def bills_by_read_db(bids):
+    result = {}
+    for bid in sorted(bids):
+        result.setdefault(read_db(bid), []).append(bid)
+    return result
+
+
+# Thread pool of `workers` threads, created lazily
+class ProcessThreadPool:
+    def __init__(self, workers, name):
+        self.workers = workers
+        self.name = name
+        self._lock = threading.Lock()
+        self._pid = None
+        self._pool = None
+
+    def get(self):
+        # one pool per process, so that forked processes (gunicorn workers) get their own threads
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix=self.name)
+            return self._pool
+
+
+_executor = ProcessThreadPool(FAN_OUT_WORKERS, 'zabacus-shards')
+
+
+def _run_on_shard(fn, db, arg):
+    try:
+        return fn(db, arg)
+    finally:
+        close_old_connections()
+
+
+# Run `fn(db, arg)` for every (db, arg) in `shard_args` and return the results. Shards are queried in
+# parallel when there are several; `fn` must return fully evaluated results, not lazy querysets.
+def fan_out(fn, shard_args):
+    if len(shard_args) <= 1:
+        return [fn(db, arg) for db, arg in shard_args.items()]
+    pool = _executor.get()
+    futures = [pool.submit(_run_on_shard, fn, db, arg) for db, arg in shard_args.items()]
+    return [f.result() for f in futures]
+
+
+# Bills `user` is involved in (and that match `filters`), from every shard holding some of them
+def user_bills(user, **filters):
+    results = fan_out(lambda db, ids: list(Bill.objects.using(db).filter(id__in=ids, **filters)), user_shards(user))
+    return [b for bills in results for b in bills]
+
+
+# Bills matching `filters`, looked up on every shard
+def find_bills(**filters):
+    results = fan_out(lambda db, _: list(Bill.objects.using(db).filter(**filters)),
+                      {routers.read_db(s): None for s in shards()})
+    return [b for bills in results for b in bills]
+
+
+# The bill of `user` with the lowest id, if any
+def first_bill(user):
+    ids = bill_ids(user)
+    return get_bill(min(ids)) if ids else None
+
+
+# Make the id counters of the sharded tables on database `using` start at its shard's range. Runs after
+# every migrate (see apps.py); with MySQL before 8.0 the counter of a table that is still empty is reset
+# on server restart, so run migrate for that shard again after restarting it.
+def ensure_id_ranges(using):
+    if using not in shards():
+        return
+    floor = shards().index(using) * SHARD_ID_SPAN
+    if not floor:
+        return
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        tables = set(connection.introspection.table_names(cursor))
+        for label in SHARDED_MODELS:
+            model = apps.get_model(label)
+            table = model._meta.db_table
+            if table not in tables or not isinstance(model._meta.pk, models.AutoField):
+                continue
+            if connection.vendor == 'mysql':
+                # InnoDB never moves the counter below the largest id already present
+                cursor.execute('ALTER TABLE {} AUTO_INCREMENT = {:d}'.format(connection.ops.quote_name(table), floor))
+            elif connection.vendor == 'sqlite':
+                cursor.execute('UPDATE sqlite_sequence SET seq = MAX(seq, %s) WHERE name = %s', [floor, table])
+                cursor.execute('INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s '
+                               'WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)', [table, floor, table])
+
+
+def _is_sharded(model):
+    # not `label_lower`: the stand-in model of DatabaseCache entries does not have it
+    return '{}.{}'.format(model._meta.app_label, model._meta.model_name) in SHARDED_MODELS
+
+
+class ShardRouter:
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if _is_sharded(model) and instance is not None and _is_sharded(type(instance)):
+            return instance._state.db
+        return None
+
+    def db_for_write(self, model, **hints):
+        instance = hints.get('instance')
+        if _is_sharded(model) and instance is not None and _is_sharded(type(instance)):
+            return shard_of(instance)
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if model_name is not None and '{}.{}'.format(app_label, model_name) in SHARDED_MODELS:
+            return db in shards()
+        if db != DEFAULT_DB_ALIAS and db in shards():
+            # global tables only live on default
+            return False
+        return None
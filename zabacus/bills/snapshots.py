@@ -0,0 +1,122 @@
+import json
+from collections import defaultdict
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from zabacus import caching, routers
+from zabacus.bills import archive, sharding, tasks
+from zabacus.bills.models import Bill
+
+# Precomputed bill snapshots, served by the `billSnapshot` query.
+#
+# A snapshot is a compact JSON document holding what a full `showBill` query returns: the bill's fields,
+# its members, its items with their weight assignments and the balances, with users given by username and
+# money in cents:
+#
+#   {"id", "name", "desc", "date", "edited", "status", "version", "archived", "createdBy",
+#    "people": [username],
+#    "items": [{"id", "name", "desc", "date", "edited", "createdBy", "paidBy", "totalCents", "version",
+#               "assignments": {username: cents}}],
+#    "balances": {username: [paid, owed, balance]}}
+#
+# It is rendered once and kept in the cache as a string, so serving it takes the membership check and two
+# cache reads instead of resolving every nested field. As it is kept, it is always rendered from the
+# primary of the bill's shard, never from a replica that may lag behind. Entries are keyed on a per-bill
+# version token (see zabacus/caching.py): once a mutation of the bill commits, `invalidate` replaces the
+# token (later reads never get the old document) and has the background task queue render the new one.
+# On a per-process cache nothing is kept, so nothing is rendered ahead of time either.
+
+CACHE_TIMEOUT = 24 * 60 * 60
+
+_cache = caching.VersionedCache('bill-snapshot', CACHE_TIMEOUT)
+
+
+# Snapshot document of `bill`, freshly computed from the database
+def render(bill):
+    items = archive.items_of(bill)
+    if not bill.archived:
+        items = items.prefetch_related('assignments')
+    items = sorted(items, key=lambda i: i.id)
+    people = sharding.member_ids(bill)
+
+    uids = set(people)
+    uids.add(bill.created_by_id)
+    paid = defaultdict(int)
+    owed = defaultdict(int)
+    for item in items:
+        uids.update((item.created_by_id, item.paid_by_id))
+        paid[item.paid_by_id] += item.total_cents
+        for a in item.assignments.all():
+            uids.add(a.user_id)
+            owed[a.user_id] += a.amount_cents
+    names = dict(get_user_model().objects.filter(id__in=uids).values_list('id', 'username'))
+
+    document = {
+        'id': bill.id,
+        'name': bill.name,
+        'desc': bill.desc,
+        'date': bill.date.isoformat(),
+        'edited': bill.edited.isoformat(),
+        'status': bill.status,
+        'version': bill.version,
+        'archived': bill.archived,
+        'createdBy': names.get(bill.created_by_id),
+        'people': sorted(names[uid] for uid in people if uid in names),
+        'items': [{
+            'id': item.id,
+            'name': item.name,
+            'desc': item.desc,
+            'date': item.date.isoformat(),
+            'edited': item.edited.isoformat(),
+            'createdBy': names.get(item.created_by_id),
+            'paidBy': names.get(item.paid_by_id),
+            'totalCents': item.total_cents,
+            'version': item.version,
+            'assignments': {names.get(a.user_id): a.amount_cents for a in item.assignments.all()},
+        } for item in items],
+        'balances': {
+            names.get(uid): [paid[uid], owed[uid], paid[uid] - owed[uid]] for uid in sorted(set(paid) | set(owed))
+        },
+    }
+    return json.dumps(document, separators=(',', ':'))
+
+
+# Snapshot document of the bill `bid` rendered from the primary of its shard (reusing `bill` if it was
+# read from there), None if the bill was deleted in the meantime
+def _render_primary(bid, bill=None):
+    db = sharding.shard_for(bid)
+    with routers.use_primary():
+        if bill is None or bill._state.db != db:
+            bill = Bill.objects.using(db).filter(id=bid).first()
+        return render(bill) if bill is not None else None
+
+
+# Snapshot of `bill` (a JSON string), rendered on a cache miss
+def get(bill):
+    return _cache.get_or_compute(bill.id, 'document', lambda: _render_primary(bill.id, bill))
+
+
+def _regenerate(bid):
+    if not caching.is_shared():
+        return
+    # the version is read first: a document rendered across a later change ends up under a stale version
+    version = _cache.version(bid)
+    document = _render_primary(bid)
+    if document is not None:
+        _cache.set(bid, 'document', document, version)
+
+
+def _changed(bids):
+    _cache.bump(bids)
+    for bid in bids:
+        tasks.enqueue(_regenerate, bid, key=('bill_snapshot', bid))
+
+
+# Replace the snapshots of the bills `bids` once the current transaction commits; call after any mutation
+# of a bill, its items or its members. New snapshots are rendered in the background, once per burst of edits.
+def invalidate_ids(bids):
+    bids = list(bids)
+    transaction.on_commit(lambda: _changed(bids))
+
+
+def invalidate(bill):
+    invalidate_ids([bill.id])
@@ -0,0 +1,117 @@
+import atexit
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from django.db import close_old_connections, transaction
+from zabacus import conf
+
+# Write-behind queue for non-critical side effects of mutations: change notifications to subscribers
+# (pubsub.py) and pre-rendering of invalidated snapshots (snapshots.py).
+#
+# Tasks run on a background thread of the current process. A task enqueued with a `key` is held for
+# WINDOW seconds, and enqueueing the same key again within that window replaces its arguments instead
+# of adding a second run, so e.g. a burst of item edits on one bill triggers a single recomputation.
+# Tasks without a key run as soon as the worker gets to them. With MODE 'sync' tasks run inline, which
+# is what tests want. Tasks are lost if the process dies and are not retried when they fail, so nothing that
+# correctness depends on goes through here: derived data that must follow a change (search index entries,
+# counters) is written in the mutation's transaction, and cached data it invalidates (snapshots, analytics,
+# membership sets) is dropped in `transaction.on_commit` by the request itself. A lost task only means a
+# missed live notification, or a snapshot rendered by the next request that reads it.
+
+logger = logging.getLogger(__name__)
+
+TASK_QUEUE_SETTINGS = conf.module_settings('TASK_QUEUE', {
+    'MODE': 'thread',
+    'WINDOW': 0.05,
+})
+
+
+class TaskQueue:
+    def __init__(self, window):
+        self.window = window
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()
+        self._ids = itertools.count()
+        self._pid = None
+        self._running = 0
+
+    def _ensure_worker(self):
+        # (re)start the worker lazily, so that forked processes (gunicorn workers) get their own
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._pending.clear()
+            threading.Thread(target=self._work, name='zabacus-tasks', daemon=True).start()
+
+    def enqueue(self, fn, *args, key=None):
+        with self._cond:
+            self._ensure_worker()
+            if key is None:
+                self._pending[('task', next(self._ids))] = (time.monotonic(), fn, args)
+            elif key in self._pending:
+                due, _, _ = self._pending[key]
+                self._pending[key] = (due, fn, args)
+            else:
+                self._pending[key] = (time.monotonic() + self.window, fn, args)
+            self._cond.notify()
+
+    def _take_due(self):
+        now = time.monotonic()
+        due = [k for k, (t, _, _) in self._pending.items() if t <= now]
+        return [self._pending.pop(k)[1:] for k in due]
+
+    def _next_due(self):
+        return min(t for t, _, _ in self._pending.values()) - time.monotonic()
+
+    @staticmethod
+    def _run(batch):
+        close_old_connections()
+        for fn, args in batch:
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception('Background task %s failed.', getattr(fn, '__name__', fn))
+        close_old_connections()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._pending or self._next_due() > 0:
+                    self._cond.wait(self._next_due() if self._pending else None)
+                batch = self._take_due()
+                self._running += 1
+            try:
+                self._run(batch)
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._cond.notify_all()
+
+    # Run everything that is pending right away, and wait for tasks already running to finish
+    def flush(self):
+        with self._cond:
+            batch = [v[1:] for v in self._pending.values()]
+            self._pending.clear()
+        self._run(batch)
+        with self._cond:
+            while self._running:
+                self._cond.wait()
+
+
+queue = TaskQueue(TASK_QUEUE_SETTINGS['WINDOW'])
+atexit.register(queue.flush)
+
+
+def enqueue(fn, *args, key=None):
+    if TASK_QUEUE_SETTINGS['MODE'] == 'sync':
+        fn(*args)
+    else:
+        queue.enqueue(fn, *args, key=key)
+
+
+# Enqueue `fn(*args)` once the current transaction commits (right away outside of a transaction);
+# nothing is enqueued if it rolls back
+def enqueue_on_commit(fn, *args, key=None):
+    transaction.on_commit(lambda: enqueue(fn, *args, key=key))
@@ -0,0 +1,135 @@
+import json
+import tempfile
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from graphql_jwt.shortcuts import get_token
+from zabacus import ratelimit
+from zabacus.bills import sharding
+from zabacus.bills.models import BillItem
+from zabacus.schema import schema
+
+# Helpers shared by the test modules of this package.
+#
+# Tests run GraphQL documents through the real executor (`execute`, `ApiTestCase.run_ok`), or through the
+# whole HTTP stack with the test client (`ApiTestCase.post`), as a user authenticated by a JWT like the apps
+# do. Every test gets empty rate limit buckets and hashing slots of its own. Shards are queried one after
+# the other (`serial_fan_out`), as other threads would not see the data of the test's transaction. The
+# default cache is replaced by a per-process one, on which nothing is cached across requests (see
+# zabacus/caching.py): TestCase never commits, so versions bumped on commit would leave cached values stale
+# from one test to the next. Tests of what follows a commit derive from CommittingApiTestCase instead.
+# Passwords are hashed with MD5, which is enough for tests and much faster.
+
+TEST_SETTINGS = {
+    'PASSWORD_HASHERS': ['django.contrib.auth.hashers.MD5PasswordHasher'],
+    'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'zabacus-tests'}},
+}
+
+HASHING_SLOTS = tempfile.mkdtemp(prefix='zabacus-test-slots-')
+
+
+def recaptcha_success(request):
+    return mock.Mock(read=mock.Mock(return_value=b'{"success": true}'))
+
+
+def user_info(user):
+    build_obj = lambda **kwargs: type("Object", (), kwargs)
+    return build_obj(context=build_obj(user=user))
+
+
+# Execution result of the GraphQL `document` run by `user` with `variables`
+def execute(document, user, **variables):
+    request = RequestFactory().post('/graphql/')
+    request.user = user
+    return schema.execute(document, context_value=request, variables=variables)
+
+
+# sharding.fan_out without the thread pool
+def serial_fan_out(fn, shard_args):
+    return [fn(db, arg) for db, arg in shard_args.items()]
+
+
+# A cap on concurrent password hashing with the server's limits, on lock files of the tests' own
+def hashing_slots():
+    return ratelimit.ConcurrencyCap(HASHING_SLOTS, ratelimit.RATE_LIMIT_SETTINGS['MAX_CONCURRENT'],
+                                    ratelimit.RATE_LIMIT_SETTINGS['MAX_QUEUED'])
+
+
+def create_user(username, password='secret'):
+    user = get_user_model()(username=username, email='{}@example.com'.format(username))
+    user.set_password(password)
+    user.save()
+    return user
+
+
+class ApiTestMixin:
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        # rate limits checked as usual, kept apart from the server's
+        for patcher in (mock.patch.object(ratelimit, 'store', ratelimit.BucketStore(':memory:')),
+                        mock.patch.object(ratelimit, 'hashing', hashing_slots()),
+                        mock.patch.object(sharding, 'fan_out', serial_fan_out)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @classmethod
+    def create_users(cls):
+        cls.owner = create_user('owner')
+        cls.friend = create_user('friend')
+        cls.stranger = create_user('stranger')
+
+    # Data of the GraphQL `document` run by `user`, failing the test on errors
+    def run_ok(self, document, user=None, **variables):
+        result = execute(document, user or self.owner, **variables)
+        self.assertIsNone(result.errors, [str(e) for e in result.errors or []])
+        return result.data
+
+    # Messages of the errors of the GraphQL `document` run by `user`
+    def run_errors(self, document, user=None, **variables):
+        result = execute(document, user or self.owner, **variables)
+        self.assertIsNotNone(result.errors, 'no error')
+        return [str(e) for e in result.errors]
+
+    # A new bill of `user` (the owner by default) shared with `members`, with one item per entry of
+    # `items`: (payer, total, {username: share})
+    def create_bill(self, name='Trip', user=None, members=(), items=()):
+        user = user or self.owner
+        bid = self.run_ok('mutation($name: String!) { createBill(name: $name) { bill { id } } }',
+                          user, name=name)['createBill']['bill']['id']
+        if members:
+            self.run_ok('mutation($bid: ID!, $unames: [String]!) { addUsersToBill(bid: $bid, unames: $unames) '
+                        '{ results { result } } }', user, bid=bid, unames=[m.username for m in members])
+        for payer, total, weights in items:
+            self.add_item(bid, payer, total, weights, user=user)
+        return bid
+
+    # Id of a new item of the bill `bid`, paid by `payer` and shared as in `weights`, {username: amount}
+    def add_item(self, bid, payer, total, weights, name='Dinner', user=None):
+        self.run_ok('mutation($bid: ID!, $payer: ID!, $total: Float!, $weights: JSONString!, $name: String!) '
+                    '{ addBillItem(bid: $bid, iname: $name, idesc: "", payer: $payer, total: $total, '
+                    'weights: $weights) { bill { id } } }', user or self.owner, bid=bid,
+                    payer=payer.id, total=total, weights=json.dumps(weights), name=name)
+        return str(BillItem.objects.using(sharding.shard_for(bid)).filter(bill_id=bid).latest('id').id)
+
+    # Response to POSTing `body` (serialized to JSON) to the GraphQL endpoint as `user` (None: anonymous)
+    def post(self, body, user=None, **headers):
+        if user is not None:
+            headers['HTTP_AUTHORIZATION'] = 'JWT {}'.format(get_token(user))
+        return self.client.post('/graphql/', json.dumps(body), content_type='application/json', **headers)
+
+
+@override_settings(**TEST_SETTINGS)
+class ApiTestCase(ApiTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_users()
+
+
+# For tests of what happens once mutations commit (TestCase never commits)
+@override_settings(**TEST_SETTINGS)
+class CommittingApiTestCase(ApiTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_users()
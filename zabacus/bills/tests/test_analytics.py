@@ -0,0 +1,97 @@
+import tempfile
+from datetime import datetime
+from django.core.cache import cache
+from django.test import override_settings
+import django.utils.timezone as tz
+from zabacus.bills import sharding
+from zabacus.bills.models import BillItem
+from zabacus.bills.tests.base import ApiTestCase, CommittingApiTestCase
+
+# Spending analytics (see analytics.py): mySpending grouped by period, bill or status, with a rolling mean
+# and share percentiles, and billPayers.
+
+SPENDING = 'query($groupBy: String, $window: Int) { mySpending(groupBy: $groupBy, window: $window) ' \
+           '{ buckets { key paidCents owedCents itemCount rollingOwedCents } ' \
+           'sharePercentiles { percentile amountCents } } }'
+PAYERS = 'query($bid: ID!) { billPayers(bid: $bid) { user { username } paidCents itemCount } }'
+
+
+# Noon in the server's time zone (US/Eastern) on `day` of January 2026
+def noon(day):
+    return datetime(2026, 1, day, 17, tzinfo=tz.utc)
+
+
+class SpendingTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bid = self.create_bill(members=[self.friend])
+        self.db = sharding.shard_for(self.bid)
+        for day, payer, total, weights in ((5, self.owner, 3, {'owner': 1, 'friend': 2}),
+                                           (6, self.friend, 5, {'owner': 2.5, 'friend': 2.5}),
+                                           (8, self.owner, 1, {'owner': 1})):
+            iid = self.add_item(self.bid, payer, total, weights)
+            BillItem.objects.using(self.db).filter(id=iid).update(date=noon(day))
+
+    def spending(self, user=None, **variables):
+        return self.run_ok(SPENDING, user, **variables)['mySpending']
+
+    def test_by_day(self):
+        report = self.spending(groupBy='day', window=2)
+        self.assertEqual(report['buckets'], [
+            {'key': '2026-01-05', 'paidCents': 300, 'owedCents': 100, 'itemCount': 1, 'rollingOwedCents': 100},
+            {'key': '2026-01-06', 'paidCents': 0, 'owedCents': 250, 'itemCount': 1, 'rollingOwedCents': 175},
+            {'key': '2026-01-08', 'paidCents': 100, 'owedCents': 100, 'itemCount': 1, 'rollingOwedCents': 175},
+        ])
+        # shares of 100, 250 and 100 cents
+        self.assertEqual(report['sharePercentiles'], [{'percentile': 50, 'amountCents': 100},
+                                                      {'percentile': 90, 'amountCents': 220},
+                                                      {'percentile': 99, 'amountCents': 247}])
+
+    def test_by_month_bill_and_status(self):
+        other = self.create_bill('Other', user=self.friend, members=[self.owner],
+                                 items=[(self.owner, 4, {'owner': 4})])
+        BillItem.objects.using(sharding.shard_for(other)).filter(bill_id=other).update(date=noon(20))
+        self.assertEqual(self.spending(groupBy='month')['buckets'], [
+            {'key': '2026-01-01', 'paidCents': 800, 'owedCents': 850, 'itemCount': 4, 'rollingOwedCents': 850},
+        ])
+        buckets = self.spending(groupBy='bill')['buckets']
+        self.assertEqual({b['key']: (b['owedCents'], b['paidCents']) for b in buckets},
+                         {self.bid: (450, 400), other: (400, 400)})
+        self.run_ok('mutation($bid: ID!) { updateBill(bid: $bid, status: "STL") { bill { id } } }', bid=other)
+        buckets = self.spending(groupBy='status')['buckets']
+        self.assertEqual([(b['key'], b['owedCents']) for b in buckets], [('OPN', 450), ('STL', 400)])
+
+    def test_other_users(self):
+        report = self.spending(self.friend, groupBy='year')
+        self.assertEqual([(b['key'], b['paidCents'], b['owedCents'], b['itemCount']) for b in report['buckets']],
+                         [('2026-01-01', 500, 450, 2)])
+        self.assertEqual(self.spending(self.stranger), {'buckets': [], 'sharePercentiles': []})
+
+    def test_invalid_grouping(self):
+        self.assertEqual(self.run_errors(SPENDING, groupBy='fortnight'), ['Invalid grouping.'])
+        self.assertEqual(self.run_errors(SPENDING, self.stranger, groupBy='fortnight'), ['Invalid grouping.'])
+
+    def test_payers(self):
+        self.add_item(self.bid, self.friend, 0.5, {'friend': 0.5})
+        self.assertEqual(self.run_ok(PAYERS, bid=self.bid)['billPayers'], [
+            {'user': {'username': 'friend'}, 'paidCents': 550, 'itemCount': 2},
+            {'user': {'username': 'owner'}, 'paidCents': 400, 'itemCount': 2},
+        ])
+        self.assertEqual(self.run_errors(PAYERS, self.stranger, bid=self.bid), ['Bill not found.'])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                       'LOCATION': tempfile.mkdtemp(prefix='zabacus-test-cache-')}})
+class CachedSpendingTests(CommittingApiTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.bid = self.create_bill(members=[self.friend], items=[(self.owner, 3, {'owner': 1, 'friend': 2})])
+
+    def owed(self, user):
+        return [b['owedCents'] for b in self.run_ok(SPENDING, user, groupBy='bill')['mySpending']['buckets']]
+
+    def test_item_mutations_invalidate(self):
+        self.assertEqual((self.owed(self.owner), self.owed(self.friend)), ([100], [200]))
+        self.add_item(self.bid, self.friend, 2, {'owner': 1, 'friend': 1}, user=self.friend)
+        self.assertEqual((self.owed(self.owner), self.owed(self.friend)), ([200], [300]))
@@ -0,0 +1,99 @@
+from datetime import timedelta
+from io import StringIO
+from django.core.management import call_command
+import django.utils.timezone as tz
+from zabacus.bills import archive, sharding
+from zabacus.bills.models import ArchivedShare, ArchivedSpending, Bill, BillArchive, BillItem, ItemWeightAssignment
+from zabacus.bills.tests.base import ApiTestCase
+
+# Archival of settled bills (see archive.py): archived bills read the same as before, and reopening one
+# moves its items back.
+
+SHOW_BILL = 'query($bid: ID) { showBill(bid: $bid) { itemCount totalCents items { id name totalCents paidBy { username } ' \
+            'assignments { user { username } amountCents } } balances { user { username } paidCents owedCents } } }'
+SPENDING = 'query($groupBy: String) { mySpending(groupBy: $groupBy) { buckets { key paidCents owedCents itemCount } ' \
+           'sharePercentiles { percentile amountCents } } }'
+PAYERS = 'query($bid: ID!) { billPayers(bid: $bid) { user { username } paidCents itemCount } }'
+
+
+class ArchiveTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bid = self.create_bill(members=[self.friend], items=[
+            (self.owner, 3, {'owner': 1, 'friend': 2}),
+            (self.friend, 5, {'owner': 2.5, 'friend': 2.5}),
+            (self.friend, 1.2, {'friend': 1.2}),
+        ])
+        self.db = sharding.shard_for(self.bid)
+        self.run_ok('mutation($bid: ID!) { updateBill(bid: $bid, status: "STL") { bill { id } } }', bid=self.bid)
+        Bill.objects.using(self.db).filter(id=self.bid).update(edited=tz.now() - timedelta(days=100))
+
+    def views(self):
+        bill = self.run_ok(SHOW_BILL, bid=self.bid)['showBill']
+        bill['items'].sort(key=lambda i: int(i['id']))
+        return [bill, self.run_ok(PAYERS, bid=self.bid)] + \
+            [self.run_ok(SPENDING, user, groupBy=g) for user in (self.owner, self.friend) for g in ('day', 'bill', 'status')]
+
+    def archive(self):
+        return archive.archive_batch(self.db, tz.now() - timedelta(days=30))
+
+    def test_archived_bill_reads_the_same(self):
+        before = self.views()
+        self.assertEqual(self.archive(), ([int(self.bid)], 3))
+        self.assertFalse(BillItem.objects.using(self.db).filter(bill_id=self.bid).exists())
+        self.assertFalse(ItemWeightAssignment.objects.using(self.db).filter(item__bill_id=self.bid).exists())
+        self.assertTrue(BillArchive.objects.using(self.db).filter(bill_id=self.bid).exists())
+        self.assertEqual(self.views(), before)
+
+    def test_summaries(self):
+        self.archive()
+        spending = {uid: (paid, paid_count, owed, owed_count) for uid, paid, paid_count, owed, owed_count in
+                    ArchivedSpending.objects.using(self.db).filter(bill_id=self.bid).values_list(
+                        'user', 'paid_cents', 'paid_count', 'owed_cents', 'owed_count')}
+        self.assertEqual(spending, {self.owner.id: (300, 1, 350, 2), self.friend.id: (620, 2, 570, 3)})
+        shares = set(ArchivedShare.objects.using(self.db).filter(bill_id=self.bid).values_list('user', 'amount_cents', 'count'))
+        self.assertEqual(shares, {(self.owner.id, 100, 1), (self.owner.id, 250, 1), (self.friend.id, 200, 1),
+                                  (self.friend.id, 250, 1), (self.friend.id, 120, 1)})
+
+    def test_only_old_settled_bills(self):
+        open_bid = self.create_bill('Open', items=[(self.owner, 1, {'owner': 1})])
+        Bill.objects.using(sharding.shard_for(open_bid)).filter(id=open_bid).update(edited=tz.now() - timedelta(days=100))
+        Bill.objects.using(self.db).filter(id=self.bid).update(edited=tz.now())
+        self.assertEqual(self.archive(), ([], 0))
+
+    def test_items_added_after_archival(self):
+        self.archive()
+        self.add_item(self.bid, self.owner, 2, {'owner': 2})
+        bill = self.run_ok(SHOW_BILL, bid=self.bid)['showBill']
+        self.assertEqual((bill['itemCount'], bill['totalCents'], len(bill['items'])), (4, 1120, 4))
+        payers = self.run_ok(PAYERS, bid=self.bid)['billPayers']
+        self.assertEqual(payers, [{'user': {'username': 'friend'}, 'paidCents': 620, 'itemCount': 2},
+                                  {'user': {'username': 'owner'}, 'paidCents': 500, 'itemCount': 2}])
+
+    def test_archived_items_are_read_only(self):
+        self.archive()
+        iid = self.run_ok(SHOW_BILL, bid=self.bid)['showBill']['items'][0]['id']
+        errors = self.run_errors('mutation($iid: ID!) { deleteBillItem(iid: $iid) { bill { id } } }', iid=iid)
+        self.assertEqual(errors, ['Invalid item.'])
+
+    def test_reopening_restores_items(self):
+        before = self.views()
+        ids = set(BillItem.objects.using(self.db).filter(bill_id=self.bid).values_list('id', flat=True))
+        self.archive()
+        bill = self.run_ok('mutation($bid: ID!) { updateBill(bid: $bid, status: "OPN") { bill { archived } } }',
+                           bid=self.bid)['updateBill']['bill']
+        self.assertFalse(bill['archived'])
+        self.assertEqual(set(BillItem.objects.using(self.db).filter(bill_id=self.bid).values_list('id', flat=True)), ids)
+        self.assertFalse(BillArchive.objects.using(self.db).filter(bill_id=self.bid).exists())
+        self.assertFalse(ArchivedSpending.objects.using(self.db).filter(bill_id=self.bid).exists())
+        self.assertFalse(ArchivedShare.objects.using(self.db).filter(bill_id=self.bid).exists())
+        after = self.views()
+        # grouped by status, the bill is now counted as open
+        self.assertEqual([v for i, v in enumerate(after) if i not in (4, 7)],
+                         [v for i, v in enumerate(before) if i not in (4, 7)])
+
+    def test_command(self):
+        out = StringIO()
+        call_command('archive_bills', '--days', '30', stdout=out)
+        self.assertIn('Archived 1 bill(s) with 3 item(s).', out.getvalue())
+        self.assertTrue(Bill.objects.using(self.db).get(id=self.bid).archived)
@@ -0,0 +1,78 @@
+from io import StringIO
+from django.core.management import CommandError, call_command
+from zabacus.bills import sharding
+from zabacus.bills.models import Bill, Involvement
+from zabacus.bills.schema import involve_users
+from zabacus.bills.tests.base import ApiTestCase, create_user
+
+# The summary counters of bills (item count, total, member count) kept up to date by every mutation, and
+# `check_bill_counters`, which verifies and repairs them.
+
+COUNTERS = 'query($bid: ID) { showBill(bid: $bid) { itemCount totalCents memberCount } }'
+
+
+class CounterTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bid = self.create_bill(members=[self.friend])
+        self.db = sharding.shard_for(self.bid)
+
+    def counters(self, bid=None):
+        return self.run_ok(COUNTERS, bid=bid or self.bid)['showBill']
+
+    def assertCounters(self, items, total_cents, members, bid=None):
+        self.assertEqual(self.counters(bid), {'itemCount': items, 'totalCents': total_cents, 'memberCount': members})
+        call_command('check_bill_counters', stdout=StringIO())
+
+    def test_item_mutations(self):
+        self.assertCounters(0, 0, 2)
+        iid = self.add_item(self.bid, self.owner, 3.5, {'owner': 1.5, 'friend': 2})
+        self.add_item(self.bid, self.friend, 1, {'friend': 1})
+        self.assertCounters(2, 450, 2)
+        self.run_ok('mutation($iid: ID!) { updateBillItem(iid: $iid, total: 5, weights: "{\\"owner\\": 5}") '
+                    '{ bill { id } } }', iid=iid)
+        self.assertCounters(2, 600, 2)
+        self.run_ok('mutation($iid: ID!) { deleteBillItem(iid: $iid) { bill { id } } }', iid=iid)
+        self.assertCounters(1, 100, 2)
+        rows = 'name,desc,payer,total,weights\nA,,owner,2,"{""owner"": 2}"\n'
+        for data, imported, counters in ((rows + 'B,,nobody,3,"{""owner"": 3}"\n', 0, (1, 100, 2)),
+                                         (rows, 1, (2, 300, 2))):
+            result = self.run_ok('mutation($bid: ID!, $data: String!) { importBillItems(bid: $bid, data: $data) '
+                                 '{ imported } }', bid=self.bid, data=data)
+            self.assertEqual(result['importBillItems']['imported'], imported)
+            self.assertCounters(*counters)
+
+    def test_member_mutations(self):
+        self.run_ok('mutation($bid: ID!) { addUserToBill(bid: $bid, uname: "stranger") { bill { id } } }', bid=self.bid)
+        self.assertCounters(0, 0, 3)
+        self.run_ok('mutation($bid: ID!, $uid: ID!) { removeUserFromBill(bid: $bid, uid: $uid) { bill { id } } }',
+                    bid=self.bid, uid=self.stranger.id)
+        self.assertCounters(0, 0, 2)
+
+    def test_clone(self):
+        self.add_item(self.bid, self.owner, 2, {'owner': 1, 'friend': 1})
+        for with_items, counters in ((False, (0, 0, 2)), (True, (1, 200, 2))):
+            bid = self.run_ok('mutation($bid: ID, $withItems: Boolean) { createBill(name: "Copy", bid: $bid, '
+                              'withItems: $withItems) { bill { id } } }',
+                              bid=self.bid, withItems=with_items)['createBill']['bill']['id']
+            self.assertCounters(*counters, bid=bid)
+
+    def test_involve_users(self):
+        create_user('other')
+        bill = Bill.objects.using(self.db).get(id=self.bid)
+        results = involve_users(bill, ['stranger', 'friend', 'nobody', 'stranger', 'other'])
+        self.assertEqual(results, {'stranger': 'OK', 'friend': 'User already in bill.',
+                                   'nobody': 'Target user does not exist.', 'other': 'OK'})
+        self.assertEqual(Involvement.objects.using(self.db).filter(bill_id=self.bid).count(), 4)
+        self.assertEqual(bill.member_count, 4)
+        self.assertCounters(0, 0, 4)
+
+    def test_repair(self):
+        self.add_item(self.bid, self.owner, 2, {'owner': 2})
+        Bill.objects.using(self.db).filter(id=self.bid).update(item_count=7, total_cents=1)
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('check_bill_counters', stdout=out)
+        self.assertIn('Bill {}: item_count 1 (stored 7), total_cents 200 (stored 1).'.format(self.bid), out.getvalue())
+        call_command('check_bill_counters', '--repair', stdout=out)
+        self.assertCounters(1, 200, 2)
@@ -0,0 +1,83 @@
+import gzip
+import json
+from unittest import mock, skipIf
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+from zabacus import encoding
+from zabacus.bills.tests.base import ApiTestCase
+
+# Encoding and compression of GraphQL responses (see zabacus/encoding.py): bodies are compressed with the
+# best coding the client accepts, and only when it pays off.
+
+BODY = json.dumps({'data': {'listBills': [{'name': 'Trip {}'.format(n)} for n in range(100)]}}).encode()
+
+
+class EncoderTests(SimpleTestCase):
+    def test_compact_json(self):
+        self.assertEqual(encoding.encode_json({'name': 'Café', 'ids': [1, 2], 'desc': None}),
+                         '{"name":"Café","ids":[1,2],"desc":null}'.encode())
+
+    @mock.patch.object(encoding, '_encoder', None)
+    @mock.patch.object(encoding, 'orjson', None)
+    @mock.patch.dict(encoding.RESPONSE_SETTINGS, ENCODER='zabacus.encoding.encode_orjson')
+    def test_orjson_must_be_installed(self):
+        with self.assertRaises(ImproperlyConfigured):
+            encoding.get_encoder()
+
+
+class NegotiationTests(SimpleTestCase):
+    def coding(self, accept_encoding, content=BODY):
+        result = encoding.compress(content, accept_encoding)
+        return result and result[0]
+
+    def test_gzip(self):
+        for accept_encoding in ('gzip', 'deflate, gzip;q=0.5', 'GZIP', 'x-gzip', 'gzip;q=1.0, identity'):
+            with self.subTest(accept_encoding=accept_encoding):
+                coding, body = encoding.compress(BODY, accept_encoding)
+                self.assertEqual(coding, 'gzip')
+                self.assertEqual(gzip.decompress(body), BODY)
+
+    def test_not_accepted(self):
+        for accept_encoding in ('', 'identity', 'deflate', 'gzip;q=0', 'gzip; q=0.0, deflate', 'gzipped'):
+            with self.subTest(accept_encoding=accept_encoding):
+                self.assertIsNone(self.coding(accept_encoding))
+
+    @mock.patch.object(encoding, 'brotli', None)
+    def test_brotli_needs_the_package(self):
+        self.assertEqual(self.coding('br, gzip'), 'gzip')
+        self.assertIsNone(self.coding('br'))
+
+    @skipIf(encoding.brotli is None, 'brotli is not installed')
+    def test_brotli_is_preferred(self):
+        self.assertEqual(self.coding('gzip, br'), 'br')
+        self.assertEqual(self.coding('gzip, br;q=0'), 'gzip')
+
+    def test_small_bodies(self):
+        self.assertIsNone(self.coding('gzip', BODY[:encoding.RESPONSE_SETTINGS['COMPRESS_MIN_SIZE'] - 1]))
+        with mock.patch.dict(encoding.RESPONSE_SETTINGS, COMPRESS_MIN_SIZE=0):
+            # compressing would make it larger
+            self.assertIsNone(self.coding('gzip', b'{}'))
+
+
+class CompressedResponseTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        for n in range(50):
+            self.create_bill('Trip {}'.format(n))
+
+    def list_bills(self, **headers):
+        return self.post({'query': 'query { listBills { id name desc date status } }'}, self.owner, **headers)
+
+    def test_compressed(self):
+        plain = self.list_bills()
+        response = self.list_bills(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+
+    def test_uncompressed(self):
+        response = self.list_bills()
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(len(json.loads(response.content.decode())['data']['listBills']), 50)
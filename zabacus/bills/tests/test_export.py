@@ -0,0 +1,79 @@
+import csv
+import io
+import json
+from datetime import timedelta
+from unittest import mock
+from graphql_jwt.shortcuts import get_token
+import django.utils.timezone as tz
+from zabacus.bills import archive, sharding, views
+from zabacus.bills.models import Bill
+from zabacus.bills.tests.base import ApiTestCase
+
+# Streaming export of a user's bills (see bills/views.py): every bill they are involved in, each followed by
+# its items and each item by its weight assignments.
+
+
+class ExportTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.trip = self.create_bill('Trip', members=[self.friend], items=[
+            (self.owner, 3, {'owner': 1, 'friend': 2}),
+            (self.friend, 1, {'friend': 1}),
+        ])
+        self.party = self.create_bill('Party', user=self.friend, members=[self.owner])
+        self.create_bill('Elsewhere', user=self.stranger, items=[(self.stranger, 2, {'stranger': 2})])
+
+    def export(self, fmt=None, user=None):
+        query = {} if fmt is None else {'format': fmt}
+        headers = {} if user is None else {'HTTP_AUTHORIZATION': 'JWT {}'.format(get_token(user))}
+        return self.client.get('/export/', query, **headers)
+
+    # (type, bill, name or username, amount) of the exported records
+    def records(self, user=None):
+        response = self.export('ndjson', user or self.owner)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        return [(r['type'], str(r['bill_id']), r.get('name', r['username']), r.get('amount_cents'))
+                for r in records]
+
+    # records of the owner's bills, which come in id order
+    def expected(self):
+        records = {
+            self.trip: [('bill', self.trip, 'Trip', None),
+                        ('item', self.trip, 'Dinner', 300), ('assignment', self.trip, 'owner', 100),
+                        ('assignment', self.trip, 'friend', 200),
+                        ('item', self.trip, 'Dinner', 100), ('assignment', self.trip, 'friend', 100)],
+            self.party: [('bill', self.party, 'Party', None)],
+        }
+        return [r for bid in sorted(records, key=int) for r in records[bid]]
+
+    def test_nested_records(self):
+        self.assertEqual(self.records(), self.expected())
+        self.assertEqual(self.records(self.stranger)[0][2], 'Elsewhere')
+
+    def test_batches(self):
+        with mock.patch.object(views, 'EXPORT_BATCH_SIZE', 1), mock.patch.object(views, 'EXPORT_CHUNK_SIZE', 1):
+            self.assertEqual(self.records(), self.expected())
+
+    def test_archived_bills(self):
+        self.run_ok('mutation($bid: ID!) { updateBill(bid: $bid, status: "STL") { bill { id } } }', bid=self.trip)
+        db = sharding.shard_for(self.trip)
+        Bill.objects.using(db).filter(id=self.trip).update(edited=tz.now() - timedelta(days=100))
+        before = self.records()
+        archive.archive_batch(db, tz.now() - timedelta(days=30))
+        self.assertTrue(Bill.objects.using(db).get(id=self.trip).archived)
+        self.assertEqual(self.records(), before)
+
+    def test_csv(self):
+        response = self.export(user=self.owner)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="zabacus-bills.csv"')
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([(r['type'], r['bill_id'], r['name'] or r['username'], r['amount_cents'] or None)
+                          for r in rows],
+                         [(t, b, n, None if a is None else str(a)) for t, b, n, a in self.expected()])
+
+    def test_refused(self):
+        self.assertEqual(self.export('csv').status_code, 401)
+        self.assertEqual(self.export('xml', self.owner).status_code, 400)
+        self.assertEqual(self.client.post('/export/').status_code, 405)
@@ -0,0 +1,123 @@
+import json
+import tempfile
+from io import StringIO
+from unittest import mock
+from django.core.management import CommandError, call_command
+from zabacus.bills import search, sharding
+from zabacus.bills.models import Bill, BillItem
+from zabacus.bills.tests.base import ApiTestCase
+
+# Bulk import of bill items (see importer.py), through importBillItems and `./manage.py import_bill_items`:
+# either every row is imported, or none is and every bad row is reported.
+
+IMPORT = 'mutation($bid: ID!, $data: String!, $format: String) { importBillItems(bid: $bid, data: $data, ' \
+         'format: $format) { imported errors { row message } bill { itemCount totalCents } } }'
+SEARCH = 'query($q: String!) { searchBills(q: $q) { hits { items { name } } } }'
+
+CSV = 'name,desc,payer,total,weights\n' \
+      'Taxi,,owner,3,"{""owner"": 1, ""friend"": 2}"\n' \
+      'Museum,tickets,friend,1.5,"{""friend"": 1.5}"\n'
+
+
+class ImportTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bid = self.create_bill(members=[self.friend])
+        self.db = sharding.shard_for(self.bid)
+
+    def items(self):
+        return list(BillItem.objects.using(self.db).filter(bill_id=self.bid).order_by('id')
+                    .values_list('name', 'desc', 'paid_by', 'total_cents'))
+
+    def run_import(self, data, fmt='csv'):
+        return self.run_ok(IMPORT, bid=self.bid, data=data, format=fmt)['importBillItems']
+
+    def test_csv(self):
+        result = self.run_import(CSV)
+        self.assertEqual(result, {'imported': 2, 'errors': [], 'bill': {'itemCount': 2, 'totalCents': 450}})
+        self.assertEqual(self.items(), [('Taxi', '', self.owner.id, 300), ('Museum', 'tickets', self.friend.id, 150)])
+        self.assertEqual(self.run_ok(SEARCH, q='museum')['searchBills']['hits'], [{'items': [{'name': 'Museum'}]}])
+
+    def test_ndjson(self):
+        rows = [{'name': 'Taxi', 'payer': 'owner', 'total': 3, 'weights': {'owner': 1, 'friend': 2}}, {},
+                {'name': 'Bus', 'payer': 'friend', 'total': '0.5', 'weights': {'friend': 0.5}}]
+        data = '\n'.join(json.dumps(r) if r else '' for r in rows)
+        self.assertEqual(self.run_import(data, 'ndjson')['imported'], 2)
+        self.assertEqual(self.items(), [('Taxi', '', self.owner.id, 300), ('Bus', '', self.friend.id, 50)])
+
+    def test_every_bad_row_is_reported(self):
+        data = CSV + ',,owner,1,"{""owner"": 1}"\n' \
+                     'Hotel,,stranger,1,"{""owner"": 1}"\n' \
+                     'Lunch,,owner,ten,"{""owner"": 1}"\n' \
+                     'Dinner,,owner,2,"{""owner"": 1}"\n' \
+                     'Snacks,,owner,1,"{""stranger"": 1}"\n' \
+                     'Drinks,,owner,1,not json\n'
+        result = self.run_import(data)
+        self.assertEqual(result['imported'], 0)
+        self.assertEqual(result['errors'], [
+            {'row': 3, 'message': 'missing name'},
+            {'row': 4, 'message': 'payer not involved'},
+            {'row': 5, 'message': 'invalid amount'},
+            {'row': 6, 'message': 'weight assignment sum mismatch'},
+            {'row': 7, 'message': 'user stranger not involved'},
+            {'row': 8, 'message': 'invalid weight assignment'},
+        ])
+        # the valid rows before the first bad one are not kept either
+        self.assertEqual(self.items(), [])
+        self.assertEqual(result['bill'], {'itemCount': 0, 'totalCents': 0})
+
+    def test_chunks(self):
+        rows = ''.join('Item {0},,owner,{0},"{{""owner"": {0}}}"\n'.format(n) for n in range(1, 8))
+        with mock.patch('zabacus.bills.importer.IMPORT_CHUNK_SIZE', 3):
+            self.assertEqual(self.run_import('name,desc,payer,total,weights\n' + rows)['imported'], 7)
+        self.assertEqual([total for _, _, _, total in self.items()], [n * 100 for n in range(1, 8)])
+
+    def test_refused(self):
+        self.assertEqual(self.run_errors(IMPORT, bid=self.bid, data=CSV, format='xlsx'), ['Unknown import format.'])
+        self.assertEqual(self.run_errors(IMPORT, self.stranger, bid=self.bid, data=CSV), ['Bill not found.'])
+
+
+class ImportCommandTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bid = self.create_bill(members=[self.friend])
+        self.db = sharding.shard_for(self.bid)
+
+    def call(self, data, *args):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+            f.write(data)
+            f.flush()
+            out, err = StringIO(), StringIO()
+            try:
+                call_command('import_bill_items', self.bid, 'friend', f.name, *args, stdout=out, stderr=err)
+            finally:
+                self.output = out.getvalue() + err.getvalue()
+
+    def test_import(self):
+        edited = Bill.objects.using(self.db).get(id=self.bid).edited
+        self.call(CSV, '--chunk-size', '1')
+        self.assertIn('Imported 2 item(s) into bill {}.'.format(self.bid), self.output)
+        bill = Bill.objects.using(self.db).get(id=self.bid)
+        self.assertEqual((bill.item_count, bill.total_cents), (2, 450))
+        self.assertGreater(bill.edited, edited)
+        self.assertEqual(self.run_ok(SEARCH, q='taxi')['searchBills']['hits'], [{'items': [{'name': 'Taxi'}]}])
+
+    def test_bad_rows(self):
+        with self.assertRaisesMessage(CommandError, '1 invalid row(s), nothing imported.'):
+            self.call(CSV + 'Hotel,,stranger,1,"{""owner"": 1}"\n')
+        self.assertIn('Row 3: payer not involved', self.output)
+        self.assertFalse(BillItem.objects.using(self.db).filter(bill_id=self.bid).exists())
+
+    def test_rolled_back_with_side_effects(self):
+        # the items are not kept without their index entries
+        with mock.patch.object(search, 'bill_changed', side_effect=RuntimeError('index unavailable')):
+            with self.assertRaises(RuntimeError):
+                self.call(CSV)
+        self.assertFalse(BillItem.objects.using(self.db).filter(bill_id=self.bid).exists())
+        self.assertEqual(Bill.objects.using(self.db).get(id=self.bid).item_count, 0)
+
+    def test_refused(self):
+        with self.assertRaisesMessage(CommandError, 'Bill not found.'):
+            call_command('import_bill_items', self.bid, 'stranger', '-', stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, 'User does not exist.'):
+            call_command('import_bill_items', self.bid, 'nobody', '-', stdout=StringIO())
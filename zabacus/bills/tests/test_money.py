@@ -0,0 +1,49 @@
+import json
+from django.test import SimpleTestCase
+from zabacus.bills.models import MAX_CENTS, parse_cents
+from zabacus.bills.tests.base import ApiTestCase
+
+# Money amounts from clients: parsed into exact cents, and item shares adding up to the item total.
+
+ADD_ITEM = 'mutation($bid: ID!, $payer: ID!, $total: Float!, $weights: JSONString!) { addBillItem(bid: $bid, ' \
+           'iname: "Dinner", idesc: "", payer: $payer, total: $total, weights: $weights) { bill { totalCents } } }'
+
+
+class ParseCentsTests(SimpleTestCase):
+    def test_amounts(self):
+        self.assertEqual(parse_cents(12), 1200)
+        self.assertEqual(parse_cents(0.1), 10)
+        self.assertEqual(parse_cents('19.99'), 1999)
+        self.assertEqual(parse_cents(0.005), 1)
+        self.assertEqual(parse_cents(-3.333), -333)
+        self.assertEqual(parse_cents(MAX_CENTS // 100), MAX_CENTS)
+
+    def test_rejected(self):
+        for amount in (True, None, [1], 'ten', '', float('nan'), float('inf'), '-inf', '1e400',
+                       MAX_CENTS // 100 + 1, -MAX_CENTS):
+            with self.subTest(amount=amount), self.assertRaises(ValueError):
+                parse_cents(amount)
+
+
+class WeightAssignmentTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bid = self.create_bill(members=[self.friend])
+
+    def errors(self, total, weights, payer=None):
+        return self.run_errors(ADD_ITEM, bid=self.bid, payer=(payer or self.owner).id, total=total,
+                               weights=json.dumps(weights))
+
+    def test_shares_add_up_exactly(self):
+        # 0.1 + 0.2 is not 0.3 in floating point, but is in cents
+        total = self.run_ok(ADD_ITEM, bid=self.bid, payer=self.owner.id, total=0.3,
+                            weights=json.dumps({'owner': 0.1, 'friend': 0.2}))['addBillItem']['bill']['totalCents']
+        self.assertEqual(total, 30)
+
+    def test_invalid(self):
+        self.assertEqual(self.errors(3, {'owner': 1, 'friend': 1}), ['Invalid weight assignment (sum mismatch).'])
+        self.assertEqual(self.errors(3, {'owner': '3'}), ['Invalid weight assignment (type error).'])
+        self.assertEqual(self.errors(3, {'owner': True}), ['Invalid weight assignment (type error).'])
+        self.assertEqual(self.errors(3, {'stranger': 3}), ['Invalid weight assignment (user not involved).'])
+        self.assertEqual(self.errors(1e300, {'owner': 1e300}), ['Invalid total.'])
+        self.assertEqual(self.errors(3, {'owner': 3}, payer=self.stranger), ['Payor not involved.'])
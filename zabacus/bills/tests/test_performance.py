@@ -0,0 +1,292 @@
+import json
+import os
+import statistics
+import tempfile
+import time
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core import management
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from graphql_jwt.shortcuts import get_token
+from zabacus import ratelimit
+from zabacus.bills import sharding
+from zabacus.bills.schema import AddBillItem, AddUsersToBill, CreateBill
+from zabacus.bills.models import Bill
+from zabacus.bills.tests.base import ApiTestCase, hashing_slots, recaptcha_success, serial_fan_out, user_info
+from zabacus.schema import schema
+
+# Performance regression tests of the GraphQL API.
+#
+# For every entry of FIXTURES, a user is seeded with bills shared with three friends: one bill of the
+# given number of items, on which the operations below work, and smaller ones next to it, so that the
+# user has the given number of bills in all. Every Query and Mutation field of zabacus/schema.py is then
+# run through the real executor for each of these users and must
+#   - succeed,
+#   - run the same number of SQL queries for every fixture (no N+1 over items, assignments, members or
+#     bills), and at most its bound in QUERIES / MUTATIONS.
+# Mutations are rolled back after every run, so all runs start from the same state. Work deferred until
+# the transaction commits (background tasks, cache invalidation) does not happen in tests and is not
+# counted.
+#
+# With ZABACUS_PERF_TIMING=1, every operation must also take no longer than its recorded baseline plus
+# TIMING_TOLERANCE (and TIMING_SLACK seconds, which keeps the fastest operations from failing on noise).
+# Timings are the median of TIMING_RUNS runs with a cold cache. They are left out of the default run:
+# they depend on the machine and on whatever else runs on it. Baselines live in perf_baselines.json next to
+# this file; operations without a baseline are not timed against one. Record them afresh (after a
+# deliberate change, or on a new machine) with:
+#
+#   ZABACUS_RECORD_BASELINES=1 ./manage.py test zabacus.bills.tests.test_performance
+
+# (items of the bill worked on, bills of its owner)
+FIXTURES = ((1, 2), (20, 4), (100, 6))
+# items of each of the other bills
+OTHER_BILL_ITEMS = 3
+TIMING_RUNS = 5
+TIMING_TOLERANCE = float(os.environ.get('ZABACUS_PERF_TOLERANCE', 1.0))
+TIMING_SLACK = 0.005
+BASELINES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'perf_baselines.json')
+RECORD_BASELINES = bool(os.environ.get('ZABACUS_RECORD_BASELINES'))
+TIMED = RECORD_BASELINES or bool(os.environ.get('ZABACUS_PERF_TIMING'))
+
+BILL_FIELDS = 'id name desc date edited status version archived itemCount totalCents memberCount ' \
+              'createdBy { username } people { username firstName lastName }'
+ITEM_FIELDS = 'id name desc date edited totalCents version createdBy { username } paidBy { username } ' \
+              'assignments { user { username } amountCents } bill { id }'
+
+# (field, GraphQL document, variables(fixture), maximum number of queries)
+QUERIES = [
+    ('me', 'query { me { id username email } }', lambda f: {}, 0),
+    ('listBills', 'query { listBills { %s } }' % BILL_FIELDS, lambda f: {}, 5),
+    ('createdBills', 'query { createdBills { %s } }' % BILL_FIELDS, lambda f: {}, 4),
+    ('showBill', 'query($bid: ID) { showBill(bid: $bid) { %s items { %s } '
+                 'balances { user { username } paidCents owedCents balanceCents } } }' % (BILL_FIELDS, ITEM_FIELDS),
+     lambda f: {'bid': f.bid}, 12),
+    ('billSnapshot', 'query($bid: ID!) { billSnapshot(bid: $bid) }', lambda f: {'bid': f.bid}, 6),
+    ('mySpending', 'query { mySpending { buckets { key paidCents owedCents itemCount rollingOwedCents } '
+                   'sharePercentiles { percentile amountCents } } }', lambda f: {}, 6),
+    ('billPayers', 'query($bid: ID!) { billPayers(bid: $bid) { user { username } paidCents itemCount } }',
+     lambda f: {'bid': f.bid}, 4),
+    ('sync', 'query { sync { cursor bills { %s } items { %s } deleted { kind id } } }' % (BILL_FIELDS, ITEM_FIELDS),
+     lambda f: {}, 10),
+    ('sync(since)', 'query($since: String) { sync(since: $since) { cursor bills { id } items { id } '
+                    'deleted { kind id } } }', lambda f: {'since': f.since}, 5),
+    ('searchBills', 'query { searchBills(q: "groc", first: 10) { cursor hits { bill { %s } items { %s } } } }'
+                    % (BILL_FIELDS, ITEM_FIELDS), lambda f: {}, 10),
+]
+
+MUTATIONS = [
+    ('addUserToBill', 'mutation($bid: ID!) { addUserToBill(bid: $bid, uname: "newcomer") { bill { id memberCount } } }',
+     lambda f: {'bid': f.bid}, 8),
+    ('addUsersToBill', 'mutation($bid: ID!) { addUsersToBill(bid: $bid, unames: ["newcomer", "friend1"]) '
+                       '{ bill { id memberCount } results { uname result } } }', lambda f: {'bid': f.bid}, 8),
+    ('removeUserFromBill', 'mutation($bid: ID!, $uid: ID!) { removeUserFromBill(bid: $bid, uid: $uid) '
+                           '{ bill { id memberCount } } }', lambda f: {'bid': f.bid, 'uid': f.idle_uid}, 11),
+    ('addBillItem', 'mutation($bid: ID!, $payer: ID!, $weights: JSONString!) { addBillItem(bid: $bid, '
+                    'iname: "Dinner", idesc: "Friday", payer: $payer, total: 30, weights: $weights) '
+                    '{ bill { id itemCount totalCents } } }',
+     lambda f: {'bid': f.bid, 'payer': f.uid, 'weights': f.weights}, 13),
+    ('updateBillItem', 'mutation($iid: ID!, $weights: JSONString!) { updateBillItem(iid: $iid, iname: "Lunch", '
+                       'total: 30, weights: $weights) { bill { id totalCents } } }',
+     lambda f: {'iid': f.iid, 'weights': f.weights}, 12),
+    ('deleteBillItem', 'mutation($iid: ID!) { deleteBillItem(iid: $iid) { bill { id itemCount } } }',
+     lambda f: {'iid': f.iid}, 10),
+    ('importBillItems', 'mutation($bid: ID!, $data: String!) { importBillItems(bid: $bid, data: $data) '
+                        '{ imported errors { row message } bill { id itemCount } } }',
+     lambda f: {'bid': f.bid, 'data': f.csv}, 14),
+    ('createBill', 'mutation { createBill(name: "Trip", desc: "Summer") { bill { id name } } }', lambda f: {}, 4),
+    ('createBill(bid, withItems)', 'mutation($bid: ID) { createBill(name: "Copy", bid: $bid, withItems: true) '
+                                   '{ bill { id itemCount memberCount } } }', lambda f: {'bid': f.bid}, 17),
+    ('updateBill', 'mutation($bid: ID!) { updateBill(bid: $bid, name: "Renamed", status: "STL") '
+                   '{ bill { id name status version } } }', lambda f: {'bid': f.bid}, 5),
+    ('deleteBill', 'mutation($bid: ID!) { deleteBill(bid: $bid) { result } }', lambda f: {'bid': f.bid}, 13),
+    ('updateUser', 'mutation { updateUser(firstName: "New", email: "new@example.com") { user { id firstName } } }',
+     lambda f: {}, 3),
+    ('tokenAuth', 'mutation($username: String!) { tokenAuth(username: $username, password: "secret") { token } }',
+     lambda f: {'username': f.username}, 1),
+    ('verifyToken', 'mutation($token: String!) { verifyToken(token: $token) { payload } }',
+     lambda f: {'token': f.token}, 0),
+    ('refreshToken', 'mutation($token: String!) { refreshToken(token: $token) { token } }',
+     lambda f: {'token': f.token}, 1),
+    ('createUser', 'mutation { createUser(username: "signup", firstName: "A", lastName: "B", password: "secret", '
+                   'email: "a@example.com", recaptcha: "ok") { user { id } } }', lambda f: {}, 1),
+]
+
+# operations run without a logged-in user
+ANONYMOUS = {'tokenAuth', 'verifyToken', 'refreshToken', 'createUser'}
+
+
+class Fixture:
+    pass
+
+
+def data_queries(queries):
+    return [q for q in queries if not q['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT'))]
+
+
+# a cache of its own: cached memberships of the development cache belong to other databases
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+                   CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                       'LOCATION': tempfile.mkdtemp(prefix='zabacus-test-cache-')}})
+@mock.patch('urllib.request.urlopen', recaptcha_success)
+# rate limits checked as usual, but never reached and kept apart from the server's
+@mock.patch.object(ratelimit, 'store', ratelimit.BucketStore(':memory:'))
+@mock.patch.object(ratelimit, 'hashing', hashing_slots())
+@mock.patch.dict(ratelimit.RATE_LIMIT_SETTINGS, RATES={key: (1000, 1) for key in ratelimit.RATE_LIMIT_SETTINGS['RATES']})
+# queries are counted on the default database, so every bill is kept there
+@mock.patch.object(sharding, 'new_bill_shard', lambda: sharding.shards()[0])
+@mock.patch.object(sharding, 'fan_out', serial_fan_out)
+class ResolverPerformanceTests(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    @mock.patch.object(sharding, 'new_bill_shard', lambda: sharding.shards()[0])
+    @mock.patch.object(sharding, 'fan_out', serial_fan_out)
+    def setUpTestData(cls):
+        User = get_user_model()
+        friends = [User.objects.create(username='friend{}'.format(i)) for i in range(1, 4)]
+        User.objects.create(username='newcomer')
+        cls.fixtures = {}
+        for size, bill_count in FIXTURES:
+            user = User(username='owner{}'.format(size), email='owner{}@example.com'.format(size))
+            user.set_password('secret')
+            user.save()
+            info = user_info(user)
+            # friend3 holds no share, so it can be removed
+            weights = {u.username: 1 for u in [user] + friends[:2]}
+            for n, items in enumerate([OTHER_BILL_ITEMS] * (bill_count - 1) + [size]):
+                bill = CreateBill().mutate(info, 'Bill {} of {}'.format(n, user.username), desc='Shared expenses').bill
+                # the cached bill ids of the user are only replaced on commit, which never comes here
+                cache.clear()
+                AddUsersToBill().mutate(info, bill.id, [u.username for u in friends])
+                for i in range(items):
+                    payer = ([user] + friends[:2])[i % 3]
+                    AddBillItem().mutate(info, bill.id, 'Item {}'.format(i), 'Groceries', payer.id, 3, weights)
+
+            # the bill worked on is the last one
+            f = Fixture()
+            f.bill_count = bill_count
+            f.uid = user.id
+            f.username = user.username
+            f.bid = str(bill.id)
+            f.iid = str(bill.items.order_by('id').values_list('id', flat=True).first())
+            f.idle_uid = str(friends[2].id)
+            f.weights = json.dumps({name: 10 for name in weights})
+            f.csv = 'name,desc,payer,total,weights\n' + ''.join(
+                'Imported {},Row,{},3,"{}"\n'.format(i, user.username, json.dumps(weights).replace('"', '""'))
+                for i in range(5))
+            f.since = bill.edited.isoformat()
+            f.token = get_token(user)
+            cls.fixtures[size] = f
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        try:
+            with open(BASELINES_FILE) as f:
+                cls.baselines = json.load(f)
+        except FileNotFoundError:
+            cls.baselines = {}
+        cls.timings = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        if RECORD_BASELINES:
+            baselines = dict(cls.baselines, **{k: round(v, 5) for k, v in cls.timings.items()})
+            with open(BASELINES_FILE, 'w') as f:
+                json.dump(baselines, f, indent=2, sort_keys=True)
+                f.write('\n')
+        super().tearDownClass()
+
+    # (execution result, SQL queries, seconds) of one run of `document` by `user`, rolled back afterwards
+    def execute(self, document, variables, user):
+        request = RequestFactory().post('/graphql/')
+        request.user = user
+        cache.clear()
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as captured:
+                begin = time.perf_counter()
+                result = schema.execute(document, context_value=request, variables=variables)
+                seconds = time.perf_counter() - begin
+            transaction.set_rollback(True)
+        return result, data_queries(captured.captured_queries), seconds
+
+    def check_operation(self, name, document, variables, max_queries):
+        User = get_user_model()
+        counts = {}
+        for size, _ in FIXTURES:
+            f = self.fixtures[size]
+            where = 'on a bill of {} items (of {} bills)'.format(size, f.bill_count)
+            user = AnonymousUser() if name in ANONYMOUS else User.objects.get(id=f.uid)
+            runs = [self.execute(document, variables(f), user) for _ in range(TIMING_RUNS if TIMED else 1)]
+            result, queries, _ = runs[0]
+            self.assertIsNone(result.errors, '{} failed {}'.format(name, where))
+            counts[size] = len(queries)
+            self.assertLessEqual(len(queries), max_queries, '{} ran {} queries {}:\n{}'.format(
+                name, len(queries), where, '\n'.join(q['sql'] for q in queries)))
+            if not TIMED:
+                continue
+
+            key = '{}/{}'.format(name, size)
+            seconds = statistics.median(s for _, _, s in runs)
+            self.timings[key] = seconds
+            baseline = self.baselines.get(key)
+            if baseline is not None and not RECORD_BASELINES:
+                self.assertLessEqual(seconds, baseline * (1 + TIMING_TOLERANCE) + TIMING_SLACK,
+                                     '{} took {:.1f} ms, baseline {:.1f} ms'.format(key, seconds * 1000, baseline * 1000))
+        self.assertEqual(len(set(counts.values())), 1, '{}: number of queries grows with the bills: {}'.format(
+            name, counts))
+
+    def test_queries(self):
+        for name, document, variables, max_queries in QUERIES:
+            with self.subTest(operation=name):
+                self.check_operation(name, document, variables, max_queries)
+
+    def test_mutations(self):
+        for name, document, variables, max_queries in MUTATIONS:
+            with self.subTest(operation=name):
+                self.check_operation(name, document, variables, max_queries)
+
+    def test_every_field_covered(self):
+        covered = {name.split('(')[0] for name, _, _, _ in QUERIES + MUTATIONS}
+        fields = set(schema.get_query_type().fields) | set(schema.get_mutation_type().fields)
+        self.assertEqual(fields - covered, set())
+
+
+# The deployment cache, a table of the default database, on which every cache read is a query: checking
+# membership must cost no more than the directory lookup it replaces, and requests of logged-in users
+# must not look up read-your-writes pins while no replica is configured.
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                                       'LOCATION': 'zabacus_test_cache'}})
+@mock.patch.object(sharding, 'new_bill_shard', lambda: sharding.shards()[0])
+class DatabaseCacheTests(ApiTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        management.call_command('createcachetable', verbosity=0)
+
+    def setUp(self):
+        super().setUp()
+        self.bid = self.create_bill(members=[self.friend])
+
+    def test_membership_check(self):
+        for user in (self.owner, self.friend):
+            with CaptureQueriesContext(connection) as captured:
+                self.assertEqual(sharding.get_user_bill(user, self.bid).id, int(self.bid))
+            self.assertEqual(len(captured), 1)
+        with CaptureQueriesContext(connection) as captured, self.assertRaises(Bill.DoesNotExist):
+            sharding.get_user_bill(self.stranger, self.bid)
+        self.assertEqual(len(captured), 1)
+        for bid in ('not an id', -1):
+            with self.assertRaises(Bill.DoesNotExist):
+                sharding.get_user_bill(self.owner, bid)
+
+    def test_requests_skip_the_cache(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.post({'query': 'query($bid: ID) { showBill(bid: $bid) { id } }',
+                                  'variables': {'bid': self.bid}}, self.friend)
+        self.assertEqual(json.loads(response.content.decode())['data'], {'showBill': {'id': self.bid}})
+        self.assertEqual([q['sql'] for q in captured if 'zabacus_test_cache' in q['sql']], [])
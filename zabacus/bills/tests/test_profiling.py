@@ -0,0 +1,148 @@
+import os
+import pstats
+import shutil
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import CommandError, call_command
+from django.test import RequestFactory, SimpleTestCase
+from zabacus import profiling
+from zabacus.bills.tests.base import ApiTestCase
+
+# Opt-in profiling of GraphQL operations (see zabacus/profiling.py) and the `summarize_profiles` command
+# merging the profiles it writes.
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class ProfileDirectoryMixin:
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp(prefix='zabacus-test-profiles-')
+        self.addCleanup(shutil.rmtree, self.directory)
+        patcher = mock.patch.dict(profiling.PROFILING_SETTINGS, DIRECTORY=self.directory, INTERVAL=0.001)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def profiles(self):
+        return sorted(os.listdir(self.directory))
+
+
+class LabelTests(SimpleTestCase):
+    def test_named_operations(self):
+        self.assertEqual(profiling.operation_label('query Q { me { id } }', 'Show bill/2'), 'Show_bill_2')
+
+    def test_anonymous_operations(self):
+        self.assertEqual(profiling.operation_label('{ me { id } listBills { id } }'), 'me+listBills')
+        self.assertEqual(profiling.operation_label('query A { me { id } } query B { me { id } }'), 'anonymous')
+        self.assertEqual(profiling.operation_label('{ ...F } fragment F on Query { me { id } }'), 'anonymous')
+        self.assertEqual(profiling.operation_label('query {'), 'invalid')
+
+
+class RequestedModeTests(SimpleTestCase):
+    def request(self, mode=None, staff=False):
+        headers = {} if mode is None else {'HTTP_X_ZABACUS_PROFILE': mode}
+        request = RequestFactory().post('/graphql/', **headers)
+        request.user = mock.Mock(is_staff=True) if staff else AnonymousUser()
+        return request
+
+    def test_header_of_staff_users(self):
+        self.assertEqual(profiling.requested_mode(self.request('cprofile', staff=True)), 'cprofile')
+        self.assertEqual(profiling.requested_mode(self.request('1', staff=True)), 'sample')
+        self.assertIsNone(profiling.requested_mode(self.request('cprofile')))
+        self.assertIsNone(profiling.requested_mode(self.request(staff=True)))
+
+    def test_sample_rate(self):
+        with mock.patch.dict(profiling.PROFILING_SETTINGS, SAMPLE_RATE=1.0, MODE='cprofile'):
+            self.assertEqual(profiling.requested_mode(self.request()), 'cprofile')
+        with mock.patch.dict(profiling.PROFILING_SETTINGS, SAMPLE_RATE=0.5), \
+                mock.patch('random.random', return_value=0.7):
+            self.assertIsNone(profiling.requested_mode(self.request()))
+
+
+class ProfileTests(ProfileDirectoryMixin, SimpleTestCase):
+    def test_sampled_stacks(self):
+        with profiling.profile('sample', 'op'):
+            busy(0.05)
+        [name] = self.profiles()
+        self.assertTrue(name.startswith('op.') and name.endswith('.collapsed'), name)
+        with open(os.path.join(self.directory, name)) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            # from the profiled block down
+            self.assertTrue(stack.startswith('test_sampled_stacks (test_profiling.py:'), stack)
+            self.assertGreater(int(count), 0)
+        self.assertTrue(any('busy (test_profiling.py:' in line for line in lines))
+
+    def test_cprofile(self):
+        with profiling.profile('cprofile', 'op'):
+            busy(0.001)
+        [name] = self.profiles()
+        self.assertTrue(name.endswith('.prof'), name)
+        stats = pstats.Stats(os.path.join(self.directory, name))
+        self.assertIn('busy', {function for _, _, function in stats.stats})
+
+
+class ProfiledRequestTests(ProfileDirectoryMixin, ApiTestCase):
+    def test_staff_header(self):
+        self.owner.is_staff = True
+        self.owner.save()
+        for mode in ('sample', 'cprofile'):
+            self.post({'query': '{ listBills { id } }'}, self.owner, HTTP_X_ZABACUS_PROFILE=mode)
+        self.post({'query': 'query Mine { me { id } }'}, self.friend, HTTP_X_ZABACUS_PROFILE='sample')
+        self.assertEqual([name.split('.')[::4] for name in self.profiles()],
+                         [['listBills', 'collapsed'], ['listBills', 'prof']])
+
+
+class SummarizeProfilesTests(ProfileDirectoryMixin, SimpleTestCase):
+    def write(self, name, lines):
+        with open(os.path.join(self.directory, name), 'w') as f:
+            f.write(''.join(line + '\n' for line in lines))
+
+    def summarize(self, *args):
+        out = StringIO()
+        call_command('summarize_profiles', '--directory', self.directory, *args, stdout=out)
+        return out.getvalue()
+
+    def test_collapsed_stacks(self):
+        self.write('listBills.1.1.1.collapsed', ['view;resolve;query 2', 'view;encode 1'])
+        self.write('listBills.2.1.1.collapsed', ['view;resolve;query 1'])
+        self.write('me.3.1.1.collapsed', ['view;me 1'])
+        self.write('notes.txt', ['not a profile'])
+        output = self.summarize('--operation', 'listBills')
+        self.assertIn('listBills (2 profile(s), collapsed)', output)
+        self.assertIn('4 samples', output)
+        self.assertIn('  75.0%       3  query', output)
+        self.assertIn(' 100.0%       4  view', output)
+        self.assertNotIn('me (', output)
+
+    def test_cprofile_stats(self):
+        with profiling.profile('cprofile', 'showBill'):
+            busy(0.001)
+        output = self.summarize()
+        self.assertIn('showBill (1 profile(s), prof)', output)
+        self.assertIn('busy', output)
+
+    def test_output_and_delete(self):
+        self.write('listBills.1.1.1.collapsed', ['view;query 2'])
+        self.write('listBills.2.1.1.collapsed', ['view;query 1', 'view 1'])
+        merged = tempfile.mkdtemp(prefix='zabacus-test-merged-')
+        self.addCleanup(shutil.rmtree, merged)
+        self.summarize('--output', merged, '--delete')
+        with open(os.path.join(merged, 'listBills.collapsed')) as f:
+            self.assertEqual(f.read(), 'view;query 3\nview 1\n')
+        self.assertEqual(self.profiles(), [])
+        self.assertEqual(self.summarize(), 'No profiles found.\n')
+
+    def test_missing_directory(self):
+        with self.assertRaises(CommandError):
+            call_command('summarize_profiles', '--directory', os.path.join(self.directory, 'missing'),
+                         stdout=StringIO())
@@ -0,0 +1,166 @@
+import json
+import multiprocessing
+import shutil
+import tempfile
+import time
+from unittest import mock
+from django.test import RequestFactory, SimpleTestCase
+from zabacus import ratelimit
+from zabacus.bills.tests.base import ApiTestCase, recaptcha_success
+
+# Rate limits of the authentication mutations (zabacus/ratelimit.py) and their HTTP 429 responses.
+
+TOKEN_AUTH = 'mutation($username: String!, $password: String!) { tokenAuth(username: $username, ' \
+             'password: $password) { token } }'
+RATES = dict(ratelimit.RATE_LIMIT_SETTINGS['RATES'], **{'token_auth:username': (2, 60), 'token_auth:ip': (3, 60)})
+
+
+class ClientAddressTests(SimpleTestCase):
+    def request(self, **meta):
+        return RequestFactory().post('/graphql/', **meta)
+
+    def test_remote_addr(self):
+        self.assertEqual(ratelimit.client_ip(self.request(REMOTE_ADDR='10.0.0.1')), '10.0.0.1')
+        self.assertIsNone(ratelimit.client_ip(self.request(REMOTE_ADDR='')))
+
+    @mock.patch.dict(ratelimit.RATE_LIMIT_SETTINGS, IP_HEADER='HTTP_X_FORWARDED_FOR')
+    def test_forwarded_for(self):
+        # the proxy appends the address it got the request from; whatever comes before is the client's say
+        request = self.request(HTTP_X_FORWARDED_FOR='1.2.3.4, 10.0.0.7', REMOTE_ADDR='')
+        self.assertEqual(ratelimit.client_ip(request), '10.0.0.7')
+        with mock.patch.dict(ratelimit.RATE_LIMIT_SETTINGS, PROXY_COUNT=2):
+            self.assertEqual(ratelimit.client_ip(request), '1.2.3.4')
+            # fewer entries than proxies: the header cannot be trusted
+            self.assertIsNone(ratelimit.client_ip(self.request(HTTP_X_FORWARDED_FOR='10.0.0.7', REMOTE_ADDR='')))
+        self.assertIsNone(ratelimit.client_ip(self.request(REMOTE_ADDR='')))
+
+
+class BucketTests(SimpleTestCase):
+    def test_refill(self):
+        store = ratelimit.BucketStore(':memory:')
+        buckets = [('a', 2, 10)]
+        self.assertEqual(store.take(buckets, now=100), 0)
+        self.assertEqual(store.take(buckets, now=100), 0)
+        self.assertAlmostEqual(store.take(buckets, now=100), 5)
+        # half a period later, one token is back
+        self.assertEqual(store.take(buckets, now=105), 0)
+        self.assertGreater(store.take(buckets, now=105), 0)
+
+    def test_all_or_nothing(self):
+        store = ratelimit.BucketStore(':memory:')
+        store.take([('a', 1, 10)], now=100)
+        self.assertGreater(store.take([('a', 1, 10), ('b', 1, 10)], now=100), 0)
+        # `b` was left untouched
+        self.assertEqual(store.take([('b', 1, 10)], now=100), 0)
+
+
+# Take a slot of `cap` in a process of its own and keep it until `release` is set
+def hold(cap, running, release):
+    with cap.admit():
+        running.set()
+        release.wait(10)
+
+
+class ConcurrencyCapTests(SimpleTestCase):
+    def setUp(self):
+        path = tempfile.mkdtemp(prefix='zabacus-test-slots-')
+        self.addCleanup(shutil.rmtree, path)
+        self.cap = ratelimit.ConcurrencyCap(path, 1, 1)
+        self.release = multiprocessing.Event()
+        self.addCleanup(self.release.set)
+
+    # A process holding a slot until `release` (self.release by default) is set; `running` once it got a
+    # running slot
+    def start_holder(self, release=None):
+        running = multiprocessing.Event()
+        process = multiprocessing.Process(target=hold, args=(self.cap, running, release or self.release), daemon=True)
+        process.start()
+        self.addCleanup(process.join, 10)
+        return process, running
+
+    def assertBusy(self):
+        with self.assertRaises(ratelimit.RateLimitError) as cm, self.cap.admit():
+            pass
+        self.assertEqual(cm.exception.retry_after, 1)
+
+    # Wait until `count` processes are admitted
+    def wait_admitted(self, count):
+        for _ in range(500):
+            busy = [self.cap._lock_slot('admitted', self.cap.limit) for _ in range(self.cap.limit)]
+            for f in busy:
+                if f is not None:
+                    f.close()
+            if busy.count(None) >= count:
+                return
+            time.sleep(0.01)
+        self.fail('{} process(es) not admitted'.format(count))
+
+    def test_shared_between_processes(self):
+        first, first_running = self.start_holder()
+        self.assertTrue(first_running.wait(10))
+        second, second_running = self.start_holder()
+        self.wait_admitted(2)
+        # one running, one waiting: the limit of the host is reached
+        self.assertFalse(second_running.is_set())
+        self.assertBusy()
+        self.release.set()
+        self.assertTrue(second_running.wait(10))
+        first.join(10)
+        second.join(10)
+        with self.cap.admit():
+            pass
+
+    def test_slots_of_dead_processes_are_freed(self):
+        # an event of its own: setting one that a killed process waited on would block
+        process, running = self.start_holder(multiprocessing.Event())
+        self.assertTrue(running.wait(10))
+        process.terminate()
+        process.join(10)
+        with self.cap.admit():
+            pass
+
+    def test_no_slots(self):
+        self.cap = ratelimit.ConcurrencyCap(self.cap.path, 0, 0)
+        self.assertBusy()
+
+
+@mock.patch.dict(ratelimit.RATE_LIMIT_SETTINGS, RATES=RATES)
+class RateLimitTests(ApiTestCase):
+    def token_auth(self, username='owner', password='secret', **meta):
+        return self.post({'query': TOKEN_AUTH, 'variables': {'username': username, 'password': password}}, **meta)
+
+    def test_too_many_attempts(self):
+        self.assertEqual(self.token_auth(password='wrong').status_code, 200)
+        self.assertEqual(self.token_auth().status_code, 200)
+        response = self.token_auth()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(json.loads(response.content.decode())['errors'][0]['message'],
+                         'Too many attempts, please retry in 30 seconds.')
+        # the rejected attempt took nothing: one more attempt from the address, on another account
+        self.assertEqual(self.token_auth('friend').status_code, 200)
+        self.assertEqual(self.token_auth('friend').status_code, 429)
+        self.assertEqual(self.token_auth('friend', REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+    def test_batch(self):
+        operation = {'query': TOKEN_AUTH, 'variables': {'username': 'owner', 'password': 'secret'}}
+        response = self.post([operation] * 3)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual([r['status'] for r in json.loads(response.content.decode())], [200] * 3)
+
+    @mock.patch('urllib.request.urlopen', recaptcha_success)
+    def test_sign_up(self):
+        sign_up = 'mutation($username: String!) { createUser(username: $username, firstName: "A", lastName: "B", ' \
+                  'password: "secret", email: "a@example.com", recaptcha: "ok") { user { id } } }'
+        with mock.patch.dict(ratelimit.RATE_LIMIT_SETTINGS, RATES=dict(RATES, **{'create_user:ip': (1, 3600)})):
+            self.assertEqual(self.post({'query': sign_up, 'variables': {'username': 'new1'}}).status_code, 200)
+            response = self.post({'query': sign_up, 'variables': {'username': 'new2'}})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '3600')
+
+    def test_busy(self):
+        with mock.patch.object(ratelimit, 'hashing', ratelimit.ConcurrencyCap(ratelimit.hashing.path, 0, 0)):
+            response = self.token_auth()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
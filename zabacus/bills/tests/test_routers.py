@@ -0,0 +1,126 @@
+import json
+import tempfile
+import time
+from unittest import mock
+from django.core.cache import cache
+from django.db import connections
+from django.test import SimpleTestCase, override_settings
+from zabacus import routers
+from zabacus.bills import sharding
+from zabacus.bills.models import Bill
+from zabacus.bills.tests.base import ApiTestCase
+
+# Read-replica routing (see zabacus/routers.py): reads made while serving a request go to the replicas,
+# unless the request ran a mutation, or its user wrote within the read-your-writes window.
+
+LIST_BILLS = 'query { listBills { id } }'
+UPDATE_USER = 'mutation { updateUser(firstName: "Fred") { user { id } } }'
+TOKEN_AUTH = 'mutation { tokenAuth(username: "owner", password: "secret") { token } }'
+
+
+class ReadDatabaseTests(SimpleTestCase):
+    def setUp(self):
+        self.addCleanup(routers.set_request_state, (False, False))
+
+    @mock.patch.dict(connections.databases, {'replica': {}, 'shard1_replica': {}})
+    def test_replicas(self):
+        self.assertEqual((routers.read_db(), routers.read_db('shard1')), ('default', 'shard1'))
+        routers.set_request_state((True, False))
+        self.assertEqual((routers.read_db(), routers.read_db('shard1')), ('replica', 'shard1_replica'))
+        # without a replica of its own
+        self.assertEqual(routers.read_db('shard2'), 'shard2')
+        with routers.use_primary():
+            self.assertEqual((routers.read_db(), routers.read_db('shard1')), ('default', 'shard1'))
+        self.assertEqual(routers.read_db(), 'replica')
+        routers.pin_primary()
+        self.assertEqual(routers.read_db(), 'default')
+
+    def test_without_replicas(self):
+        routers.set_request_state((True, False))
+        self.assertEqual(routers.read_db(), 'default')
+        self.assertFalse(routers.has_replicas())
+        with mock.patch.dict(connections.databases, {'shard1_replica': {}}):
+            self.assertTrue(routers.has_replicas())
+
+    @mock.patch.dict(connections.databases, {'replica': {}})
+    def test_router(self):
+        router = routers.ReplicaRouter()
+        routers.set_request_state((True, False))
+        self.assertEqual(router.db_for_read(Bill), 'replica')
+        self.assertEqual(router.db_for_write(Bill), 'default')
+        cache_entry = mock.Mock(_meta=mock.Mock(app_label='django_cache'))
+        self.assertEqual(router.db_for_read(cache_entry), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'bills'))
+
+
+class RoutingTestCase(ApiTestCase):
+    # whether routing takes a replica to be configured (none is, so reads still land on default)
+    replicas = True
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        # routing state of the requests at the time they list bills: (in a request, pinned to the primary)
+        self.states = []
+        for patcher in (mock.patch.object(sharding, 'user_bills', lambda user, **filters:
+                                          self.states.append(routers.request_state()) or []),
+                        mock.patch.object(routers, 'has_replicas', lambda: self.replicas)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def list_bills(self, user):
+        self.post({'query': LIST_BILLS}, user)
+        return self.states.pop()
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                       'LOCATION': tempfile.mkdtemp(prefix='zabacus-test-cache-')}})
+class PinTests(RoutingTestCase):
+    def test_queries_read_from_replicas(self):
+        self.assertEqual(self.list_bills(self.owner), (True, False))
+
+    def test_writes_pin_their_user(self):
+        self.post({'query': UPDATE_USER}, self.owner)
+        self.assertEqual(self.list_bills(self.owner), (True, True))
+        self.assertEqual(self.list_bills(self.friend), (True, False))
+
+    def test_pins_are_kept_per_database(self):
+        with mock.patch.dict(connections['default'].settings_dict, NAME='other.sqlite3'):
+            routers.record_write(self.owner)
+        self.assertEqual(self.list_bills(self.owner), (True, False))
+
+    @override_settings(REPLICA_READ_YOUR_WRITES_WINDOW=1)
+    def test_window(self):
+        self.post({'query': UPDATE_USER}, self.owner)
+        time.sleep(1.1)
+        self.assertEqual(self.list_bills(self.owner), (True, False))
+
+    def test_logins_pin_their_user(self):
+        self.post({'query': TOKEN_AUTH})
+        self.assertEqual(self.list_bills(self.owner), (True, True))
+
+    def test_mutations_pin_the_rest_of_their_request(self):
+        response = self.post([{'query': LIST_BILLS}, {'query': UPDATE_USER}, {'query': LIST_BILLS}], self.friend)
+        self.assertEqual([r['status'] for r in json.loads(response.content.decode())], [200] * 3)
+        self.assertEqual(self.states, [(True, False), (True, True)])
+
+    def test_failed_mutations_pin_too(self):
+        self.post({'query': 'mutation { deleteBill(bid: 1) { result } }'}, self.friend)
+        self.assertEqual(self.list_bills(self.friend), (True, True))
+
+
+class UnsharedCacheTests(RoutingTestCase):
+    # pins kept in a per-process cache would not be seen by the other processes
+    def test_logged_in_users_read_from_the_primary(self):
+        self.assertEqual(self.list_bills(self.owner), (True, True))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                       'LOCATION': tempfile.mkdtemp(prefix='zabacus-test-cache-')}})
+class WithoutReplicasTests(RoutingTestCase):
+    replicas = False
+
+    def test_nothing_is_pinned(self):
+        self.post({'query': UPDATE_USER}, self.owner)
+        self.assertIsNone(cache.get(routers._pin_key(self.owner.id)))
+        self.assertEqual(self.list_bills(self.owner), (True, False))
@@ -0,0 +1,53 @@
+from zabacus.bills.tests.base import ApiTestCase
+
+# Full-text search over bills and items (see search.py), kept up to date by the mutations.
+
+SEARCH = 'query($q: String!, $first: Int, $after: String) { searchBills(q: $q, first: $first, after: $after) ' \
+         '{ cursor hits { bill { name } items { name } } } }'
+
+
+class SearchTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bid = self.create_bill('Ski trip', members=[self.friend])
+        self.iid = self.add_item(self.bid, self.owner, 2, {'owner': 2}, name='Lift passes')
+        self.add_item(self.bid, self.owner, 2, {'owner': 2}, name='Fondue dinner')
+
+    def search(self, q, user=None, **variables):
+        result = self.run_ok(SEARCH, user, q=q, **variables)['searchBills']
+        return [(hit['bill']['name'], sorted(i['name'] for i in hit['items'])) for hit in result['hits']]
+
+    def test_prefixes_of_words(self):
+        self.assertEqual(self.search('ski'), [('Ski trip', [])])
+        self.assertEqual(self.search('lift pass'), [('Ski trip', ['Lift passes'])])
+        self.assertEqual(self.search('DIN'), [('Ski trip', ['Fondue dinner'])])
+        self.assertEqual(self.search('lift dinner'), [])
+        self.assertEqual(self.search('trip', self.friend), [('Ski trip', [])])
+        self.assertEqual(self.search('trip', self.stranger), [])
+
+    def test_follows_edits(self):
+        self.run_ok('mutation($bid: ID!) { updateBill(bid: $bid, name: "Beach trip") { bill { id } } }', bid=self.bid)
+        self.assertEqual(self.search('ski'), [])
+        self.assertEqual(self.search('beach'), [('Beach trip', [])])
+        self.run_ok('mutation($iid: ID!) { updateBillItem(iid: $iid, iname: "Surf lessons") { bill { id } } }',
+                    iid=self.iid)
+        self.assertEqual(self.search('surf'), [('Beach trip', ['Surf lessons'])])
+        self.assertEqual(self.search('lift'), [])
+        self.run_ok('mutation($iid: ID!) { deleteBillItem(iid: $iid) { bill { id } } }', iid=self.iid)
+        self.assertEqual(self.search('surf'), [])
+        self.run_ok('mutation($bid: ID!) { deleteBill(bid: $bid) { result } }', bid=self.bid)
+        self.assertEqual(self.search('fondue'), [])
+
+    def test_pages(self):
+        for n in range(3):
+            self.create_bill('Dinner {}'.format(n))
+        result = self.run_ok(SEARCH, q='dinner', first=2)['searchBills']
+        self.assertEqual([h['bill']['name'] for h in result['hits']], ['Dinner 2', 'Dinner 1'])
+        result = self.run_ok(SEARCH, q='dinner', first=2, after=result['cursor'])['searchBills']
+        self.assertEqual([h['bill']['name'] for h in result['hits']], ['Dinner 0', 'Ski trip'])
+        self.assertIsNone(self.run_ok(SEARCH, q='dinner', first=4)['searchBills']['cursor'])
+
+    def test_invalid(self):
+        self.assertEqual(self.run_errors(SEARCH, q='  !! '), ['Empty search.'])
+        self.assertEqual(self.run_errors(SEARCH, q='ski', first=0), ['Page size must be between 1 and 100.'])
+        self.assertEqual(self.run_errors(SEARCH, q='ski', after='yesterday'), ['Invalid cursor.'])
@@ -0,0 +1,136 @@
+import tempfile
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.db import DatabaseCache
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection
+from django.test import override_settings
+from zabacus.bills import sharding
+from zabacus.bills.models import Bill, BillItem, Involvement, InvolvementDirectory
+from zabacus.bills.tests.base import ApiTestCase
+
+# Routing of bill data to the shards (see sharding.py). The tests placing bills on several shards only run
+# with more than one, e.g. `SQLITE_SHARDS=2 ./manage.py test zabacus.bills`.
+
+MULTIPLE_SHARDS = len(settings.BILL_SHARDS) > 1
+
+
+def on_shard(index):
+    return mock.patch.object(sharding, 'new_bill_shard', lambda: sharding.shards()[index])
+
+
+class RoutingTests(ApiTestCase):
+    def test_shard_for_id(self):
+        for index, db in enumerate(sharding.shards()):
+            self.assertEqual(sharding.shard_for(index * sharding.SHARD_ID_SPAN + 1), db)
+            self.assertEqual(sharding.shard_for(str((index + 1) * sharding.SHARD_ID_SPAN - 1)), db)
+        with self.assertRaises(ObjectDoesNotExist):
+            sharding.shard_for(len(sharding.shards()) * sharding.SHARD_ID_SPAN)
+        with self.assertRaises(ObjectDoesNotExist):
+            sharding.shard_for(-1)
+
+    def test_router(self):
+        router = sharding.ShardRouter()
+        bill = Bill(id=1)
+        self.assertEqual(router.db_for_write(Involvement, instance=bill), sharding.shards()[0])
+        cache_entry = DatabaseCache('zabacus_cache', {}).cache_model_class
+        self.assertIsNone(router.db_for_read(cache_entry, instance=bill))
+        self.assertIsNone(router.db_for_write(cache_entry, instance=bill))
+
+    def test_bill_data_stays_on_its_shard(self):
+        with on_shard(-1):
+            bid = self.create_bill(members=[self.friend], items=[(self.friend, 4, {'owner': 1, 'friend': 3})])
+        db = sharding.shard_for(bid)
+        self.assertEqual(db, sharding.shards()[-1])
+        iid = BillItem.objects.using(db).get(bill_id=bid).id
+        self.assertEqual(sharding.shard_for(iid), db)
+        self.assertEqual(set(Involvement.objects.using(db).filter(bill_id=bid).values_list('user_id', flat=True)),
+                         {self.owner.id, self.friend.id})
+        # the directory on default mirrors the memberships
+        self.assertEqual(set(InvolvementDirectory.objects.filter(bill_id=bid).values_list('user_id', flat=True)),
+                         {self.owner.id, self.friend.id})
+
+    def test_membership(self):
+        bid = self.create_bill(members=[self.friend])
+        self.assertTrue(sharding.is_member(self.friend, bid))
+        self.assertFalse(sharding.is_member(self.stranger, bid))
+        self.assertFalse(sharding.is_member(self.friend, 'not an id'))
+        errors = self.run_errors('query($bid: ID) { showBill(bid: $bid) { id } }', self.stranger, bid=bid)
+        self.assertEqual(errors, ['Bill matching query does not exist.'])
+
+    def test_removed_member_loses_access(self):
+        bid = self.create_bill(members=[self.friend])
+        self.run_ok('mutation($bid: ID!, $uid: ID!) { removeUserFromBill(bid: $bid, uid: $uid) { bill { id } } }',
+                    bid=bid, uid=self.friend.id)
+        self.assertFalse(InvolvementDirectory.objects.filter(bill_id=bid, user=self.friend).exists())
+        self.assertEqual(self.run_ok('query { listBills { id } }', self.friend), {'listBills': []})
+
+    def test_deleted_bill_leaves_directory(self):
+        bid = self.create_bill(members=[self.friend])
+        self.run_ok('mutation($bid: ID!) { deleteBill(bid: $bid) { result } }', bid=bid)
+        self.assertFalse(InvolvementDirectory.objects.filter(bill_id=bid).exists())
+        self.assertFalse(Bill.objects.using(sharding.shard_for(bid)).filter(id=bid).exists())
+
+    def test_global_tables_stay_on_default(self):
+        router = sharding.ShardRouter()
+        for db in sharding.shards()[1:]:
+            self.assertFalse(router.allow_migrate(db, 'auth', 'user'))
+            self.assertFalse(router.allow_migrate(db, 'bills', 'involvementdirectory'))
+            self.assertTrue(router.allow_migrate(db, 'bills', 'bill'))
+
+
+# The default database switched to `name` for the block, as the benchmarks do while sharing the server's cache
+def other_database(name='other.sqlite3'):
+    return mock.patch.dict(connection.settings_dict, NAME=name)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                       'LOCATION': tempfile.mkdtemp(prefix='zabacus-test-cache-')}})
+class SharedCacheTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_databases_keep_their_memberships_apart(self):
+        bid = int(self.create_bill(members=[self.friend]))
+        with other_database():
+            self.assertIn(bid, sharding.bill_ids(self.friend))
+        # this database never had the friend as a member, whatever the other one cached
+        InvolvementDirectory.objects.filter(user=self.friend).delete()
+        self.assertNotIn(bid, sharding.bill_ids(self.friend))
+        with other_database():
+            self.assertIn(bid, sharding.bill_ids(self.friend))
+
+
+@skipUnless(MULTIPLE_SHARDS, 'needs several bill shards')
+class MultipleShardTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bids = []
+        for index in range(len(sharding.shards())):
+            with on_shard(index):
+                self.bids.append(self.create_bill('Bill {}'.format(index), members=[self.friend],
+                                                  items=[(self.owner, 2, {'owner': 1, 'friend': 1})]))
+
+    def test_bills_spread_over_shards(self):
+        self.assertEqual([sharding.shard_for(bid) for bid in self.bids], sharding.shards())
+        self.assertEqual(sharding.user_shards(self.friend), {db: [int(bid)] for db, bid in zip(sharding.shards(), self.bids)})
+
+    def test_queries_cover_every_shard(self):
+        listed = self.run_ok('query { listBills { id } }', self.friend)['listBills']
+        self.assertEqual(sorted(b['id'] for b in listed), sorted(self.bids))
+        synced = self.run_ok('query { sync { bills { id } items { bill { id } } } }', self.friend)['sync']
+        self.assertEqual(sorted(b['id'] for b in synced['bills']), sorted(self.bids))
+        self.assertEqual(sorted(i['bill']['id'] for i in synced['items']), sorted(self.bids))
+        spending = self.run_ok('query { mySpending(groupBy: "bill") { buckets { key owedCents } } }', self.friend)
+        self.assertEqual(sorted(b['key'] for b in spending['mySpending']['buckets']), sorted(self.bids))
+
+    def test_clone_to_another_shard(self):
+        with on_shard(-1):
+            clone = self.run_ok('mutation($bid: ID) { createBill(name: "Copy", bid: $bid, withItems: true) '
+                                '{ bill { id itemCount memberCount items { totalCents } } } }',
+                                bid=self.bids[0])['createBill']['bill']
+        self.assertEqual(sharding.shard_for(clone['id']), sharding.shards()[-1])
+        self.assertEqual((clone['itemCount'], clone['memberCount']), (1, 2))
+        self.assertEqual(clone['items'], [{'totalCents': 200}])
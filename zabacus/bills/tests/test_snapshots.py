@@ -0,0 +1,78 @@
+import json
+import tempfile
+from unittest import mock
+from django.core.cache import cache
+from django.test import override_settings
+from zabacus.bills import sharding, snapshots, tasks
+from zabacus.bills.models import Bill
+from zabacus.bills.tests.base import ApiTestCase, CommittingApiTestCase
+
+# Cached bill snapshots (see snapshots.py): the document matches `showBill`, is served from the cache and is
+# replaced, in the background, once a change to the bill commits. Background tasks run synchronously here.
+
+SNAPSHOT = 'query($bid: ID!) { billSnapshot(bid: $bid) }'
+SHOW_BILL = 'query($bid: ID) { showBill(bid: $bid) { id name status version people { username } ' \
+            'items { id name totalCents paidBy { username } assignments { user { username } amountCents } } ' \
+            'balances { user { username } paidCents owedCents balanceCents } } }'
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                       'LOCATION': tempfile.mkdtemp(prefix='zabacus-test-cache-')}})
+@mock.patch.dict(tasks.TASK_QUEUE_SETTINGS, MODE='sync')
+class SnapshotTests(CommittingApiTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.bid = self.create_bill(members=[self.friend], items=[
+            (self.owner, 3, {'owner': 1, 'friend': 2}),
+            (self.friend, 1, {'friend': 1}),
+        ])
+
+    def snapshot(self, user=None):
+        return json.loads(self.run_ok(SNAPSHOT, user, bid=self.bid)['billSnapshot'])
+
+    def test_matches_show_bill(self):
+        bill = self.run_ok(SHOW_BILL, bid=self.bid)['showBill']
+        document = self.snapshot(self.friend)
+        self.assertEqual([document[f] for f in ('id', 'name', 'status', 'version')],
+                         [int(bill['id']), bill['name'], bill['status'], bill['version']])
+        self.assertEqual(document['people'], sorted(p['username'] for p in bill['people']))
+        items = [{f: i[f] for f in ('id', 'name', 'totalCents', 'paidBy', 'assignments')} for i in document['items']]
+        self.assertEqual(items, [{
+            'id': int(i['id']), 'name': i['name'], 'totalCents': i['totalCents'], 'paidBy': i['paidBy']['username'],
+            'assignments': {a['user']['username']: a['amountCents'] for a in i['assignments']},
+        } for i in sorted(bill['items'], key=lambda i: int(i['id']))])
+        self.assertEqual(document['balances'], {b['user']['username']: [b['paidCents'], b['owedCents'], b['balanceCents']]
+                                                for b in bill['balances']})
+
+    def test_served_from_cache(self):
+        self.snapshot()
+        # a write that skips the mutations (and their invalidation) is not seen
+        Bill.objects.using(sharding.shard_for(self.bid)).filter(id=self.bid).update(name='Behind the back')
+        self.assertEqual(self.snapshot()['name'], 'Trip')
+        snapshots.invalidate_ids([int(self.bid)])
+        self.assertEqual(self.snapshot()['name'], 'Behind the back')
+
+    def test_replaced_after_mutations(self):
+        self.snapshot()
+        self.add_item(self.bid, self.friend, 2, {'owner': 2}, name='Taxi', user=self.friend)
+        # rendered again once the mutation committed, before anyone asks
+        document = json.loads(snapshots._cache.get(int(self.bid), 'document'))
+        self.assertEqual([i['name'] for i in document['items']][-1], 'Taxi')
+        self.assertEqual(document['balances']['owner'], [300, 300, 0])
+        self.run_ok('mutation($bid: ID!) { updateBill(bid: $bid, name: "Renamed") { bill { id } } }', bid=self.bid)
+        self.assertEqual(self.snapshot()['name'], 'Renamed')
+
+    def test_members_only(self):
+        errors = self.run_errors(SNAPSHOT, self.stranger, bid=self.bid)
+        self.assertEqual(errors, ['Bill not found.'])
+
+
+class UnsharedCacheTests(ApiTestCase):
+    def test_rendered_on_request_only(self):
+        bid = self.create_bill()
+        # the document would not be kept: no point rendering it in the background
+        with mock.patch.object(snapshots, '_render_primary') as render:
+            snapshots._regenerate(int(bid))
+        render.assert_not_called()
+        self.assertEqual(json.loads(self.run_ok(SNAPSHOT, bid=bid)['billSnapshot'])['name'], 'Trip')
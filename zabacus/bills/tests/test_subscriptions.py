@@ -0,0 +1,142 @@
+import asyncio
+import json
+from unittest import mock
+from graphql_jwt.shortcuts import get_token
+from zabacus.bills import tasks
+from zabacus.bills.tests.base import CommittingApiTestCase
+from zabacus.subscriptions import GRAPHQL_WS, graphql_ws_app
+
+# billUpdated subscriptions over the graphql-ws protocol (see zabacus/subscriptions.py), driven through the
+# ASGI application by a fake WebSocket client. Events are published inline once a mutation commits.
+
+BILL_UPDATED = 'subscription($bid: ID!) { billUpdated(bid: $bid) { bid kind id } }'
+
+
+class WebSocketClient:
+    def __init__(self, test, subprotocols=(GRAPHQL_WS,)):
+        self.test = test
+        self.incoming = asyncio.Queue()
+        self.outgoing = asyncio.Queue()
+
+        async def send(message):
+            await self.outgoing.put(message)
+
+        self.app = asyncio.ensure_future(graphql_ws_app(
+            {'type': 'websocket', 'path': '/graphql/', 'subprotocols': list(subprotocols)}, self.incoming.get, send))
+        self.incoming.put_nowait({'type': 'websocket.connect'})
+
+    def wait(self, awaitable):
+        return asyncio.get_event_loop().run_until_complete(asyncio.wait_for(awaitable, 5))
+
+    # The next ASGI message sent by the application, with the protocol message of `websocket.send` decoded
+    def receive(self):
+        message = self.wait(self.outgoing.get())
+        if message['type'] == 'websocket.send':
+            return json.loads(message['text'])
+        return message
+
+    def send(self, message):
+        text = message if isinstance(message, str) else json.dumps(message)
+        self.incoming.put_nowait({'type': 'websocket.receive', 'text': text})
+
+    def connect(self, user=None):
+        self.test.assertEqual(self.receive(), {'type': 'websocket.accept', 'subprotocol': GRAPHQL_WS})
+        self.send({'type': 'connection_init', 'payload': {'authToken': 'JWT {}'.format(get_token(user))}
+                   if user else {}})
+        self.test.assertEqual(self.receive(), {'type': 'connection_ack'})
+
+    def subscribe(self, bid, op_id='1'):
+        self.send({'type': 'start', 'id': op_id, 'payload': {'query': BILL_UPDATED, 'variables': {'bid': bid}}})
+        # processed by the time the server answers a later message
+        self.send({'type': 'ping'})
+        self.test.assertEqual(self.receive()['payload'], {'message': 'Unknown message type.'})
+
+    def close(self):
+        self.incoming.put_nowait({'type': 'websocket.disconnect'})
+        self.wait(self.app)
+
+
+class SubscriptionTests(CommittingApiTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.dict(tasks.TASK_QUEUE_SETTINGS, MODE='sync')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.addCleanup(loop.close)
+        self.bid = self.create_bill(members=[self.friend])
+        self.ws = WebSocketClient(self)
+        self.addCleanup(self.ws.close)
+
+    def event(self, kind, object_id=None, op_id='1'):
+        return {'type': 'data', 'id': op_id,
+                'payload': {'data': {'billUpdated': {'bid': self.bid, 'kind': kind, 'id': object_id}}}}
+
+    def test_events(self):
+        self.ws.connect(self.friend)
+        self.ws.subscribe(self.bid)
+        iid = self.add_item(self.bid, self.owner, 2, {'owner': 2})
+        self.assertEqual(self.ws.receive(), self.event('item_added', iid))
+        self.run_ok('mutation($bid: ID!) { updateBill(bid: $bid, name: "Renamed") { bill { id } } }', bid=self.bid)
+        self.assertEqual(self.ws.receive(), self.event('bill_updated'))
+        # nothing more once stopped
+        self.ws.send({'type': 'stop', 'id': '1'})
+        self.ws.subscribe(self.create_bill('Other', user=self.friend), '2')
+        self.add_item(self.bid, self.owner, 2, {'owner': 2})
+        self.ws.send({'type': 'connection_terminate'})
+        self.assertEqual(self.ws.receive(), {'type': 'websocket.close', 'code': 1000})
+
+    def test_members_only(self):
+        for user in (self.stranger, None):
+            client = WebSocketClient(self)
+            client.connect(user)
+            client.send({'type': 'start', 'id': '1', 'payload': {'query': BILL_UPDATED, 'variables': {'bid': self.bid}}})
+            message = client.receive()
+            self.assertEqual((message['type'], message['payload']['data']), ('data', None))
+            self.assertEqual([e['message'] for e in message['payload']['errors']],
+                             ['Bill not found.' if user else 'Not logged in.'])
+            self.assertEqual(client.receive(), {'type': 'complete', 'id': '1'})
+            client.close()
+
+    def test_removal_ends_the_stream(self):
+        self.ws.connect(self.friend)
+        self.ws.subscribe(self.bid)
+        self.run_ok('mutation($bid: ID!, $uid: ID!) { removeUserFromBill(bid: $bid, uid: $uid) { bill { id } } }',
+                    bid=self.bid, uid=self.friend.id)
+        self.assertEqual(self.ws.receive(), self.event('member_removed', str(self.friend.id)))
+        self.assertEqual(self.ws.receive(), {'type': 'complete', 'id': '1'})
+        # the bill's later events are not sent
+        self.add_item(self.bid, self.owner, 2, {'owner': 2})
+        self.ws.send({'type': 'start', 'id': '2', 'payload': {'query': BILL_UPDATED, 'variables': {'bid': self.bid}}})
+        self.assertEqual(self.ws.receive()['payload']['errors'][0]['message'], 'Bill not found.')
+
+    def test_removal_of_others(self):
+        self.run_ok('mutation($bid: ID!) { addUserToBill(bid: $bid, uname: "stranger") { bill { id } } }',
+                    bid=self.bid)
+        self.ws.connect(self.friend)
+        self.ws.subscribe(self.bid)
+        self.run_ok('mutation($bid: ID!, $uid: ID!) { removeUserFromBill(bid: $bid, uid: $uid) { bill { id } } }',
+                    bid=self.bid, uid=self.stranger.id)
+        self.assertEqual(self.ws.receive(), self.event('member_removed', str(self.stranger.id)))
+        self.run_ok('mutation($bid: ID!) { deleteBill(bid: $bid) { result } }', bid=self.bid)
+        self.assertEqual(self.ws.receive(), self.event('bill_deleted'))
+        self.assertEqual(self.ws.receive(), {'type': 'complete', 'id': '1'})
+
+    def test_invalid_messages(self):
+        self.assertEqual(self.ws.receive()['type'], 'websocket.accept')
+        for message in ('not json', '[1, 2]', '"connection_init"', {'type': 'connection_init', 'payload': 'JWT x'},
+                        {'type': 'start', 'id': '1', 'payload': [BILL_UPDATED]}):
+            self.ws.send(message)
+            self.assertEqual(self.ws.receive(), {'type': 'connection_error',
+                                                 'payload': {'message': 'Invalid message.'}})
+        self.ws.send({'type': 'connection_init', 'payload': {'authToken': ['JWT x']}})
+        self.assertEqual(self.ws.receive(), {'type': 'connection_error', 'payload': {'message': 'Invalid token'}})
+        # the connection is still up
+        self.ws.send({'type': 'connection_init', 'payload': {'authToken': 'JWT {}'.format(get_token(self.owner))}})
+        self.assertEqual(self.ws.receive(), {'type': 'connection_ack'})
+
+    def test_subprotocol_required(self):
+        client = WebSocketClient(self, subprotocols=())
+        self.assertEqual(client.receive(), {'type': 'websocket.close', 'code': 1002})
+        client.wait(client.app)
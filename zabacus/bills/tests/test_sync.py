@@ -0,0 +1,72 @@
+from datetime import timedelta
+from django.utils.dateparse import parse_datetime
+import django.utils.timezone as tz
+from zabacus.bills.tests.base import ApiTestCase
+
+# Incremental sync: the bills and items changed since a cursor (their `edited` stamp, bumped by every
+# mutation), and the tombstones of what was deleted or left since.
+
+SYNC = 'query($since: String) { sync(since: $since) { cursor bills { id name } items { id name } ' \
+       'deleted { kind id } } }'
+
+
+class SyncTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bid = self.create_bill(members=[self.friend])
+        self.iid = self.add_item(self.bid, self.owner, 2, {'owner': 1, 'friend': 1}, name='Taxi')
+        self.other = self.create_bill('Other', items=[(self.owner, 1, {'owner': 1})])
+        self.since = tz.now()
+
+    # (ids of the bills, names of the items, deletions) synced by `user` since the cursor `since`
+    def sync(self, user=None, since=None):
+        result = self.run_ok(SYNC, user, since=since and since.isoformat())['sync']
+        return (sorted(b['id'] for b in result['bills']), sorted(i['name'] for i in result['items']),
+                sorted((d['kind'], d['id']) for d in result['deleted']))
+
+    def test_full(self):
+        self.assertEqual(self.sync(), (sorted([self.bid, self.other]), ['Dinner', 'Taxi'], []))
+        self.assertEqual(self.sync(self.friend), ([self.bid], ['Taxi'], []))
+        self.assertEqual(self.sync(self.stranger), ([], [], []))
+
+    def test_cursor(self):
+        result = self.run_ok(SYNC)['sync']
+        # stepped back a little, not to miss rows stamped just before a late commit
+        self.assertLess(parse_datetime(result['cursor']), tz.now() - timedelta(seconds=4))
+        self.assertEqual(self.sync(since=tz.now()), ([], [], []))
+
+    def test_changes_since(self):
+        self.assertEqual(self.sync(since=self.since), ([], [], []))
+        self.run_ok('mutation($iid: ID!) { updateBillItem(iid: $iid, iname: "Cab") { bill { id } } }', iid=self.iid)
+        # the item and its bill
+        self.assertEqual(self.sync(since=self.since), ([self.bid], ['Cab'], []))
+        self.assertEqual(self.sync(self.friend, self.since), ([self.bid], ['Cab'], []))
+        since = tz.now()
+        self.run_ok('mutation($bid: ID!) { updateBill(bid: $bid, name: "Renamed") { bill { id } } }', bid=self.other)
+        self.assertEqual(self.sync(since=since), ([self.other], [], []))
+
+    def test_member_profile_edits(self):
+        self.run_ok('mutation { updateUser(firstName: "Fred") { user { id } } }', self.friend)
+        self.assertEqual(self.sync(since=self.since), ([self.bid], [], []))
+
+    def test_joined_bill_comes_with_its_items(self):
+        self.run_ok('mutation($bid: ID!) { addUserToBill(bid: $bid, uname: "stranger") { bill { id } } }',
+                    bid=self.bid)
+        self.assertEqual(self.sync(self.stranger, self.since), ([self.bid], ['Taxi'], []))
+
+    def test_tombstones(self):
+        self.run_ok('mutation($iid: ID!) { deleteBillItem(iid: $iid) { bill { id } } }', iid=self.iid)
+        for user in (self.owner, self.friend):
+            self.assertEqual(self.sync(user, self.since), ([self.bid], [], [('item', self.iid)]))
+        since = tz.now()
+        self.run_ok('mutation($bid: ID!, $uid: ID!) { removeUserFromBill(bid: $bid, uid: $uid) { bill { id } } }',
+                    bid=self.bid, uid=self.friend.id)
+        self.assertEqual(self.sync(self.friend, since), ([], [], [('bill', self.bid)]))
+        self.run_ok('mutation($bid: ID!) { deleteBill(bid: $bid) { result } }', bid=self.other)
+        self.assertEqual(self.sync(since=since)[2], [('bill', self.other)])
+        # tombstones older than the cursor are not sent again
+        self.assertEqual(self.sync(self.friend, tz.now())[2], [])
+
+    def test_invalid_cursor(self):
+        for since in ('yesterday', '2026-01-01T00:00:00'):
+            self.assertEqual(self.run_errors(SYNC, since=since), ['Invalid cursor.'])
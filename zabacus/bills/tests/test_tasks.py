@@ -0,0 +1,88 @@
+import threading
+from unittest import mock
+from django.db import transaction
+from django.test import SimpleTestCase, TransactionTestCase
+from zabacus.bills import tasks
+
+# The write-behind task queue (see tasks.py): keyed tasks enqueued within the window run once, with the
+# last arguments; tasks enqueued in a transaction only run once it commits.
+
+
+class TaskQueueTests(SimpleTestCase):
+    def setUp(self):
+        self.runs = []
+        self.done = threading.Event()
+
+    def record(self, *args):
+        self.runs.append(args)
+
+    def finish(self):
+        self.done.set()
+
+    # Wait until the queue ran everything enqueued before
+    def wait(self, queue):
+        queue.enqueue(self.finish)
+        self.assertTrue(self.done.wait(5))
+        self.done.clear()
+
+    def test_unkeyed_tasks_run_in_order(self):
+        queue = tasks.TaskQueue(window=10)
+        for n in range(3):
+            queue.enqueue(self.record, n)
+        self.wait(queue)
+        self.assertEqual(self.runs, [(0,), (1,), (2,)])
+
+    def test_keyed_tasks_coalesce(self):
+        queue = tasks.TaskQueue(window=10)
+        for n in range(3):
+            queue.enqueue(self.record, 'bill 1', n, key=('snapshot', 1))
+        queue.enqueue(self.record, 'bill 2', 0, key=('snapshot', 2))
+        # held for the window
+        self.wait(queue)
+        self.assertEqual(self.runs, [])
+        queue.flush()
+        self.assertEqual(self.runs, [('bill 1', 2), ('bill 2', 0)])
+        # a task that ran is not replaced any more
+        queue.enqueue(self.record, 'bill 1', 3, key=('snapshot', 1))
+        queue.flush()
+        self.assertEqual(self.runs[-1], ('bill 1', 3))
+
+    def test_window(self):
+        queue = tasks.TaskQueue(window=0.05)
+        queue.enqueue(self.record, 1, key='k')
+        queue.enqueue(self.finish, key='end')
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.runs, [(1,)])
+
+    def test_failures_are_logged(self):
+        queue = tasks.TaskQueue(window=10)
+        queue.enqueue(int, 'not a number')
+        queue.enqueue(self.record, 'after')
+        with self.assertLogs(tasks.logger) as logs:
+            self.wait(queue)
+        self.assertIn('Background task int failed.', logs.output[0])
+        self.assertEqual(self.runs, [('after',)])
+
+
+class EnqueueOnCommitTests(TransactionTestCase):
+    def setUp(self):
+        self.runs = []
+        patcher = mock.patch.dict(tasks.TASK_QUEUE_SETTINGS, MODE='sync')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_after_commit(self):
+        with transaction.atomic():
+            tasks.enqueue_on_commit(self.runs.append, 1)
+            self.assertEqual(self.runs, [])
+        self.assertEqual(self.runs, [1])
+
+    def test_not_after_rollback(self):
+        with transaction.atomic():
+            tasks.enqueue_on_commit(self.runs.append, 1)
+            transaction.set_rollback(True)
+        self.assertEqual(self.runs, [])
+
+    def test_outside_of_transactions(self):
+        tasks.enqueue_on_commit(self.runs.append, 1)
+        self.assertEqual(self.runs, [1])
@@ -0,0 +1,83 @@
+from unittest import mock
+from django.db import OperationalError, transaction
+from django.test import TransactionTestCase
+import django.utils.timezone as tz
+from zabacus.bills import transactions
+from zabacus.bills.models import Tombstone
+from zabacus.bills.tests.base import create_user
+
+# The transaction layer of mutations (see transactions.py): a mutation aborted by a deadlock or a lock
+# timeout is rolled back and run again, anything else fails at once.
+
+
+class FlakyMutation:
+    # `errors`: raised by the first calls, one each, after writing a row
+    def __init__(self, user, errors):
+        self.user = user
+        self.errors = list(errors)
+
+    @transactions.atomic_mutation
+    def mutate(self, info):
+        Tombstone.objects.create(user=self.user, kind=Tombstone.BILL, object_id=1, deleted=tz.now())
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'OK'
+
+
+@mock.patch('time.sleep')
+class RetryTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        transactions.retry_stats.reset()
+        self.addCleanup(transactions.retry_stats.reset)
+        self.user = create_user('owner')
+
+    def mutate(self, *errors):
+        return FlakyMutation(self.user, errors).mutate(None)
+
+    # mutate(*errors), which logs its retries
+    def mutate_retried(self, *errors):
+        with self.assertLogs(transactions.logger, 'WARNING'):
+            return self.mutate(*errors)
+
+    def stats(self):
+        return transactions.retry_stats.snapshot()['FlakyMutation']
+
+    def test_retried_until_it_commits(self, sleep):
+        locked = OperationalError('database is locked')
+        deadlock = OperationalError(1213, 'Deadlock found when trying to get lock; try restarting transaction')
+        self.assertEqual(self.mutate_retried(locked, deadlock), 'OK')
+        self.assertEqual(self.stats(), {'calls': 1, 'retries': 2, 'failures': 0})
+        self.assertEqual(sleep.call_count, 2)
+        # the aborted attempts were rolled back
+        self.assertEqual(Tombstone.objects.count(), 1)
+
+    def test_other_errors_are_not_retried(self, sleep):
+        for error in (OperationalError('no such table: bills_bill'), OperationalError(1054, 'Unknown column'),
+                      ValueError('bug')):
+            with self.subTest(error=error), self.assertRaises(type(error)):
+                self.mutate(error)
+        self.assertEqual(self.stats(), {'calls': 3, 'retries': 0, 'failures': 2})
+        sleep.assert_not_called()
+        self.assertEqual(Tombstone.objects.count(), 0)
+
+    @mock.patch.dict(transactions.RETRY_SETTINGS, ATTEMPTS=3)
+    def test_gives_up(self, sleep):
+        with self.assertRaises(OperationalError):
+            self.mutate_retried(*[OperationalError('database is locked')] * 3)
+        self.assertEqual(self.stats(), {'calls': 1, 'retries': 2, 'failures': 1})
+        self.assertEqual(Tombstone.objects.count(), 0)
+
+    def test_backoff(self, sleep):
+        with mock.patch('random.uniform', side_effect=lambda low, high: high):
+            self.mutate_retried(*[OperationalError('database is locked')] * 9)
+        delays = [call[0][0] for call in sleep.call_args_list]
+        self.assertEqual(delays, [0.02, 0.04, 0.08, 0.16, 0.32, 0.64, 1.0, 1.0, 1.0])
+
+    def test_nested_mutations_are_not_retried(self, sleep):
+        # the enclosing transaction is what the database aborted: retrying within it would not help
+        with self.assertRaises(OperationalError), transaction.atomic():
+            self.mutate(OperationalError('database is locked'))
+        self.assertEqual(self.stats(), {'calls': 1, 'retries': 0, 'failures': 0})
+        self.assertEqual(Tombstone.objects.count(), 0)
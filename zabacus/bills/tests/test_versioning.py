@@ -0,0 +1,50 @@
+from zabacus.bills import sharding
+from zabacus.bills.models import Bill
+from zabacus.bills.schema import ConflictError, save_versioned
+from zabacus.bills.tests.base import ApiTestCase
+
+# Optimistic concurrency control of bill and item edits: a write carrying the version it was based on
+# only applies if nobody else wrote the row since.
+
+UPDATE_BILL = 'mutation($bid: ID!, $name: String, $version: Int) { updateBill(bid: $bid, name: $name, ' \
+              'version: $version) { bill { name version } } }'
+UPDATE_ITEM = 'mutation($iid: ID!, $name: String, $version: Int) { updateBillItem(iid: $iid, iname: $name, ' \
+              'version: $version) { bill { items { name version } } } }'
+
+
+class VersioningTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bid = self.create_bill(members=[self.friend])
+        self.iid = self.add_item(self.bid, self.owner, 2, {'owner': 1, 'friend': 1})
+
+    def test_edit_bumps_version(self):
+        bill = self.run_ok(UPDATE_BILL, bid=self.bid, name='One', version=1)['updateBill']['bill']
+        self.assertEqual(bill, {'name': 'One', 'version': 2})
+        # without a version, the edit applies to whatever version is current
+        bill = self.run_ok(UPDATE_BILL, self.friend, bid=self.bid, name='Two')['updateBill']['bill']
+        self.assertEqual(bill, {'name': 'Two', 'version': 3})
+
+    def test_stale_bill_version_conflicts(self):
+        self.run_ok(UPDATE_BILL, bid=self.bid, name='Mine', version=1)
+        errors = self.run_errors(UPDATE_BILL, self.friend, bid=self.bid, name='Theirs', version=1)
+        self.assertEqual(errors, ['Conflict: Bill was modified concurrently, please reload and retry.'])
+        bill = Bill.objects.using(sharding.shard_for(self.bid)).get(id=self.bid)
+        self.assertEqual((bill.name, bill.version), ('Mine', 2))
+
+    def test_stale_item_version_conflicts(self):
+        items = self.run_ok(UPDATE_ITEM, iid=self.iid, name='Lunch', version=1)['updateBillItem']['bill']['items']
+        self.assertEqual(items, [{'name': 'Lunch', 'version': 2}])
+        errors = self.run_errors(UPDATE_ITEM, iid=self.iid, name='Dinner', version=1)
+        self.assertEqual(errors, ['Conflict: BillItem was modified concurrently, please reload and retry.'])
+
+    def test_conflicting_save(self):
+        db = sharding.shard_for(self.bid)
+        mine = Bill.objects.using(db).get(id=self.bid)
+        theirs = Bill.objects.using(db).get(id=self.bid)
+        mine.name = 'Mine'
+        save_versioned(mine, ['name'])
+        theirs.name = 'Theirs'
+        with self.assertRaises(ConflictError):
+            save_versioned(theirs, ['name'])
+        self.assertEqual(Bill.objects.using(db).get(id=self.bid).name, 'Mine')
@@ -0,0 +1,98 @@
+import json
+from unittest import mock
+from zabacus import views
+from zabacus.bills.tests.base import ApiTestCase
+
+# The GraphQL endpoint (zabacus/views.py): conditional responses to bill queries and batched operations.
+
+SHOW_BILL = 'query($bid: ID) { showBill(bid: $bid) { name items { name } } }'
+LIST_BILLS = 'query { listBills { name } }'
+ADD_ITEM = 'mutation($bid: ID!, $payer: ID!) { addBillItem(bid: $bid, iname: "Taxi", idesc: "", payer: $payer, ' \
+           'total: 1, weights: "{\\"owner\\": 1}") { bill { itemCount } } }'
+
+
+class ETagTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bid = self.create_bill(members=[self.friend])
+
+    def get(self, query, user=None, etag=None, **variables):
+        headers = {} if etag is None else {'HTTP_IF_NONE_MATCH': etag}
+        return self.post({'query': query, 'variables': variables}, user or self.owner, **headers)
+
+    def test_unchanged_query_is_not_modified(self):
+        response = self.get(SHOW_BILL, bid=self.bid)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        response = self.get(SHOW_BILL, etag=etag, bid=self.bid)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+    def test_changes_renew_the_etag(self):
+        etags = [self.get(SHOW_BILL, bid=self.bid)['ETag'], self.get(LIST_BILLS)['ETag']]
+        self.post({'query': ADD_ITEM, 'variables': {'bid': self.bid, 'payer': self.owner.id}}, self.owner)
+        for query, etag in zip((SHOW_BILL, LIST_BILLS), etags):
+            response = self.get(query, etag=etag, bid=self.bid)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('Taxi', self.get(SHOW_BILL, etag=etags[0], bid=self.bid).content.decode())
+
+    def test_profile_edits_of_members_renew_the_etag(self):
+        etag = self.get(SHOW_BILL, bid=self.bid)['ETag']
+        self.post({'query': 'mutation { updateUser(firstName: "Fred") { user { id } } }'}, self.friend)
+        self.assertEqual(self.get(SHOW_BILL, etag=etag, bid=self.bid).status_code, 200)
+
+    def test_etag_is_per_user_and_query(self):
+        etag = self.get(SHOW_BILL, bid=self.bid)['ETag']
+        self.assertEqual(self.get(SHOW_BILL, self.friend, etag=etag, bid=self.bid).status_code, 200)
+        self.assertNotEqual(self.get(SHOW_BILL, self.friend, bid=self.bid)['ETag'], etag)
+        self.assertNotEqual(self.get(LIST_BILLS)['ETag'], etag)
+
+    def test_no_etag(self):
+        # mutations, other fields, failed queries
+        self.assertFalse(self.post({'query': ADD_ITEM, 'variables': {'bid': self.bid, 'payer': self.owner.id}},
+                                   self.owner).has_header('ETag'))
+        self.assertFalse(self.get('query { me { id } }').has_header('ETag'))
+        response = self.get(SHOW_BILL, self.stranger, bid=self.bid)
+        self.assertIn('errors', json.loads(response.content.decode()))
+        self.assertFalse(response.has_header('ETag'))
+
+
+class BatchTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bid = self.create_bill()
+
+    def batch(self, *operations, user=None):
+        response = self.post([dict(op, id=n) for n, op in enumerate(operations)], user or self.owner)
+        return response, json.loads(response.content.decode())
+
+    def test_operations_run_in_order(self):
+        response, results = self.batch(
+            {'query': 'query($bid: ID) { showBill(bid: $bid) { itemCount } }', 'variables': {'bid': self.bid}},
+            {'query': ADD_ITEM, 'variables': {'bid': self.bid, 'payer': self.owner.id}},
+            {'query': 'query($bid: ID) { showBill(bid: $bid) { itemCount } }', 'variables': {'bid': self.bid}},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['id'] for r in results], [0, 1, 2])
+        self.assertEqual([r['status'] for r in results], [200] * 3)
+        self.assertEqual(results[0]['data'], {'showBill': {'itemCount': 0}})
+        self.assertEqual(results[1]['data'], {'addBillItem': {'bill': {'itemCount': 1}}})
+        self.assertEqual(results[2]['data'], {'showBill': {'itemCount': 1}})
+
+    def test_failures_stay_with_their_operation(self):
+        response, results = self.batch({'query': 'query { me { username } }'}, {'query': 'query { nope }'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(results[0], {'data': {'me': {'username': 'owner'}}, 'id': 0, 'status': 200})
+        self.assertEqual(results[1]['status'], 400)
+        self.assertIn('errors', results[1])
+
+    @mock.patch.dict(views.BATCH_SETTINGS, MAX_OPERATIONS=2)
+    def test_limits(self):
+        response, result = self.batch(*[{'query': 'query { me { id } }'}] * 3)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(result['errors'][0]['message'], 'Batches are limited to 2 operations.')
+        response = self.post([{'query': 'query { me { id } }'}, 'me'], self.owner)
+        self.assertEqual(response.status_code, 400)
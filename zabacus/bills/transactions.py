@@ -0,0 +1,145 @@
+import functools
+import inspect
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, transaction
+from zabacus import conf
+from zabacus.bills import sharding
+
+# Transaction layer for mutations.
+#
+# `atomic_mutation` runs a mutation in one database transaction and, when the database aborts it because
+# of a deadlock or a lock wait / busy timeout, rolls back and runs it again after a jittered exponential
+# backoff. Retries only happen at the outermost level: a mutation called inside an existing transaction
+# just gets a savepoint, since the enclosing transaction is what the database rolled back.
+#
+# A mutation holds one transaction on `default` and one on each bill shard it writes to: the shards of the
+# bills and items named by its `bid` and `iid` arguments are enlisted up front, and a mutation that writes
+# to any other shard (a new bill's) must `enlist` it before its first write there. Mutations of one bill
+# thus never open transactions on the other shards. The transactions are committed one after the other
+# (shards first), not with a two-phase commit, so a crash in between can leave a shard's changes without
+# their global counterpart (the involvement directory, tombstones).
+
+logger = logging.getLogger(__name__)
+
+RETRY_SETTINGS = conf.module_settings('MUTATION_RETRY', {
+    'ATTEMPTS': 10,
+    # backoff before retry n is uniform in [0, min(MAX_DELAY, BASE_DELAY * 2 ** n)] seconds
+    'BASE_DELAY': 0.01,
+    'MAX_DELAY': 1.0,
+})
+
+# MySQL: deadlock found, lock wait timeout exceeded
+MYSQL_RETRYABLE_CODES = (1213, 1205)
+
+
+def is_retryable(exc):
+    if not isinstance(exc, OperationalError):
+        return False
+    if exc.args and exc.args[0] in MYSQL_RETRYABLE_CODES:
+        return True
+    # SQLite reports busy / deadlocked writers as "database is locked"
+    return 'database is locked' in str(exc)
+
+
+class RetryStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = Counter()
+
+    def incr(self, name, key):
+        with self._lock:
+            self._counters[(name, key)] += 1
+
+    # {mutation name: {'calls': .., 'retries': .., 'failures': ..}}
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for (name, key), count in self._counters.items():
+                result.setdefault(name, {'calls': 0, 'retries': 0, 'failures': 0})[key] = count
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+
+retry_stats = RetryStats()
+
+
+def _backoff(attempt):
+    return random.uniform(0, min(RETRY_SETTINGS['MAX_DELAY'], RETRY_SETTINGS['BASE_DELAY'] * 2 ** attempt))
+
+
+# transactions of the mutation run by the current thread: (ExitStack, enlisted aliases)
+_current = threading.local()
+
+
+# Atomic block spanning `default` and the databases `aliases`, joined by those `enlist`ed inside it
+@contextmanager
+def atomic_on(aliases):
+    previous = getattr(_current, 'block', None)
+    with ExitStack() as stack:
+        _current.block = (stack, set())
+        try:
+            for alias in [DEFAULT_DB_ALIAS] + list(aliases):
+                enlist(alias)
+            yield
+        finally:
+            _current.block = previous
+
+
+# Make the current mutation's atomic block span database `alias` as well (no-op outside of one)
+def enlist(alias):
+    block = getattr(_current, 'block', None)
+    if block is None or alias in block[1]:
+        return
+    block[0].enter_context(transaction.atomic(using=alias))
+    block[1].add(alias)
+
+
+# Shards of the bills and items named by the `bid` and `iid` arguments of a mutation call
+def _argument_shards(arguments):
+    aliases = set()
+    for name in ('bid', 'iid'):
+        try:
+            aliases.add(sharding.shard_for(arguments[name]))
+        except (KeyError, TypeError, ValueError, ObjectDoesNotExist):
+            # absent, null or malformed: the mutation reports it
+            pass
+    return aliases
+
+
+# Decorator for `Mutation.mutate` methods
+def atomic_mutation(mutate):
+    name = mutate.__qualname__.split('.')[0]
+    signature = inspect.signature(mutate)
+
+    @functools.wraps(mutate)
+    def wrapper(self, info, *args, **kwargs):
+        retry_stats.incr(name, 'calls')
+        aliases = _argument_shards(signature.bind_partial(self, info, *args, **kwargs).arguments)
+        if connection.in_atomic_block:
+            with atomic_on(aliases):
+                return mutate(self, info, *args, **kwargs)
+        attempt = 0
+        while True:
+            try:
+                with atomic_on(aliases):
+                    return mutate(self, info, *args, **kwargs)
+            except OperationalError as e:
+                attempt += 1
+                if not is_retryable(e) or attempt >= RETRY_SETTINGS['ATTEMPTS']:
+                    retry_stats.incr(name, 'failures')
+                    raise
+                retry_stats.incr(name, 'retries')
+                delay = _backoff(attempt)
+                logger.warning('Retrying %s in %.3fs after: %s', name, delay, e)
+                time.sleep(delay)
+
+    return wrapper
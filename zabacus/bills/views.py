@@ -1,3 +1,137 @@
-from django.shortcuts import render
+import csv
+import json
+from itertools import groupby
+from django.contrib.auth import get_user_model
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from zabacus.bills import archive, sharding
+from zabacus.bills.models import Bill, BillItem, Involvement, ItemWeightAssignment
 
-# Create your views here.
+# Streaming export of every bill the requesting user is involved in.
+#
+# Bills are walked in keyset batches of EXPORT_BATCH_SIZE ids; for each batch the items and the weight
+# assignments are read with one ordered query each through `iterator()` and merge-joined on the fly,
+# so the output is nested (bill, its items, each item's assignments) while memory stays bounded by
+# a single batch no matter how large the account is. Shards holding the user's bills are visited in id
+# order; usernames come from the user database, looked up once per batch. Archived items are exported
+# from the archives of the batch, ahead of any items added to their bills since.
+
+EXPORT_BATCH_SIZE = 100
+EXPORT_CHUNK_SIZE = 2000
+
+CSV_COLUMNS = ('type', 'bill_id', 'item_id', 'name', 'desc', 'date', 'status', 'username', 'amount_cents')
+
+
+def _bill_batches(user):
+    for db, _ in sorted(sharding.user_shards(user).items(), key=lambda s: min(s[1])):
+        last_id = 0
+        while True:
+            batch = list(
+                Bill.objects.using(db).filter(people=user, id__gt=last_id).order_by('id')
+                .values('id', 'name', 'desc', 'date', 'status', 'created_by', 'archived')[:EXPORT_BATCH_SIZE]
+            )
+            if not batch:
+                break
+            yield db, batch
+            last_id = batch[-1]['id']
+
+
+# {user id: username} for everyone appearing in `bills`: creators, members (who include every assignee)
+# and payers
+def _usernames(db, bills, bill_ids, archives):
+    uids = {b['created_by'] for b in bills}
+    uids.update(i['paid_by_id'] for items in archives.values() for i in items)
+    uids.update(Involvement.objects.using(db).filter(bill_id__in=bill_ids).values_list('user_id', flat=True))
+    uids.update(BillItem.objects.using(db).filter(bill_id__in=bill_ids).values_list('paid_by', flat=True).distinct())
+    return dict(get_user_model().objects.filter(id__in=uids).values_list('id', 'username'))
+
+
+# Yield one dict per exported record, in nested order
+def export_records(user):
+    for db, bills in _bill_batches(user):
+        bill_ids = [b['id'] for b in bills]
+        archives = archive.load_archives(db, [b['id'] for b in bills if b['archived']])
+        usernames = _usernames(db, bills, bill_ids, archives)
+        items = BillItem.objects.using(db).filter(bill_id__in=bill_ids).order_by('bill_id', 'id') \
+            .values('id', 'bill_id', 'name', 'desc', 'date', 'paid_by', 'total_cents') \
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        assignments = ItemWeightAssignment.objects.using(db).filter(item__bill_id__in=bill_ids) \
+            .order_by('item__bill_id', 'item_id', 'id') \
+            .values('item_id', 'item__bill_id', 'user', 'amount_cents') \
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        items_by_bill = groupby(items, key=lambda i: i['bill_id'])
+        assignments_by_item = groupby(assignments, key=lambda a: a['item_id'])
+        next_items = next(items_by_bill, None)
+        next_assignments = next(assignments_by_item, None)
+
+        for b in bills:
+            yield {
+                'type': 'bill', 'bill_id': b['id'], 'name': b['name'], 'desc': b['desc'],
+                'date': b['date'].isoformat(), 'status': b['status'], 'username': usernames[b['created_by']],
+            }
+            for i in archives.get(b['id'], ()):
+                yield {
+                    'type': 'item', 'bill_id': b['id'], 'item_id': i['id'], 'name': i['name'], 'desc': i['desc'],
+                    'date': i['date'].isoformat(), 'username': usernames[i['paid_by_id']],
+                    'amount_cents': i['total_cents'],
+                }
+                for _, uid, amount in i['assignments']:
+                    yield {
+                        'type': 'assignment', 'bill_id': b['id'], 'item_id': i['id'],
+                        'username': usernames[uid], 'amount_cents': amount,
+                    }
+            if next_items is None or next_items[0] != b['id']:
+                continue
+            for i in next_items[1]:
+                yield {
+                    'type': 'item', 'bill_id': b['id'], 'item_id': i['id'], 'name': i['name'], 'desc': i['desc'],
+                    'date': i['date'].isoformat(), 'username': usernames[i['paid_by']],
+                    'amount_cents': i['total_cents'],
+                }
+                if next_assignments is None or next_assignments[0] != i['id']:
+                    continue
+                for a in next_assignments[1]:
+                    yield {
+                        'type': 'assignment', 'bill_id': b['id'], 'item_id': i['id'],
+                        'username': usernames[a['user']], 'amount_cents': a['amount_cents'],
+                    }
+                next_assignments = next(assignments_by_item, None)
+            next_items = next(items_by_bill, None)
+
+
+class _Echo:
+    # File-like object whose write() hands the line back to the csv writer's caller
+    def write(self, value):
+        return value
+
+
+def _csv_lines(records):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for r in records:
+        yield writer.writerow([r.get(c, '') for c in CSV_COLUMNS])
+
+
+def _ndjson_lines(records):
+    for r in records:
+        yield json.dumps(r) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': (_csv_lines, 'text/csv', 'csv'),
+    'ndjson': (_ndjson_lines, 'application/x-ndjson', 'ndjson'),
+}
+
+
+@require_GET
+def export_bills(request):
+    if request.user.is_anonymous:
+        return JsonResponse({'errors': [{'message': 'Not logged in.'}]}, status=401)
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return JsonResponse({'errors': [{'message': 'Unknown export format.'}]}, status=400)
+
+    render, content_type, extension = EXPORT_FORMATS[fmt]
+    response = StreamingHttpResponse(render(export_records(request.user)), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="zabacus-bills.{}"'.format(extension)
+    return response
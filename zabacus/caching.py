@@ -0,0 +1,105 @@
+import hashlib
+import time
+import uuid
+from django.core.cache import cache, caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Cached values invalidated through version tokens.
+#
+# A VersionedCache keeps a token per key (a user, a bill) and stores values under the key's current token.
+# Replacing the token (`bump`) makes every value cached for the key unreachable at once, without having to
+# know which values were cached; they expire on their own. Tokens start with the time they were issued at.
+#
+# What is cached this way (membership sets used for authorization, snapshots, analytics) has to agree
+# between all server processes: a token replaced by the worker that ran a mutation must be seen replaced by
+# every other worker. So nothing is cached on a backend that lives in one process (LocMemCache): values
+# are computed afresh every time instead. settings.py configures a shared backend.
+
+
+# Whether the default cache is shared by all server processes
+def is_shared():
+    return not isinstance(caches['default'], LocMemCache)
+
+
+# Whether the default cache is a table of the default database: every read from it is a query
+def is_in_database():
+    return isinstance(caches['default'], DatabaseCache)
+
+
+_process_id = uuid.uuid4().hex
+
+
+# Namespace of the cache entries derived from the current default database
+def namespace():
+    db = connections[DEFAULT_DB_ALIAS].settings_dict
+    name = str(db['NAME'])
+    if name == ':memory:' or 'mode=memory' in name:
+        name = '{}@{}'.format(name, _process_id)
+    ident = '{}|{}|{}|{}'.format(db['ENGINE'], db.get('HOST', ''), db.get('PORT', ''), name)
+    return hashlib.md5(ident.encode()).hexdigest()[:12]
+
+
+def namespaced(key):
+    return '{}:{}'.format(namespace(), key)
+
+
+def _new_version():
+    return '{:d}-{}'.format(int(time.time()), uuid.uuid4().hex)
+
+
+class VersionedCache:
+    def __init__(self, prefix, timeout):
+        self.prefix = prefix
+        self.timeout = timeout
+
+    def _version_key(self, key):
+        return namespaced('{}-version:{}'.format(self.prefix, key))
+
+    def _value_key(self, key, version, name):
+        return namespaced('{}:{}:{}:{}'.format(self.prefix, key, version, name))
+
+    # Current version token of `key`
+    def version(self, key):
+        return self.versions([key])[key]
+
+    # {key: current version token} for every key in `keys`
+    def versions(self, keys):
+        if not is_shared():
+            return {key: _new_version() for key in keys}
+        version_keys = {self._version_key(key): key for key in keys}
+        found = cache.get_many(list(version_keys))
+        missing = {vk: _new_version() for vk in version_keys if vk not in found}
+        if missing:
+            cache.set_many(missing, None)
+            found.update(missing)
+        return {version_keys[vk]: version for vk, version in found.items()}
+
+    # Replace the version tokens of `keys`, dropping everything cached for them
+    def bump(self, keys):
+        if not is_shared():
+            return
+        cache.set_many({self._version_key(key): _new_version() for key in keys}, None)
+
+    # The value `name` of `key` cached under `version` (the current one by default), None if absent
+    def get(self, key, name, version=None):
+        if not is_shared():
+            return None
+        return cache.get(self._value_key(key, version or self.version(key), name))
+
+    def set(self, key, name, value, version=None):
+        if not is_shared():
+            return
+        cache.set(self._value_key(key, version or self.version(key), name), value, self.timeout)
+
+    # The value `name` of `key`, computed by `compute()` and cached if absent
+    def get_or_compute(self, key, name, compute):
+        if not is_shared():
+            return compute()
+        version = self.version(key)
+        value = self.get(key, name, version)
+        if value is None:
+            value = compute()
+            self.set(key, name, value, version)
+        return value
@@ -0,0 +1,14 @@
+from django.conf import settings
+
+# Settings of the zabacus modules.
+#
+# A module with tunables keeps their defaults next to the code that uses them and reads the overrides
+# from one dict in settings.py, e.g. TASK_QUEUE for zabacus/bills/tasks.py. settings.py only lists the
+# values that differ from the defaults.
+
+
+# The defaults `defaults` updated with the dict `name` of settings.py
+def module_settings(name, defaults):
+    values = dict(defaults)
+    values.update(getattr(settings, name, {}))
+    return values
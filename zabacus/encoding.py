@@ -0,0 +1,104 @@
+import gzip
+import json
+import re
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.cache import patch_vary_headers
+from django.utils.module_loading import import_string
+from zabacus import conf
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Encoding and compression of GraphQL responses (see zabacus/views.py).
+#
+# The encoder turning a result into the response body is pluggable through GRAPHQL_RESPONSE['ENCODER']:
+# any function taking the result (a dict) and returning UTF-8 JSON bytes. The default reuses one stdlib
+# encoder set up for what the GraphQL executor produces, a tree of dicts, lists and plain scalars: no
+# circular-reference bookkeeping, no ASCII escaping, no whitespace. `encode_orjson` is faster still when
+# orjson is installed. Bodies of at least COMPRESS_MIN_SIZE bytes are compressed with brotli (if installed
+# and accepted by the client) or gzip; smaller ones are not worth the CPU.
+
+RESPONSE_SETTINGS = conf.module_settings('GRAPHQL_RESPONSE', {
+    'ENCODER': 'zabacus.encoding.encode_json',
+    'COMPRESS_MIN_SIZE': 1024,
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,
+})
+
+_json_encoder = json.JSONEncoder(ensure_ascii=False, check_circular=False, separators=(',', ':'))
+
+_quality = re.compile(r'\bq\s*=\s*([0-9.]+)')
+
+
+def encode_json(data):
+    return _json_encoder.encode(data).encode()
+
+
+def encode_orjson(data):
+    return orjson.dumps(data)
+
+
+_encoder = None
+
+
+def get_encoder():
+    global _encoder
+    if _encoder is None:
+        encoder = import_string(RESPONSE_SETTINGS['ENCODER'])
+        if encoder is encode_orjson and orjson is None:
+            raise ImproperlyConfigured('encode_orjson needs the orjson package.')
+        _encoder = encoder
+    return _encoder
+
+
+def encode(data):
+    return get_encoder()(data)
+
+
+# Content codings listed in the Accept-Encoding header `accept_encoding`, except those refused with q=0
+def _accepted_codings(accept_encoding):
+    codings = set()
+    for entry in accept_encoding.lower().split(','):
+        coding, _, params = entry.partition(';')
+        quality = _quality.search(params)
+        try:
+            if quality is not None and float(quality.group(1)) == 0:
+                continue
+        except ValueError:
+            continue
+        codings.add(coding.strip())
+    return codings
+
+
+# (Content-Encoding, compressed body) of `content` for a client accepting `accept_encoding`, or None
+# if it should be sent uncompressed
+def compress(content, accept_encoding):
+    if len(content) < RESPONSE_SETTINGS['COMPRESS_MIN_SIZE']:
+        return None
+    codings = _accepted_codings(accept_encoding)
+    if brotli is not None and 'br' in codings:
+        encoding, compressed = 'br', brotli.compress(content, quality=RESPONSE_SETTINGS['BROTLI_QUALITY'])
+    elif 'gzip' in codings or 'x-gzip' in codings:
+        encoding, compressed = 'gzip', gzip.compress(content, RESPONSE_SETTINGS['GZIP_LEVEL'])
+    else:
+        return None
+    return (encoding, compressed) if len(compressed) < len(content) else None
+
+
+# Compress the body of `response` to `request` in place, where worthwhile
+def compress_response(request, response):
+    if response.streaming or response.has_header('Content-Encoding') or not response.content:
+        return response
+    patch_vary_headers(response, ('Accept-Encoding',))
+    result = compress(response.content, request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    if result is not None:
+        response['Content-Encoding'], response.content = result
+        response['Content-Length'] = str(len(response.content))
+    return response
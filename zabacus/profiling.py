@@ -0,0 +1,142 @@
+import cProfile
+import contextlib
+import functools
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from graphql.language import ast
+from graphql.language.parser import parse
+from zabacus import conf
+
+# Opt-in profiling of GraphQL operations (wired into zabacus.views.GraphQLView).
+#
+# A request is profiled when it is drawn in GRAPHQL_PROFILING['SAMPLE_RATE'] (a fraction of all requests,
+# 0 by default), or when a staff user sends the GRAPHQL_PROFILING['HEADER'] header, whose value may pick
+# the mode. Every operation of a profiled request writes one file to GRAPHQL_PROFILING['DIRECTORY'],
+# named after the operation (its name, or its root fields for anonymous ones):
+#
+#   'sample'   - a thread samples the stack of the request's thread every INTERVAL seconds and writes the
+#                counts in collapsed-stack format (`<label>.<ms>.<pid>.<thread>.collapsed`, one
+#                `frame;frame;frame count` line per stack, the input of flamegraph.pl / speedscope).
+#                Costs next to nothing on the profiled request.
+#   'cprofile' - the operation runs under cProfile and the stats are dumped in pstats format (`.prof`).
+#                Exact call counts, but slows the request down noticeably.
+#
+# `./manage.py summarize_profiles` merges the files per operation and prints the hot spots.
+
+PROFILING_SETTINGS = conf.module_settings('GRAPHQL_PROFILING', {
+    # fraction of requests profiled; staff users can also ask for it with the header
+    'SAMPLE_RATE': 0.0,
+    'HEADER': 'X-Zabacus-Profile',
+    # 'sample' (collapsed stacks) or 'cprofile' (pstats)
+    'MODE': 'sample',
+    'INTERVAL': 0.005,
+    # where profiles are written, read by `./manage.py summarize_profiles`
+    'DIRECTORY': os.path.join(tempfile.gettempdir(), 'zabacus-profiles'),
+})
+
+MODES = {'sample': 'collapsed', 'cprofile': 'prof'}
+
+_header = 'HTTP_' + PROFILING_SETTINGS['HEADER'].upper().replace('-', '_')
+_unsafe = re.compile(r'[^A-Za-z0-9_+-]')
+
+
+# Profiling mode for `request`, None if it is not to be profiled
+def requested_mode(request):
+    value = request.META.get(_header)
+    if value is not None:
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            return value if value in MODES else PROFILING_SETTINGS['MODE']
+    rate = PROFILING_SETTINGS['SAMPLE_RATE']
+    if rate > 0 and random.random() < rate:
+        return PROFILING_SETTINGS['MODE']
+    return None
+
+
+# File-name-safe label of the operation `operation_name` of the GraphQL document `query`
+@functools.lru_cache(maxsize=256)
+def operation_label(query, operation_name=None):
+    if operation_name:
+        return _unsafe.sub('_', operation_name)
+    try:
+        operations = [d for d in parse(query).definitions if isinstance(d, ast.OperationDefinition)]
+    except Exception:
+        return 'invalid'
+    if len(operations) != 1:
+        return 'anonymous'
+    fields = [s.name.value for s in operations[0].selection_set.selections if isinstance(s, ast.Field)]
+    return _unsafe.sub('_', '+'.join(fields)) or 'anonymous'
+
+
+def _frame_name(code):
+    return '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+# Samples the stack of thread `thread_id`, from its frame `root` down, every `interval` seconds
+class StackSampler:
+    def __init__(self, thread_id, root, interval):
+        self.thread_id = thread_id
+        self.root = root
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='zabacus-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                if frame is self.root:
+                    break
+                frame = frame.f_back
+            # not a sample of the profiled code if it already left the block
+            if stack and frame is not None and not self._stopped.is_set():
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+
+def _path(label, mode):
+    return os.path.join(PROFILING_SETTINGS['DIRECTORY'], '{}.{:d}.{}.{}.{}'.format(
+        label, int(time.time() * 1000), os.getpid(), threading.get_ident(), MODES[mode]))
+
+
+# Profile the enclosed code in `mode` and write the result to a file tagged `label`
+@contextlib.contextmanager
+def profile(mode, label):
+    os.makedirs(PROFILING_SETTINGS['DIRECTORY'], exist_ok=True)
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(_path(label, mode))
+    else:
+        # the frame running the `with` block, past contextlib's __enter__
+        sampler = StackSampler(threading.get_ident(), sys._getframe(2), PROFILING_SETTINGS['INTERVAL'])
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            sampler.dump(_path(label, mode))
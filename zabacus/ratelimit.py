@@ -0,0 +1,184 @@
+import contextlib
+import fcntl
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from graphql import GraphQLError
+from zabacus import conf
+
+# Rate limiting and load shedding of the expensive authentication mutations (`tokenAuth`, `createUser`).
+#
+# Both hash a password (PBKDF2, tens of milliseconds of CPU) and `createUser` also calls the reCAPTCHA
+# API, so a burst of them can tie up every worker. `limit` guards them in two steps, both before any of
+# that work starts:
+#
+#   - token buckets per client IP and per username: every attempt takes a token from the buckets of its
+#     action, which refill at RATES[action:ip|username] = (burst, period), i.e. `burst` attempts per
+#     `period` seconds. When a bucket is empty the attempt is rejected with RateLimitError and the
+#     number of seconds to wait. Buckets live in a small SQLite database (STORE, on local disk) so that
+#     all server processes of the host share them.
+#   - a cap on concurrent hashing on the host: at most MAX_CONCURRENT guarded mutations run at once and
+#     MAX_QUEUED more may wait for a slot; beyond that, attempts are rejected at once instead of queueing.
+#     The slots are lock files (in SLOTS), so that the cap holds across the server processes: with sync
+#     workers, each process only ever serves one request at a time.
+#
+# Rejections are GraphQL errors; zabacus.views.GraphQLView turns them into HTTP 429 with Retry-After.
+
+RATE_LIMIT_SETTINGS = conf.module_settings('AUTH_RATE_LIMIT', {
+    # SQLite file holding the token buckets, shared by the server processes of the host
+    'STORE': os.path.join(tempfile.gettempdir(), 'zabacus-ratelimit.sqlite3'),
+    # request header holding the client address; 'HTTP_X_FORWARDED_FOR' behind a proxy that appends to it
+    'IP_HEADER': 'REMOTE_ADDR',
+    # with an X-Forwarded-For style IP_HEADER, number of trusted proxies appending to it: the client is the
+    # address that many entries from the end (entries before it are supplied by the client)
+    'PROXY_COUNT': 1,
+    # {action:scope: (burst, period in seconds)}
+    'RATES': {
+        'token_auth:ip': (30, 60),
+        'token_auth:username': (10, 60),
+        'create_user:ip': (5, 3600),
+        'create_user:username': (5, 3600),
+    },
+    # directory of the lock files counting the guarded mutations in progress on the host
+    'SLOTS': os.path.join(tempfile.gettempdir(), 'zabacus-ratelimit-slots'),
+    # password hashes computed at once on the host, and attempts allowed to wait for one; keep their sum
+    # below the number of server workers (start_gunicorn.sh runs 3), so that some are left for other requests
+    'MAX_CONCURRENT': 2,
+    'MAX_QUEUED': 0,
+})
+
+# Takes between purges of buckets that have been full for a while
+PURGE_INTERVAL = 1000
+
+# Seconds between attempts of a waiting caller to get a running slot
+SLOT_POLL_INTERVAL = 0.01
+
+
+class RateLimitError(GraphQLError):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# Token buckets in an SQLite database shared by the processes of the host
+class BucketStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+
+    def _connection(self):
+        # one connection per thread, and per process after a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    # Take one token from every bucket in `buckets`, [(key, burst, period)], if all of them have one.
+    # Returns 0 on success, otherwise the seconds until they all do (and takes nothing).
+    def take(self, buckets, now=None):
+        now = time.time() if now is None else now
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            levels = {}
+            wait = 0
+            for key, burst, period in buckets:
+                row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * burst / period)
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) * period / burst)
+                levels[key] = tokens
+            if not wait:
+                conn.executemany('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                                 [(key, tokens - 1, now) for key, tokens in levels.items()])
+            self._takes += 1
+            if self._takes % PURGE_INTERVAL == 0:
+                longest = max(period for _, period in RATE_LIMIT_SETTINGS['RATES'].values())
+                conn.execute('DELETE FROM buckets WHERE updated < ?', (now - longest,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+
+# Admission of at most `max_concurrent` running and `max_queued` waiting callers, counted across the
+# processes of the host with lock files in the directory `path`: an admitted caller holds an exclusive lock
+# on one of `admitted.0` .. `admitted.<limit - 1>`, and a running one on one of the `running.<n>` files too.
+# Locks go away with the process holding them, so a crashed worker never keeps a slot.
+class ConcurrencyCap:
+    def __init__(self, path, max_concurrent, max_queued):
+        self.path = path
+        self.max_concurrent = max_concurrent
+        self.limit = max_concurrent + max_queued
+
+    # The first of the files `<kind>.0` .. `<kind>.<count - 1>` that could be locked (open, holding the
+    # lock until closed), None if all of them are locked
+    def _lock_slot(self, kind, count):
+        for n in range(count):
+            f = open(os.path.join(self.path, '{}.{}'.format(kind, n)), 'a')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return f
+            except BlockingIOError:
+                f.close()
+        return None
+
+    @contextlib.contextmanager
+    def admit(self):
+        os.makedirs(self.path, exist_ok=True)
+        admitted = self._lock_slot('admitted', self.limit)
+        if admitted is None:
+            raise RateLimitError('Server busy, please retry shortly.', 1)
+        try:
+            running = self._lock_slot('running', self.max_concurrent)
+            while running is None:
+                time.sleep(SLOT_POLL_INTERVAL)
+                running = self._lock_slot('running', self.max_concurrent)
+            with running:
+                yield
+        finally:
+            admitted.close()
+
+
+store = BucketStore(RATE_LIMIT_SETTINGS['STORE'])
+hashing = ConcurrencyCap(RATE_LIMIT_SETTINGS['SLOTS'], RATE_LIMIT_SETTINGS['MAX_CONCURRENT'],
+                         RATE_LIMIT_SETTINGS['MAX_QUEUED'])
+
+
+# Address of the client of `request`, None if unknown (e.g. REMOTE_ADDR behind a proxy on a unix socket)
+def client_ip(request):
+    hops = [h.strip() for h in (request.META.get(RATE_LIMIT_SETTINGS['IP_HEADER']) or '').split(',')]
+    hops = [h for h in hops if h]
+    if len(hops) >= RATE_LIMIT_SETTINGS['PROXY_COUNT'] > 0:
+        return hops[-RATE_LIMIT_SETTINGS['PROXY_COUNT']]
+    return request.META.get('REMOTE_ADDR') or None
+
+
+# Guard one `action` ('token_auth', 'create_user') by the client of `request` on the account `username`;
+# raises RateLimitError (and records the wait on the request) if it is over its rate or the server is busy.
+# Clients without a known address are only limited per username, rather than all sharing one bucket.
+@contextlib.contextmanager
+def limit(request, action, username=None):
+    rates = RATE_LIMIT_SETTINGS['RATES']
+    buckets = []
+    for scope, value in (('ip', client_ip(request)), ('username', username)):
+        rate = rates.get('{}:{}'.format(action, scope))
+        if rate is not None and value:
+            buckets.append(('{}:{}:{}'.format(action, scope, value), rate[0], rate[1]))
+    try:
+        wait = store.take(buckets) if buckets else 0
+        if wait:
+            raise RateLimitError('Too many attempts, please retry in {} seconds.'.format(math.ceil(wait)), wait)
+        with hashing.admit():
+            yield
+    except RateLimitError as e:
+        request._retry_after = max(getattr(request, '_retry_after', 0), math.ceil(e.retry_after))
+        raise
@@ -0,0 +1,115 @@
+"""
+Read-replica routing.
+
+Reads made while serving a request go to the ``replica`` database (when one is configured), writes
+always go to ``default``. A request is pinned to the primary for all of its reads as soon as it runs a
+mutation (see zabacus/views.py), so the mutation and everything resolved after it see its own writes.
+After a user's mutation (or login), their following requests stay pinned for
+REPLICA_READ_YOUR_WRITES_WINDOW seconds, which should exceed the replica lag. The pins are kept in the
+cache, which every server process must share; on a per-process cache every request of a logged-in user
+reads from the primary. Without any replica configured, pins are neither kept nor looked up. Reads
+outside of a request (management commands, background tasks, benchmarks) use the primary.
+
+Bill shards (see zabacus/bills/sharding.py) can have replicas too: the replica of database alias
+``<alias>`` is ``<alias>_replica`` (``replica`` for ``default``).
+"""
+
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from zabacus import caching
+
+PRIMARY_DATABASE = 'default'
+REPLICA_DATABASE = 'replica'
+
+_state = threading.local()
+
+
+def _pin_key(uid):
+    return caching.namespaced('replica-pin:{}'.format(uid))
+
+
+def pin_primary():
+    _state.pinned = True
+
+
+# Route all reads of the current thread to the primary inside this block
+@contextmanager
+def use_primary():
+    pinned = getattr(_state, 'pinned', False)
+    _state.pinned = True
+    try:
+        yield
+    finally:
+        _state.pinned = pinned
+
+
+# Routing state of the request served by the current thread, for threads working on its behalf
+def request_state():
+    return getattr(_state, 'in_request', False), getattr(_state, 'pinned', False)
+
+
+def set_request_state(state):
+    _state.in_request, _state.pinned = state
+
+
+def replica_of(alias):
+    return REPLICA_DATABASE if alias == PRIMARY_DATABASE else '{}_{}'.format(alias, REPLICA_DATABASE)
+
+
+# Whether any database has a replica configured
+def has_replicas():
+    return any(alias == REPLICA_DATABASE or alias.endswith('_' + REPLICA_DATABASE) for alias in connections.databases)
+
+
+# The database that reads meant for database `alias` should go to right now
+def read_db(alias=PRIMARY_DATABASE):
+    if not getattr(_state, 'in_request', False) or getattr(_state, 'pinned', False):
+        return alias
+    replica = replica_of(alias)
+    return replica if replica in connections.databases else alias
+
+
+# Keep reads of `user` on the primary for the read-your-writes window, and for the rest of this request
+def record_write(user):
+    pin_primary()
+    if user is not None and not user.is_anonymous and has_replicas():
+        cache.set(_pin_key(user.id), True, getattr(settings, 'REPLICA_READ_YOUR_WRITES_WINDOW', 5))
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == 'django_cache':
+            # the cache table (DatabaseCache) must not lag behind
+            return PRIMARY_DATABASE
+        return read_db()
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY_DATABASE
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get their schema through replication
+        return db == PRIMARY_DATABASE
+
+
+class ReplicaRoutingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.in_request = True
+        _state.pinned = False
+        try:
+            user = getattr(request, 'user', None)
+            if user is not None and not user.is_anonymous and has_replicas() and \
+                    (not caching.is_shared() or cache.get(_pin_key(user.id))):
+                pin_primary()
+            return self.get_response(request)
+        finally:
+            _state.in_request = False
+            _state.pinned = False
@@ -9,9 +9,13 @@ class Query(zabacus.user.schema.Query, zabacus.bills.schema.Query, graphene.Obje
 
 
 class Mutation(zabacus.user.schema.Mutation, zabacus.bills.schema.Mutation, graphene.ObjectType):
-    token_auth = graphql_jwt.ObtainJSONWebToken.Field()
+    token_auth = zabacus.user.schema.ObtainJSONWebToken.Field()
     verify_token = graphql_jwt.Verify.Field()
     refresh_token = graphql_jwt.Refresh.Field()
 
 
-schema = graphene.Schema(query=Query, mutation=Mutation)
+class Subscription(zabacus.bills.schema.Subscription, graphene.ObjectType):
+    pass
+
+
+schema = graphene.Schema(query=Query, mutation=Mutation, subscription=Subscription)
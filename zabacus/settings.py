@@ -22,11 +22,9 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # SECURITY WARNING: keep the secret key used in production secret!
 if 'DJANGO_SECRET_KEY' in os.environ:
     SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
-    print('Nice, set SECRET_KEY from environment variable!')
     DEPLOY = True
 else:
     SECRET_KEY = 't9#b-3)vvk1j-92#3!pto0dudj^wh9pw=kjv+$ma&3w#$9nkfj'
-    print('Using default secret key, running in debug mode')
     DEPLOY = False
 
 # SECURITY WARNING: don't run with debug turned on in production!
@@ -48,12 +46,15 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'django_extensions',
-    'zabacus.bills',
+    'zabacus.bills.apps.BillsConfig',
     'graphene_django',
     'corsheaders',
 ]
 
+# Development tools (shell_plus, runserver_plus, ...), not loaded by production workers
+if DEBUG:
+    INSTALLED_APPS.append('django_extensions')
+
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -64,6 +65,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'graphql_jwt.middleware.JSONWebTokenMiddleware',
+    'zabacus.routers.ReplicaRoutingMiddleware',
 ]
 
 AUTHENTICATION_BACKENDS = [
@@ -113,11 +115,60 @@ DEV_DB = {
     }
 }
 
+# Optional read replica, used for GraphQL queries (see zabacus/routers.py)
+if 'MYSQL_REPLICA_HOST' in os.environ:
+    MYSQL_DB['replica'] = dict(
+        MYSQL_DB['default'],
+        HOST=os.environ['MYSQL_REPLICA_HOST'],
+        PORT=os.environ.get('MYSQL_REPLICA_PORT', '3306'),
+        TEST={'MIRROR': 'default'},
+    )
+if 'SQLITE_REPLICA_DB' in os.environ:
+    DEV_DB['replica'] = dict(DEV_DB['default'], NAME=os.environ['SQLITE_REPLICA_DB'], TEST={'MIRROR': 'default'})
+
+# Extra databases holding bill data (see zabacus/bills/sharding.py)
+for i, host in enumerate([h for h in os.environ.get('MYSQL_SHARD_HOSTS', '').split(',') if h], 1):
+    MYSQL_DB['shard{}'.format(i)] = dict(MYSQL_DB['default'], HOST=host)
+for i in range(1, int(os.environ.get('SQLITE_SHARDS', 1))):
+    DEV_DB['shard{}'.format(i)] = dict(DEV_DB['default'], NAME=os.path.join(BASE_DIR, 'db.shard{}.sqlite3'.format(i)))
+
 if DEPLOY:
     DATABASES = MYSQL_DB
 else:
     DATABASES = DEV_DB
 
+# Databases holding bill data, in shard order ('default' is the first shard); shards may only be appended
+BILL_SHARDS = ['default'] + sorted((a for a in DATABASES if a.startswith('shard') and a[5:].isdigit()),
+                                   key=lambda a: int(a[5:]))
+
+DATABASE_ROUTERS = ['zabacus.bills.sharding.ShardRouter', 'zabacus.routers.ReplicaRouter']
+
+# Seconds a user's reads stay on the primary after they wrote; must exceed the replica lag
+REPLICA_READ_YOUR_WRITES_WINDOW = 5
+
+
+# Cache shared by all server processes: the cached membership sets used for authorization, the version
+# tokens of cached snapshots and analytics and the read-your-writes pins must be the same for every worker
+# (see zabacus/caching.py; nothing is cached across requests on a per-process LocMemCache). Deployments
+# use a table of the default database, created by `./manage.py createcachetable`. Every read from it is a
+# query, so membership sets are not cached there (see zabacus/bills/sharding.py).
+if DEPLOY:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'zabacus_cache',
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(os.environ.get('TMPDIR', '/tmp'), 'zabacus-cache'),
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -162,4 +213,18 @@ GRAPHENE = {
     'SCHEMA': 'zabacus.schema.schema'
 }
 
+# nginx passes the client address in X-Forwarded-For ($proxy_add_x_forwarded_for); gunicorn listens on a
+# unix socket, so REMOTE_ADDR is empty
+if DEPLOY:
+    AUTH_RATE_LIMIT = {'IP_HEADER': 'HTTP_X_FORWARDED_FOR'}
+
+# Fan-out of bill change events to GraphQL subscriptions (see zabacus/bills/pubsub.py)
+PUBSUB_BACKEND = 'zabacus.bills.pubsub.LocalPubSub'
+
+# Tunables of the zabacus modules are read from dicts named after them, holding only what differs from
+# the defaults kept in the module (see zabacus/conf.py):
+#   TASK_QUEUE (zabacus/bills/tasks.py), MUTATION_RETRY (zabacus/bills/transactions.py),
+#   GRAPHQL_BATCH (zabacus/views.py), GRAPHQL_RESPONSE (zabacus/encoding.py),
+#   GRAPHQL_PROFILING (zabacus/profiling.py), AUTH_RATE_LIMIT (zabacus/ratelimit.py)
+
 CORS_ORIGIN_ALLOW_ALL = True
@@ -0,0 +1,157 @@
+"""
+GraphQL subscriptions over WebSocket for the ASGI entry point.
+
+Speaks the `graphql-ws` protocol of subscriptions-transport-ws (Apollo): the client sends
+`connection_init` (optionally with `{"authToken": "JWT <token>"}` as payload), then one `start`
+message per subscription and `stop` / `connection_terminate` when done.
+
+Database work (authentication, the resolver's membership check) runs in the default thread pool.
+Events are delivered by the pub/sub backend on the publishing thread and handed over to the event
+loop through a per-connection outbox.
+"""
+
+import asyncio
+import json
+from django.contrib.auth.models import AnonymousUser
+from django.db import close_old_connections
+from graphql.error import format_error
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.shortcuts import get_user_by_token
+from rx import Observable
+from zabacus.schema import schema
+
+GRAPHQL_WS = 'graphql-ws'
+
+
+class SubscriptionContext:
+    def __init__(self, user):
+        self.user = user
+
+
+def _run_db(fn, *args):
+    # run a blocking, database-touching call on a pool thread
+    def call():
+        close_old_connections()
+        try:
+            return fn(*args)
+        finally:
+            close_old_connections()
+    return asyncio.get_event_loop().run_in_executor(None, call)
+
+
+def _authenticate(payload):
+    token = (payload or {}).get('authToken') or (payload or {}).get('Authorization') or ''
+    if not isinstance(token, str):
+        raise JSONWebTokenError('Invalid token')
+    if token.startswith('JWT '):
+        token = token[4:]
+    if not token:
+        return AnonymousUser()
+    return get_user_by_token(token) or AnonymousUser()
+
+
+def _result_payload(result):
+    payload = {'data': result.data}
+    if result.errors:
+        payload['errors'] = [format_error(e) for e in result.errors]
+    return payload
+
+
+class GraphQLWSConnection:
+    def __init__(self, send):
+        self.send = send
+        self.loop = asyncio.get_event_loop()
+        self.outbox = asyncio.Queue()
+        self.user = AnonymousUser()
+        self.operations = {}
+
+    def post(self, message):
+        # may be called from any thread
+        self.loop.call_soon_threadsafe(self.outbox.put_nowait, message)
+
+    async def writer(self):
+        while True:
+            message = await self.outbox.get()
+            if message is None:
+                return
+            await self.send({'type': 'websocket.send', 'text': json.dumps(message)})
+
+    def _execute(self, query, variables, operation_name):
+        return schema.execute(query, variable_values=variables, operation_name=operation_name,
+                              context_value=SubscriptionContext(self.user), allow_subscriptions=True)
+
+    async def start(self, op_id, payload):
+        self.stop(op_id)
+        result = await _run_db(self._execute, payload.get('query'), payload.get('variables'),
+                               payload.get('operationName'))
+        if not isinstance(result, Observable):
+            # not a subscription, or it failed before subscribing
+            self.post({'type': 'data', 'id': op_id, 'payload': _result_payload(result)})
+            self.post({'type': 'complete', 'id': op_id})
+            return
+        self.operations[op_id] = result.subscribe(
+            on_next=lambda r: self.post({'type': 'data', 'id': op_id, 'payload': _result_payload(r)}),
+            on_error=lambda e: self.post({'type': 'error', 'id': op_id, 'payload': {'message': str(e)}}),
+            on_completed=lambda: self.post({'type': 'complete', 'id': op_id}),
+        )
+
+    def stop(self, op_id):
+        subscription = self.operations.pop(op_id, None)
+        if subscription is not None:
+            subscription.dispose()
+
+    def close(self):
+        for op_id in list(self.operations):
+            self.stop(op_id)
+        self.outbox.put_nowait(None)
+
+    async def handle(self, message):
+        if not isinstance(message, dict) or not isinstance(message.get('payload') or {}, dict):
+            self.post({'type': 'connection_error', 'payload': {'message': 'Invalid message.'}})
+            return True
+        kind = message.get('type')
+        if kind == 'connection_init':
+            try:
+                self.user = await _run_db(_authenticate, message.get('payload'))
+            except JSONWebTokenError as e:
+                self.post({'type': 'connection_error', 'payload': {'message': str(e)}})
+                return True
+            self.post({'type': 'connection_ack'})
+        elif kind == 'start':
+            await self.start(message.get('id'), message.get('payload') or {})
+        elif kind == 'stop':
+            self.stop(message.get('id'))
+        elif kind == 'connection_terminate':
+            return False
+        else:
+            self.post({'type': 'error', 'id': message.get('id'), 'payload': {'message': 'Unknown message type.'}})
+        return True
+
+
+async def graphql_ws_app(scope, receive, send):
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    if GRAPHQL_WS not in scope.get('subprotocols', []):
+        await send({'type': 'websocket.close', 'code': 1002})
+        return
+    await send({'type': 'websocket.accept', 'subprotocol': GRAPHQL_WS})
+
+    connection = GraphQLWSConnection(send)
+    writer = asyncio.ensure_future(connection.writer())
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            try:
+                data = json.loads(message.get('text') or '')
+            except ValueError:
+                connection.post({'type': 'connection_error', 'payload': {'message': 'Invalid message.'}})
+                continue
+            if not await connection.handle(data):
+                await send({'type': 'websocket.close', 'code': 1000})
+                break
+    finally:
+        connection.close()
+        await writer
@@ -3,9 +3,12 @@ from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.utils.html import escape
 import graphene
+import graphql_jwt
 from graphql import GraphQLError
 from graphene_django import DjangoObjectType
-from zabacus.bills.schema import get_auth_user
+from zabacus import ratelimit, routers
+from zabacus.bills import sharding, snapshots
+from zabacus.bills.schema import get_auth_user, touch_bills
 
 
 class UserType(DjangoObjectType):
@@ -28,6 +31,14 @@ class CreateUser(graphene.Mutation):
     def mutate(self, info, username, first_name, last_name, password, email, recaptcha):
         if not info.context.user.is_anonymous:
             raise GraphQLError('Please log out first.')
+        with ratelimit.limit(info.context, 'create_user', username):
+            result = CreateUser.create(username, first_name, last_name, password, email, recaptcha)
+        # the new user's first requests (logging in) must find the account
+        routers.record_write(result.user)
+        return result
+
+    @staticmethod
+    def create(username, first_name, last_name, password, email, recaptcha):
         # verify recaptcha first
         url = 'https://www.google.com/recaptcha/api/siteverify'
         values = {
@@ -54,6 +65,17 @@ class CreateUser(graphene.Mutation):
         return CreateUser(user=user)
 
 
+# graphql_jwt's tokenAuth, with the rate limits applied before the password is checked. The user it logs
+# in reads from the primary for the read-your-writes window, like after their own mutations.
+class ObtainJSONWebToken(graphql_jwt.ObtainJSONWebToken):
+    @classmethod
+    def mutate(cls, root, info, **kwargs):
+        with ratelimit.limit(info.context, 'token_auth', kwargs.get(get_user_model().USERNAME_FIELD)):
+            result = super().mutate(root, info, **kwargs)
+        routers.record_write(info.context.user)
+        return result
+
+
 class UpdateUser(graphene.Mutation):
     user = graphene.Field(UserType)
 
@@ -85,6 +107,11 @@ class UpdateUser(graphene.Mutation):
             else:
                 raise GraphQLError('Incorrect old password.')
         user.save()
+        if any(f is not None for f in (fn, ln, em)):
+            # the user's name and email show up in all of their bills
+            bids = sharding.bill_ids(user)
+            touch_bills(bids)
+            snapshots.invalidate_ids(bids)
         return UpdateUser(user=user)
 
 
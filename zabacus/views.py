@@ -0,0 +1,169 @@
+from django.db import close_old_connections
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotModified
+from django.utils.http import parse_etags
+from graphene_django.views import GraphQLView as BaseGraphQLView, HttpError
+from zabacus import conf, encoding, profiling, routers
+from zabacus.bills import etags, sharding
+
+# GraphQL endpoint.
+#
+# Every mutation operation pins the request, and the user's following requests for the read-your-writes
+# window, to the primary before it runs (see zabacus/routers.py), whether or not it writes bills.
+#
+# Read queries over bills get an ETag (see zabacus/bills/etags.py). When the If-None-Match header of a
+# request still matches, the response is 304 Not Modified and the query is neither executed nor serialized.
+#
+# A POST whose JSON body is an array runs every operation in it within the one request (one pass through
+# the middleware and JWT authentication, shared per-request caches) and answers with the array of their
+# results, each carrying the `id` sent with the operation and its own `status`. Mutations run one at a
+# time in the order given; with GRAPHQL_BATCH['CONCURRENCY'] above 1, the queries between them run
+# concurrently on a thread pool.
+#
+# Responses are encoded and compressed as configured in GRAPHQL_RESPONSE (see zabacus/encoding.py).
+#
+# Operations of requests picked by GRAPHQL_PROFILING run under a profiler (see zabacus/profiling.py).
+#
+# Requests turned away by the rate limits of zabacus/ratelimit.py get status 429 and a Retry-After header.
+
+BATCH_SETTINGS = conf.module_settings('GRAPHQL_BATCH', {
+    'MAX_OPERATIONS': 20,
+    # threads running consecutive queries of a batch concurrently; 1 runs everything in order
+    'CONCURRENCY': 1,
+})
+
+_batch_pool = sharding.ProcessThreadPool(BATCH_SETTINGS['CONCURRENCY'], 'zabacus-batch')
+
+
+def _weak(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+class GraphQLView(BaseGraphQLView):
+    def is_batch_request(self, request):
+        return request.method == 'POST' and self.get_content_type(request) == 'application/json' \
+            and request.body.lstrip()[:1] == b'['
+
+    def get_etag(self, request):
+        if self.batch:
+            return None
+        try:
+            data = self.parse_body(request)
+            if self.graphiql and self.can_display_graphiql(request, data):
+                return None
+            query, variables, operation_name, _ = self.get_graphql_params(request, data)
+        except HttpError:
+            return None
+        return etags.query_etag(getattr(request, 'user', None), query, variables, operation_name)
+
+    def dispatch(self, request, *args, **kwargs):
+        request._profiling_mode = profiling.requested_mode(request)
+        return encoding.compress_response(request, self.dispatch_uncompressed(request, *args, **kwargs))
+
+    def dispatch_uncompressed(self, request, *args, **kwargs):
+        if self.is_batch_request(request):
+            return self.dispatch_batch(request)
+        etag = self.get_etag(request)
+        if etag is not None:
+            client_etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+            if '*' in client_etags or _weak(etag) in (_weak(e) for e in client_etags):
+                response = HttpResponseNotModified()
+                response['ETag'] = etag
+                return response
+        response = super().dispatch(request, *args, **kwargs)
+        if getattr(request, '_retry_after', None) is not None:
+            return self.rate_limited(request, response)
+        # failed results are not worth keeping: errors may be transient
+        if etag is not None and response.status_code == 200 and getattr(request, '_graphql_succeeded', False):
+            response['ETag'] = etag
+            response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    # `response` turned into 429 with Retry-After if an operation of `request` was rejected by the rate
+    # limits of zabacus/ratelimit.py
+    @staticmethod
+    def rate_limited(request, response):
+        retry_after = getattr(request, '_retry_after', None)
+        if retry_after is not None:
+            response.status_code = 429
+            response['Retry-After'] = str(retry_after)
+        return response
+
+    def dispatch_batch(self, request):
+        self.batch = True
+        try:
+            data = self.parse_body(request)
+            if len(data) > BATCH_SETTINGS['MAX_OPERATIONS']:
+                raise HttpError(HttpResponseBadRequest(
+                    'Batches are limited to {} operations.'.format(BATCH_SETTINGS['MAX_OPERATIONS'])))
+            if not all(isinstance(entry, dict) for entry in data):
+                raise HttpError(HttpResponseBadRequest('Every operation of a batch must be a JSON object.'))
+            responses = self.get_batch_responses(request, data)
+        except HttpError as e:
+            response = e.response
+            response['Content-Type'] = 'application/json'
+            response.content = self.json_encode(request, {'errors': [self.format_error(e)]})
+            return response
+        response = HttpResponse(
+            status=max(status for _, status in responses),
+            # pretty-printed results are str
+            content=b'[' + b','.join(r if isinstance(r, bytes) else r.encode() for r, _ in responses) + b']',
+            content_type='application/json',
+        )
+        return self.rate_limited(request, response)
+
+    # [(result, status code)] of the operations in `data`, in order
+    def get_batch_responses(self, request, data):
+        if BATCH_SETTINGS['CONCURRENCY'] <= 1:
+            return [self.get_response(request, entry) for entry in data]
+        responses = []
+        queries = []
+        for entry in data:
+            if etags.operation_type(entry.get('query'), entry.get('operationName')) == 'query':
+                queries.append(entry)
+                continue
+            responses.extend(self._run_concurrently(request, queries))
+            queries = []
+            responses.append(self.get_response(request, entry))
+        responses.extend(self._run_concurrently(request, queries))
+        return responses
+
+    def _run_concurrently(self, request, entries):
+        if len(entries) <= 1:
+            return [self.get_response(request, entry) for entry in entries]
+        state = routers.request_state(), sharding.request_memberships()
+
+        def run(entry):
+            # work in the request's context: same replica routing, same memoized memberships
+            routers.set_request_state(state[0])
+            sharding.set_request_memberships(state[1])
+            try:
+                return self.get_response(request, entry)
+            finally:
+                routers.set_request_state((False, False))
+                sharding.set_request_memberships(None)
+                close_old_connections()
+
+        pool = _batch_pool.get()
+        return [f.result() for f in [pool.submit(run, entry) for entry in entries]]
+
+    def get_response(self, request, data, show_graphiql=False):
+        mode = getattr(request, '_profiling_mode', None)
+        if mode is None:
+            return super().get_response(request, data, show_graphiql)
+        query, _, operation_name, _ = self.get_graphql_params(request, data)
+        if not query:
+            return super().get_response(request, data, show_graphiql)
+        with profiling.profile(mode, profiling.operation_label(query, operation_name)):
+            return super().get_response(request, data, show_graphiql)
+
+    def json_encode(self, request, d, pretty=False):
+        if pretty or self.pretty or request.GET.get('pretty'):
+            return super().json_encode(request, d, pretty)
+        return encoding.encode(d)
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, *args, **kwargs):
+        if etags.operation_type(query, operation_name) == 'mutation':
+            routers.record_write(getattr(request, 'user', None))
+        result = super().execute_graphql_request(request, data, query, variables, operation_name, *args, **kwargs)
+        request._graphql_succeeded = result is not None and not result.errors
+        return result
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zabacus.settings')
 
 application = get_wsgi_application()
+
+from zabacus import startup  # noqa: E402 (needs Django set up)
+
+# build the schema and load the views now rather than on the first request (once for all workers when
+# gunicorn preloads the application)
+startup.warm_up()